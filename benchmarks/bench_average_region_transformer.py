@@ -0,0 +1,64 @@
+# Benchmarks the per-call latency of AverageRegionTransformer.transform
+# (sparse averaging matrix) against the former per-region loop.
+#
+# Usage: python benchmarks/bench_average_region_transformer.py
+
+# Author: Lukas Snoek [lukassnoek.github.io]
+# Contact: lukassnoek@gmail.com
+# License: 3 clause BSD
+
+from __future__ import division, print_function, absolute_import
+import timeit
+import numpy as np
+from skbold.feature_extraction import AverageRegionTransformer
+
+N_SAMPLES = 500
+N_FEATURES = 200000
+N_REPEATS = 5
+
+
+def loop_transform(X, rois, orig_mask):
+    """ Reference implementation: one (boolean) mean per region. """
+
+    X_new = np.zeros((X.shape[0], len(rois)))
+    for i, roi in enumerate(rois):
+        X_new[:, i] = X[:, roi.ravel()[orig_mask]].mean(axis=1)
+
+    return X_new
+
+
+def main():
+
+    data_shape = (91, 109, 91)
+    rng = np.random.RandomState(42)
+    orig_mask = np.sort(rng.choice(np.prod(data_shape), N_FEATURES,
+                                   replace=False))
+    X = rng.randn(N_SAMPLES, N_FEATURES)
+
+    start = timeit.default_timer()
+    art = AverageRegionTransformer(atlas='HarvardOxford-All',
+                                   orig_mask=orig_mask, data_shape=data_shape,
+                                   ref_space='mni')
+    print('Init (incl. loading atlas): %.3f sec.' %
+          (timeit.default_timer() - start))
+
+    n_regions = art.averaging_matrix.shape[1]
+    print('X: %i samples x %i voxels, %i regions' % (N_SAMPLES, N_FEATURES,
+                                                      n_regions))
+
+    sparse_time = min(timeit.repeat(lambda: art.transform(X), number=1,
+                                    repeat=N_REPEATS))
+    print('Sparse matmul: %.4f sec. per call' % sparse_time)
+
+    from skbold.utils import load_roi_mask
+    rois, _ = load_roi_mask('all', atlas_name='HarvardOxford-All')
+    loop_time = min(timeit.repeat(lambda: loop_transform(X, rois, orig_mask),
+                                  number=1, repeat=N_REPEATS))
+    print('Region loop: %.4f sec. per call (%.1fx slower)' %
+          (loop_time, loop_time / sparse_time))
+
+    assert(np.allclose(art.transform(X), loop_transform(X, rois, orig_mask)))
+
+
+if __name__ == '__main__':
+    main()
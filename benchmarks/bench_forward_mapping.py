@@ -0,0 +1,57 @@
+# Benchmarks the (matrix-free) forward mapping of MvpResults against the
+# former implementation with the full voxel-by-voxel covariance matrix,
+# for an increasing number of (selected) voxels.
+#
+# Usage: python benchmarks/bench_forward_mapping.py
+
+# Author: Lukas Snoek [lukassnoek.github.io]
+# Contact: lukassnoek@gmail.com
+# License: 3 clause BSD
+
+from __future__ import division, print_function, absolute_import
+import timeit
+import numpy as np
+from skbold.postproc.mvp_results import _forward_mapping
+
+N_SAMPLES = 200
+N_VOXELS = [1000, 2000, 4000, 8000, 50000]
+MAX_COV_VOXELS = 8000  # larger covariance matrices do not fit in memory
+N_REPEATS = 3
+
+
+def cov_forward_mapping(X, W):
+    """ Reference implementation: full covariance matrix. """
+    return np.cov(X.T).dot(W)
+
+
+def main():
+
+    rng = np.random.RandomState(42)
+    print('%8s %16s %12s %16s %12s' % ('n_vox', 'matrix-free (s)',
+                                       'memory (MB)', 'covariance (s)',
+                                       'memory (MB)'))
+
+    for n_vox in N_VOXELS:
+        X = rng.randn(N_SAMPLES, n_vox)
+        W = rng.randn(n_vox)
+
+        free_time = min(timeit.repeat(lambda: _forward_mapping(X, W),
+                                      number=1, repeat=N_REPEATS))
+        free_mem = N_SAMPLES * 8 / 1e6  # only X.dot(W) is extra
+
+        if n_vox <= MAX_COV_VOXELS:
+            cov_time = min(timeit.repeat(lambda: cov_forward_mapping(X, W),
+                                         number=1, repeat=N_REPEATS))
+            assert(np.allclose(_forward_mapping(X, W),
+                               cov_forward_mapping(X, W)))
+            cov_time = '%16.4f' % cov_time
+        else:
+            cov_time = '%16s' % '-'
+
+        cov_mem = n_vox ** 2 * 8 / 1e6
+        print('%8i %16.4f %12.3f %s %12.1f' % (n_vox, free_time, free_mem,
+                                                cov_time, cov_mem))
+
+
+if __name__ == '__main__':
+    main()
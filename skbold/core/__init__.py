@@ -39,21 +39,19 @@ the main page of ReadTheDocs_.
 
 Also, functional-to-standard (i.e. ``convert2mni``) and standard-to-functional
 (i.e. ``convert2epi``) warp-functions for niftis are defined here, because
-they have caused circular import errors in the past.
+they have caused circular import errors in the past. Their outputs can be
+cached (content-addressed) with a ``WarpCache``. When FSL is not installed,
+these functions use skbold's own resampler (``RegTransform``), which applies
+FSL's registration-files in-process (and can also transform images in memory).
 
 """
-import os
 from .mvp import Mvp
+from .cache import WarpCache
+from .resample import RegTransform
 from .convert_to_epi import convert2epi
 from .convert_to_mni import convert2mni
 from .mvp_between import MvpBetween
 from .mvp_within import MvpWithin
 
-try:
-    os.environ['FSLDIR']
-except KeyError:
-    print("Could not find FSL on this system (or FSLDIR is not set); "
-          "Transforming/warping files from EPI to MNI and vice versa "
-          "is not possible!")
-
-__all__ = ['Mvp', 'convert2epi', 'convert2mni', 'MvpBetween', 'MvpWithin']
+__all__ = ['Mvp', 'convert2epi', 'convert2mni', 'MvpBetween', 'MvpWithin',
+           'WarpCache', 'RegTransform']
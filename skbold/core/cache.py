@@ -0,0 +1,215 @@
+# Content-addressed (on-disk) cache for transformed niftis, such that
+# expensive FSL warps are only performed when their inputs change.
+
+# Author: Lukas Snoek [lukassnoek.github.io]
+# Contact: lukassnoek@gmail.com
+# License: 3 clause BSD
+
+from __future__ import division, print_function, absolute_import
+import os
+import os.path as op
+import shutil
+import hashlib
+from glob import glob
+
+
+def get_cache_dir(subdir=None):
+    """ Returns skbold's cache-directory (or None if not configured).
+
+    The cache-directory is set by the environment variable
+    ``SKBOLD_CACHE_DIR``.
+
+    Parameters
+    ----------
+    subdir : str
+        Subdirectory of the cache-directory (e.g. 'warps').
+
+    Returns
+    -------
+    cache_dir : str or None
+        Absolute path to the cache-directory or None when no cache-directory
+        has been set.
+    """
+
+    cache_dir = os.environ.get('SKBOLD_CACHE_DIR', None)
+
+    if cache_dir is None:
+        return None
+
+    cache_dir = op.abspath(op.expanduser(cache_dir))
+    if subdir is not None:
+        cache_dir = op.join(cache_dir, subdir)
+
+    return cache_dir
+
+
+def hash_file(path, block_size=2 ** 20):
+    """ Computes the sha1-hash of the contents of a file. """
+
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha1.update(block)
+
+    return sha1.hexdigest()
+
+
+class WarpCache(object):
+    """
+    Content-addressed cache for transformed (warped) niftis.
+
+    Transformed files are stored under a key which is a hash of the contents
+    of the input-file, the contents of the registration files (reference
+    image, matrix and/or warp), and the transformation options (e.g. the
+    interpolation). As such, changed inputs are always re-transformed and
+    unchanged inputs are never transformed twice. When the total size of
+    the cache exceeds ``max_size``, the least recently used files are removed.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Absolute path to the cache-directory. If None, the 'warps' subdirectory
+        of the ``SKBOLD_CACHE_DIR`` environment variable is used.
+    max_size : int or float
+        Maximum size of the cache (in bytes). Default: 2 GB.
+    """
+
+    def __init__(self, cache_dir=None, max_size=2e9):
+
+        if cache_dir is None:
+            cache_dir = get_cache_dir('warps')
+
+        if cache_dir is None:
+            raise ValueError("No cache_dir given and SKBOLD_CACHE_DIR "
+                             "is not set!")
+
+        if not op.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self._hashes = {}
+
+    def key(self, in_file, reg_files, **options):
+        """ Computes the cache-key for a transformation.
+
+        Parameters
+        ----------
+        in_file : str
+            Absolute path to the to-be-transformed file.
+        reg_files : list
+            Absolute paths to the files used for the transformation (e.g.
+            reference image, affine matrix, warp-field).
+        **options : keyword arguments
+            Transformation options (e.g. ``interpolation='trilinear'``).
+
+        Returns
+        -------
+        key : str
+            Hexadecimal sha1-hash.
+        """
+
+        sha1 = hashlib.sha1()
+        sha1.update(hash_file(in_file).encode('utf-8'))
+
+        for reg_file in reg_files:
+            sha1.update(self._hash_reg_file(reg_file).encode('utf-8'))
+
+        for name in sorted(options.keys()):
+            sha1.update(('%s=%s' % (name, options[name])).encode('utf-8'))
+
+        return sha1.hexdigest()
+
+    def get(self, key, out_file):
+        """ Copies a cached file to out_file (if it exists).
+
+        Returns
+        -------
+        hit : bool
+            Whether the key was in the cache.
+        """
+
+        cached = self._path(key)
+
+        if not op.isfile(cached):
+            return False
+
+        # Update modification-time, which is used for LRU-eviction
+        os.utime(cached, None)
+
+        if op.abspath(out_file) != cached:
+            shutil.copyfile(cached, out_file)
+
+        return True
+
+    def put(self, key, out_file):
+        """ Stores a transformed file in the cache. """
+
+        cached = self._path(key)
+        tmp = cached + '.tmp%i' % os.getpid()
+        shutil.copyfile(out_file, tmp)
+        os.rename(tmp, cached)  # atomic; avoids half-written cache entries
+        self._evict()
+
+    def clear(self):
+        """ Removes all files from the cache. """
+        _ = [os.remove(f) for f in self._entries()]
+
+    def _path(self, key):
+        return op.join(self.cache_dir, key + '.nii.gz')
+
+    def _entries(self):
+        return glob(op.join(self.cache_dir, '*.nii.gz'))
+
+    def _hash_reg_file(self, path):
+        """ Hashes registration files, which are reused for many inputs. """
+
+        stat = os.stat(path)
+        idf = (path, stat.st_mtime, stat.st_size)
+
+        if idf not in self._hashes:
+            self._hashes[idf] = hash_file(path)
+
+        return self._hashes[idf]
+
+    def _evict(self):
+        """ Removes least recently used files until size <= max_size. """
+
+        entries = [(os.stat(f).st_mtime, os.stat(f).st_size, f)
+                   for f in self._entries()]
+        total = sum(e[1] for e in entries)
+
+        for mtime, size, f in sorted(entries):
+
+            if total <= self.max_size:
+                break
+
+            os.remove(f)
+            total -= size
+
+
+def check_warp_cache(cache):
+    """ Converts the cache-argument of convert2epi/convert2mni to a WarpCache.
+
+    Parameters
+    ----------
+    cache : None, bool, str, or WarpCache
+        If None, a cache is used only when ``SKBOLD_CACHE_DIR`` is set.
+        If False, no cache is used. If a str, it is used as cache-directory.
+
+    Returns
+    -------
+    cache : WarpCache or None
+    """
+
+    if cache is None:
+        cache_dir = get_cache_dir('warps')
+        return None if cache_dir is None else WarpCache(cache_dir)
+    elif cache is False:
+        return None
+    elif cache is True:
+        return WarpCache()
+    elif isinstance(cache, WarpCache):
+        return cache
+    else:
+        return WarpCache(cache)
@@ -1,5 +1,5 @@
 # Function to convert a nifti in MNI space to Epi-space. Only works with
-# reg_dir as created by FSL.
+# reg_dir as created by FSL (but does not need FSL itself).
 
 # Author: Lukas Snoek [lukassnoek.github.io]
 # Contact: lukassnoek@gmail.com
@@ -9,16 +9,21 @@ from __future__ import division, print_function, absolute_import
 import os
 import os.path as op
 import subprocess
+from sklearn.externals.joblib import Parallel, delayed
+import nibabel as nib
+from .cache import check_warp_cache
+from .resample import RegTransform
 
 
 def convert2epi(file2transform, reg_dir, out_dir=None,
                 interpolation='trilinear', suffix='epi',
-                overwrite=False):
+                overwrite=False, cache=None, n_jobs=1, engine=None):
     """
     Transforms a nifti from mni152 (2mm) to EPI (native) format.
     Assuming that reg_dir is a directory with transformation-files (warps)
-    including standard2example_func warps, this function uses nipype's
-    fsl interface to flirt a nifti to EPI format.
+    including standard2example_func warps, this function uses FSL's flirt
+    (or applywarp) or skbold's own resampler to transform a nifti to EPI
+    format.
 
     Parameters
     ----------
@@ -35,20 +40,45 @@ def convert2epi(file2transform, reg_dir, out_dir=None,
         What to suffix the transformed file with (default : 'epi')
     overwrite : bool
         Whether to overwrite existing transformed files
+    cache : None, bool, str, or WarpCache
+        Content-addressed cache of transformed files (see
+        ``skbold.core.cache.WarpCache``). If None (default), the cache is
+        only used when the environment variable ``SKBOLD_CACHE_DIR`` is set.
+        If a str, it is used as cache-directory; if False, no cache is used.
+        When a cache is used, existing out-files are only reused when the
+        input-file, registration-files, and interpolation are unchanged.
+        The cache is not used when the out-file is the input-file itself
+        (i.e., suffix and out_dir are None).
+    n_jobs : int
+        Maximum number of transformations (FSL processes) that run in
+        parallel (-1 means all cores). Default: 1.
+    engine : str
+        Either 'fsl' (transform with FSL's command-line tools) or 'numpy'
+        (transform in-process with ``skbold.core.resample.RegTransform``,
+        which does not need FSL). If None (default), 'fsl' is used when FSL
+        is installed and 'numpy' otherwise.
 
     Returns
     -------
     out_all : list
-        Absolute path(s) to newly transformed file(s).
+        Absolute path(s) to newly transformed file(s), in the same order as
+        file2transform.
+
+    Raises
+    ------
+    OSError
+        If engine is 'fsl' but FSL is not installed or if one or more
+        transformations failed.
     """
 
-    if not 'FSLDIR' in os.environ.keys():
-        raise OSError("FSL is not installed! Cannot transform images!")
+    engine = _check_engine(engine)
 
     if not isinstance(file2transform, list):
         file2transform = [file2transform]
 
+    cache = check_warp_cache(cache)
     out_all = []
+    to_run = []
 
     for f in file2transform:
 
@@ -62,8 +92,14 @@ def convert2epi(file2transform, reg_dir, out_dir=None,
 
         out_file = op.join(out_dir, out_name)
 
-        if op.exists(out_file) and not overwrite:
-            out_all.append(out_file)
+        out_all.append(out_file)
+
+        # The cache-key depends on the contents of f, so it cannot be used
+        # when f would be overwritten by its transformed version
+        use_cache = cache is not None and \
+            op.abspath(out_file) != op.abspath(f)
+
+        if not use_cache and op.exists(out_file) and not overwrite:
             continue
 
         if not op.isdir(out_dir):
@@ -76,17 +112,112 @@ def convert2epi(file2transform, reg_dir, out_dir=None,
         if op.isfile(warp_file):
             cmd = 'applywarp -i %s -r %s -o %s -w %s --interp=%s' % \
                   (f, ref_file, out_file, warp_file, interpolation)
+            reg_files = [ref_file, warp_file]
         else:
             cmd = ('flirt -in %s -ref %s -out %s -applyxfm -init %s '
                    '-interp %s' % (f, ref_file, out_file, matrix_file,
                                    interpolation))
+            reg_files = [ref_file, matrix_file]
 
-        status = subprocess.call(cmd, shell=True)
+        key = None
+        if use_cache:
+            tool = cmd.split(' ')[0] if engine == 'fsl' else engine
+            key = cache.key(f, reg_files, tool=tool,
+                            interpolation=interpolation)
+            if not overwrite and cache.get(key, out_file):
+                continue
 
-        out_all.append(out_file)
+        to_run.append((f, cmd, out_file, key))
         out_name = None
 
+    if engine == 'fsl':
+        _run_warps(to_run, cache=cache, n_jobs=n_jobs)
+    elif to_run:
+        transform = RegTransform(reg_dir, direction='epi')
+        _run_resample(to_run, transform, interpolation, cache=cache)
+
     if len(out_all) == 1:
         out_all = out_all[0]
 
     return out_all
+
+
+def _check_engine(engine):
+    """ Checks (and sets the default of) the transformation engine. """
+
+    fsl = 'FSLDIR' in os.environ.keys()
+
+    if engine is None:
+        engine = 'fsl' if fsl else 'numpy'
+
+    if engine not in ['fsl', 'numpy']:
+        raise ValueError("Engine should be 'fsl' or 'numpy', not '%s'."
+                         % engine)
+
+    if engine == 'fsl' and not fsl:
+        raise OSError("FSL is not installed! Cannot transform images with "
+                      "engine='fsl' (use engine='numpy' instead)!")
+
+    return engine
+
+
+def _run_resample(to_run, transform, interpolation, cache=None):
+    """ Transforms files in-process with a RegTransform.
+
+    Parameters
+    ----------
+    to_run : list
+        List of (in_file, cmd, out_file, cache_key) tuples (cmd is ignored).
+    transform : RegTransform
+        Transform to apply; its (cached) coordinates are shared by all files.
+    interpolation : str
+        Interpolation (e.g. 'trilinear' or 'nearestneighbour').
+    cache : WarpCache
+        If not None, transformed files with a cache-key are added to the
+        cache.
+    """
+
+    for f, cmd, out_file, key in to_run:
+        img = transform.resample(f, interpolation=interpolation)
+        nib.save(img, out_file)
+
+        if cache is not None and key is not None:
+            cache.put(key, out_file)
+
+
+def _run_warps(to_run, cache=None, n_jobs=1):
+    """ Runs warp-commands (in parallel) and checks their exit-status.
+
+    Parameters
+    ----------
+    to_run : list
+        List of (in_file, cmd, out_file, cache_key) tuples.
+    cache : WarpCache
+        If not None, successfully transformed files with a cache-key are
+        added to the cache.
+    n_jobs : int
+        Maximum number of commands that run in parallel.
+    """
+
+    cmds = [job[1] for job in to_run]
+
+    if n_jobs == 1 or len(cmds) < 2:
+        statuses = [subprocess.call(cmd, shell=True) for cmd in cmds]
+    else:
+        # The work is done in the (FSL) subprocesses, so threads suffice
+        # to keep n_jobs of them running at the same time
+        statuses = Parallel(n_jobs=n_jobs, backend='threading')(
+            delayed(subprocess.call)(cmd, shell=True) for cmd in cmds)
+
+    failed = []
+    for (f, cmd, out_file, key), status in zip(to_run, statuses):
+
+        if status != 0:
+            failed.append('%s (exit status %i)' % (f, status))
+        elif cache is not None and key is not None:
+            cache.put(key, out_file)
+
+    if failed:
+        msg = "Transformation failed for %i file(s): %s" % \
+              (len(failed), ', '.join(failed))
+        raise OSError(msg)
@@ -1,24 +1,28 @@
 # Function to convert Nifti's to mni space. Only works with reg_dirs as
-# created by FSL.
+# created by FSL (but does not need FSL itself).
 
 # Author: Lukas Snoek [lukassnoek.github.io]
 # Contact: lukassnoek@gmail.com
 # License: 3 clause BSD
 
 from __future__ import division, print_function, absolute_import
-import subprocess
 import os
 import os.path as op
+from .cache import check_warp_cache
+from .convert_to_epi import _check_engine, _run_resample, _run_warps
+from .resample import RegTransform
 
 
 def convert2mni(file2transform, reg_dir, out_dir=None,
                 interpolation='trilinear', suffix=None,
-                overwrite=False, apply_warp=True):
+                overwrite=False, apply_warp=True, cache=None, n_jobs=1,
+                engine=None):
     """
     Transforms a nifti to mni152 (2mm) format.
     Assuming that reg_dir is a directory with transformation-files (warps)
-    including example_func2standard warps, this function uses nipype's
-    fsl interface to flirt a nifti to mni format.
+    including example_func2standard warps, this function uses FSL's flirt
+    (or applywarp) or skbold's own resampler to transform a nifti to mni
+    format.
 
     Parameters
     ----------
@@ -38,19 +42,45 @@ def convert2mni(file2transform, reg_dir, out_dir=None,
         Whether to overwrite already existing transformed file(s)
     apply_warp : bool
         Whether to use the non-linear warp transform (if available).
+    cache : None, bool, str, or WarpCache
+        Content-addressed cache of transformed files (see
+        ``skbold.core.cache.WarpCache``). If None (default), the cache is
+        only used when the environment variable ``SKBOLD_CACHE_DIR`` is set.
+        If a str, it is used as cache-directory; if False, no cache is used.
+        When a cache is used, existing out-files are only reused when the
+        input-file, registration-files, and interpolation are unchanged.
+        The cache is not used when the out-file is the input-file itself
+        (i.e., suffix and out_dir are None).
+    n_jobs : int
+        Maximum number of transformations (FSL processes) that run in
+        parallel (-1 means all cores). Default: 1.
+    engine : str
+        Either 'fsl' (transform with FSL's command-line tools) or 'numpy'
+        (transform in-process with ``skbold.core.resample.RegTransform``,
+        which does not need FSL). If None (default), 'fsl' is used when FSL
+        is installed and 'numpy' otherwise.
+
     Returns
     -------
     out_all : list
-        Absolute path(s) to newly transformed file(s).
+        Absolute path(s) to newly transformed file(s), in the same order as
+        file2transform.
+
+    Raises
+    ------
+    OSError
+        If engine is 'fsl' but FSL is not installed or if one or more
+        transformations failed.
     """
 
-    if not 'FSLDIR' in os.environ.keys():
-        raise OSError("FSL is not installed! Cannot transform images!")
+    engine = _check_engine(engine)
 
     if type(file2transform) == str:
         file2transform = [file2transform]
 
+    cache = check_warp_cache(cache)
     out_all = []
+    to_run = []
     for f in file2transform:
 
         if out_dir is None:
@@ -63,8 +93,14 @@ def convert2mni(file2transform, reg_dir, out_dir=None,
 
         out_file = op.join(out_dir, out_name)
 
-        if op.exists(out_file) and not overwrite:
-            out_all.append(out_file)
+        out_all.append(out_file)
+
+        # The cache-key depends on the contents of f, so it cannot be used
+        # when f would be overwritten by its transformed version
+        use_cache = cache is not None and \
+            op.abspath(out_file) != op.abspath(f)
+
+        if not use_cache and op.exists(out_file) and not overwrite:
             continue
 
         if not op.isdir(out_dir):
@@ -78,16 +114,31 @@ def convert2mni(file2transform, reg_dir, out_dir=None,
         if op.isfile(warp_file) and apply_warp:
             cmd = 'applywarp -i %s -r %s -o %s -w %s --interp=%s' % \
                   (f, ref_file, out_file, warp_file, interpolation)
+            reg_files = [ref_file, warp_file]
         else:
             cmd = ('flirt -in %s -ref %s -out %s -applyxfm -init %s '
                    '-interp %s' % (f, ref_file, out_file, matrix_file,
                                    interpolation))
+            reg_files = [ref_file, matrix_file]
 
-        status = subprocess.call(cmd, shell=True)
+        key = None
+        if use_cache:
+            tool = cmd.split(' ')[0] if engine == 'fsl' else engine
+            key = cache.key(f, reg_files, tool=tool,
+                            interpolation=interpolation)
+            if not overwrite and cache.get(key, out_file):
+                continue
 
-        out_all.append(out_file)
+        to_run.append((f, cmd, out_file, key))
         out_name = None
 
+    if engine == 'fsl':
+        _run_warps(to_run, cache=cache, n_jobs=n_jobs)
+    elif to_run:
+        transform = RegTransform(reg_dir, direction='mni',
+                                 apply_warp=apply_warp)
+        _run_resample(to_run, transform, interpolation, cache=cache)
+
     if len(out_all) == 1:
         out_all = out_all[0]
 
@@ -8,6 +8,7 @@
 from __future__ import print_function, absolute_import, division
 
 import os
+import warnings
 import nibabel as nib
 import os.path as op
 import numpy as np
@@ -15,6 +16,11 @@ from glob import glob
 from copy import copy
 from sklearn.externals import joblib
 
+# Files written (to a common prefix) by each backend of Mvp.write
+BACKEND_FILES = {'joblib': ['.jl'],
+                 'numpy': ['_header.jl', '_data.npy'],
+                 'hdf5': ['_header.jl', '.h5']}
+
 
 class Mvp(object):
     """
@@ -85,7 +91,7 @@ class Mvp(object):
         self.X = X
         self.y = y
 
-    def write(self, path=None, name='mvp', backend='joblib'):
+    def write(self, path=None, name='mvp', backend='joblib', chunks=None):
         """ Writes the Mvp-object to disk.
 
         Parameters
@@ -96,11 +102,22 @@ class Mvp(object):
             Name of to-be-written file.
         backend : str
             Which format will be used to save the files. Default is 'joblib',
-            which conveniently saves the Mvp-object as one file. Alternatively,
-            and if the Mvp-object is too large to be save with joblib, a
-            data-header format will be used, in which the data (``X``) will be
-            saved using Numpy and the meta-data (everythin except ``X``) will
-            be saved using joblib.
+            which conveniently saves the Mvp-object as one (compressed) file.
+            Alternatively, and if the Mvp-object is too large to be saved with
+            joblib, a data-header format ('numpy') will be used, in which the
+            data (``X``) will be saved as an uncompressed Numpy-file
+            (``name_data.npy``) and the meta-data (everything except ``X``,
+            e.g. ``voxel_idx``, ``featureset_id``, ``affine``, ``data_shape``)
+            will be saved in a joblib-sidecar (``name_header.jl``). The data
+            of the 'numpy' format can be memory-mapped when loading it again
+            with ``Mvp.load``. Lastly, the 'hdf5' backend (which needs h5py)
+            stores ``X`` in a chunked HDF5-file (``name.h5``), in tiles of
+            samples by features, with the same joblib-sidecar. This allows
+            ``Mvp.load`` to read only a subset of the features (e.g. a single
+            feature-set or range of voxels) from disk.
+        chunks : tuple
+            Shape of the (samples x features) tiles used by the 'hdf5' backend.
+            Default: (64, 4096), clipped to the shape of ``X``.
         """
         if path is None:
             path = os.getcwd()
@@ -112,17 +129,148 @@ class Mvp(object):
         if backend == 'joblib':
             try:
                 joblib.dump(self, fn + '.jl', compress=3)
-            except:
-                msg = "Array too large to save with joblib; using Numpy ... "
-                print(msg)
+            except (MemoryError, OverflowError, SystemError) as e:
+                msg = ("Array too large to save with joblib (%r); "
+                       "using the 'numpy' backend instead." % e)
+                warnings.warn(msg)
                 backend = 'numpy'
-                to_remove = glob(op.join(path, '*npy.z'))
+                to_remove = glob(fn + '.jl*')
                 _ = [os.remove(f) for f in to_remove]
 
         if backend == 'numpy':
+            # np.save writes the array uncompressed with an aligned header,
+            # which allows for memory-mapping it later on
             np.save(fn + '_data.npy', self.X)
+            X = self.X
+            self.X = None
+            try:
+                joblib.dump(self, fn + '_header.jl', compress=3)
+            finally:
+                self.X = X
+        elif backend == 'hdf5':
+            _write_hdf5(fn + '.h5', self, chunks=chunks)
+            X = self.X
             self.X = None
-            joblib.dump(self, fn + '_header.jl', compress=3)
+            try:
+                joblib.dump(self, fn + '_header.jl', compress=3)
+            finally:
+                self.X = X
+        elif backend != 'joblib':
+            msg = ("Backend should be 'joblib', 'numpy', or 'hdf5', not '%s'."
+                   % backend)
+            raise ValueError(msg)
+
+        # Files of other backends (from an earlier write with the same name)
+        # would otherwise be loaded instead of the ones just written
+        _remove_other_backends(fn, backend)
+
+    @staticmethod
+    def load(path, mmap_mode=None, featureset_id=None, voxel_range=None):
+        """ Loads an Mvp-object written to disk with ``write``.
+
+        Parameters
+        ----------
+        path : str
+            Absolute path to the file written by ``write``. For the 'joblib'
+            backend, this is the .jl file; for the 'numpy' and 'hdf5'
+            backends, this can be the header-file (``name_header.jl``), the
+            data-file (``name_data.npy`` or ``name.h5``), or the common
+            prefix (``path/name``). If a data-file is given, its backend is
+            used.
+        mmap_mode : str
+            Memory-map mode (e.g. 'r' or 'r+', see ``numpy.load``) for the
+            data of the 'numpy' backend. If not None, ``X`` becomes a
+            ``np.memmap`` which is read lazily from disk (and which can be
+            shared across processes without copying). Ignored for files
+            written with the 'joblib' or 'hdf5' backend.
+        featureset_id : int or list
+            If not None, only load the features of this/these feature-set(s).
+            Attributes such as ``data_shape`` and ``data_name`` are updated
+            accordingly and the feature-set ids are renumbered from 0.
+        voxel_range : tuple
+            If not None, only load features whose ``voxel_idx`` lies within
+            [start, stop). Can be combined with ``featureset_id``.
+
+        For the 'hdf5' backend, only the tiles overlapping with the selected
+        features are read from disk.
+
+        Returns
+        -------
+        mvp : Mvp-object
+            The loaded Mvp-object (or subclass thereof).
+        """
+
+        backend = None
+        for suffix in ['_header.jl', '_data.npy', '.h5']:
+            if path.endswith(suffix):
+                path = path[:-len(suffix)]
+                backend = {'_data.npy': 'numpy', '.h5': 'hdf5'}.get(suffix)
+
+        header, data = path + '_header.jl', path + '_data.npy'
+        select = featureset_id is not None or voxel_range is not None
+
+        if op.isfile(header) and op.isfile(path + '.h5') and \
+                backend != 'numpy':
+            mvp = joblib.load(header)
+            col_idx = None
+            if select:
+                col_idx = mvp._get_feature_idx(featureset_id, voxel_range)
+            mvp.X = _read_hdf5_columns(path + '.h5', col_idx)
+        elif op.isfile(header) and op.isfile(data) and backend != 'hdf5':
+            mvp = joblib.load(header)
+            mvp.X = np.load(data, mmap_mode=mmap_mode)
+            if select:
+                col_idx = mvp._get_feature_idx(featureset_id, voxel_range)
+                mvp.X = mvp.X[:, col_idx]
+        elif op.isfile(path) or op.isfile(path + '.jl'):
+            mvp = joblib.load(path if op.isfile(path) else path + '.jl')
+            if select:
+                col_idx = mvp._get_feature_idx(featureset_id, voxel_range)
+                mvp.X = mvp.X[:, col_idx]
+        else:
+            raise IOError("Could not find an Mvp-file at '%s'." % path)
+
+        if select:
+            mvp._select_features(col_idx)
+
+        return mvp
+
+    def _get_feature_idx(self, featureset_id=None, voxel_range=None):
+        """ Returns the (sorted) column-indices of a subset of features. """
+
+        idx = np.ones(self.featureset_id.size, dtype=bool)
+
+        if featureset_id is not None:
+            idx &= np.in1d(self.featureset_id, featureset_id)
+
+        if voxel_range is not None:
+            start, stop = voxel_range
+            idx &= (self.voxel_idx >= start) & (self.voxel_idx < stop)
+
+        if idx.sum() == 0:
+            msg = ("Found no features for featureset_id=%r and "
+                   "voxel_range=%r." % (featureset_id, voxel_range))
+            raise ValueError(msg)
+
+        return np.where(idx)[0]
+
+    def _select_features(self, col_idx):
+        """ Updates the feature meta-data after selecting columns of X. """
+
+        fids = np.unique(self.featureset_id)
+        featureset_id = self.featureset_id[col_idx]
+        kept = np.unique(featureset_id)
+
+        # Feature-set specific attributes are lists (in MvpBetween)
+        for attr in ['data_shape', 'data_name', 'affine', 'fs_masks']:
+            value = getattr(self, attr, None)
+            if isinstance(value, list) and len(value) == fids.size:
+                value = [value[i] for i in np.searchsorted(fids, kept)]
+                setattr(self, attr, value)
+
+        self.voxel_idx = self.voxel_idx[col_idx]
+        self.featureset_id = np.searchsorted(kept, featureset_id).astype(
+            self.featureset_id.dtype)
 
     def update_mask(self, mask, threshold=0):
         # For external use
@@ -168,6 +316,98 @@ class Mvp(object):
         self.featureset_id = self.featureset_id[indices]
         self.voxel_idx = self.voxel_idx[indices]
 
+    def run_searchlight(self, out_dir, name='sl_results', n_folds=10, radius=5,
+                        mask=None, estimator=None, scoring='accuracy',
+                        n_jobs=1, verbose=0, alpha=None):
+        """ Runs a searchlight on the mvp object.
+
+        The searchlight works directly on X (per feature-set); the sphere
+        neighbourhoods are computed once for all radii (see
+        ``skbold.utils.get_neighbourhoods``) and the spheres are run in
+        parallel (see ``skbold.core.searchlight.searchlight``). For linear
+        classifiers, the fast estimators ('gnb', 'lda', or 'ridge') score
+        all spheres with batched linear algebra instead of fitting an
+        estimator per sphere (and fold).
+
+        Parameters
+        ----------
+        out_dir : str
+            Path to which to save the searchlight results
+        name : str
+            Name for the searchlight-results-file (nifti)
+        n_folds : int
+            The amount of folds in sklearn's StratifiedKFold.
+        radius : int/list
+            Radius (in mm) for the searchlight. If list, it iterates over
+            radii.
+        mask : str
+            Path to mask to select the sphere-centers (and voxels) with. If
+            nothing is listed, all voxels in the mvp are used.
+        estimator : sklearn estimator, pipeline, or str
+            Estimator to use in the classification process, or one of the
+            fast estimators ('gnb', 'lda', or 'ridge').
+        scoring : str or callable
+            Scoring-method (see sklearn's ``cross_val_score``).
+        n_jobs : int
+            Number of processes to run the spheres with (-1 means all cores).
+        verbose : int
+            Verbosity of the parallel computation.
+        alpha : float
+            Regularization of the fast estimators (shrinkage for 'lda',
+            penalty for 'ridge').
+
+        Returns
+        -------
+        imgs : list
+            List of Nifti1Images with the scores (per feature-set and radius).
+        """
+
+        from .searchlight import searchlight
+        from ..utils.neighbourhood import get_neighbourhoods
+        from sklearn.model_selection import StratifiedKFold
+
+        if isinstance(radius, (int, float)):
+            radius = [radius]
+
+        cv = StratifiedKFold(n_splits=n_folds)
+        fids = np.unique(self.featureset_id)
+        data_shape = self.data_shape if isinstance(self.data_shape, list) \
+            else [self.data_shape]
+        affine = self.affine if isinstance(self.affine, list) \
+            else [self.affine]
+        data_name = self.data_name if isinstance(self.data_name, list) \
+            else [self.data_name]
+
+        imgs = []
+        for pos_idx, fid in enumerate(fids):
+
+            cols = np.flatnonzero(self.featureset_id == fid)
+            shape = data_shape[pos_idx][:3]
+
+            if mask is not None:
+                mask_idx = (nib.load(mask).get_data() > 0).ravel()
+                cols = cols[mask_idx[self.voxel_idx[cols]]]
+
+            vox_idx = self.voxel_idx[cols]
+            nbhs = get_neighbourhoods(vox_idx, affine[pos_idx], shape, radius)
+
+            for r, nbh in zip(radius, nbhs):
+                scores = searchlight(self.X[:, cols], self.y, nbh,
+                                     estimator=estimator, cv=cv,
+                                     scoring=scoring, n_jobs=n_jobs,
+                                     verbose=verbose, alpha=alpha)
+
+                img = np.zeros(np.prod(shape))
+                img[vox_idx] = scores
+                img = nib.Nifti1Image(img.reshape(shape), affine[pos_idx])
+                imgs.append(img)
+
+                fn = name if len(fids) == 1 else \
+                    name + '_%s' % data_name[pos_idx]
+                nib.save(img, op.join(out_dir, fn + '_%gmm.nii.gz' % r))
+
+        return imgs
+
     def _update_mask_info(self, mask, threshold=None):
 
         thr = 0 if threshold is None else threshold
@@ -180,3 +420,67 @@ class Mvp(object):
         self.voxel_idx = self.voxel_idx[self.common_mask['idx']]
         self.affine = maskl.affine
         self.nifti_header = maskl.header
+
+
+def _remove_other_backends(fn, backend):
+    """ Removes the files of the other backends written to prefix fn. """
+
+    keep = BACKEND_FILES[backend]
+    other = set(ext for exts in BACKEND_FILES.values() for ext in exts)
+
+    for ext in other - set(keep):
+        if op.isfile(fn + ext):
+            os.remove(fn + ext)
+
+
+def _write_hdf5(fn, mvp, chunks=None):
+    """ Writes X (in tiles) and its feature-index to an HDF5-file. """
+
+    try:
+        import h5py
+    except ImportError:
+        raise ImportError("The 'hdf5' backend needs h5py; install it or "
+                          "use the 'numpy' backend instead.")
+
+    X = mvp.X
+    if chunks is None:
+        chunks = (64, 4096)
+
+    chunks = (min(chunks[0], X.shape[0]), min(chunks[1], X.shape[1]))
+
+    with h5py.File(fn, 'w') as f:
+        f.create_dataset('X', data=X, chunks=chunks)
+        f.create_dataset('featureset_id', data=mvp.featureset_id)
+        f.create_dataset('voxel_idx', data=mvp.voxel_idx)
+
+
+def _read_hdf5_columns(fn, col_idx):
+    """ Reads a subset of (sorted) columns of X from an HDF5-file.
+
+    Consecutive columns are read as slices, such that only the tiles that
+    overlap with the selected columns are touched.
+    """
+
+    try:
+        import h5py
+    except ImportError:
+        raise ImportError("Reading the 'hdf5' backend needs h5py!")
+
+    with h5py.File(fn, 'r') as f:
+        dset = f['X']
+
+        if col_idx is None:
+            return dset[...]
+
+        # Split column-indices into runs of consecutive columns
+        breaks = np.where(np.diff(col_idx) != 1)[0] + 1
+        runs = np.split(col_idx, breaks)
+
+        X = np.zeros((dset.shape[0], col_idx.size), dtype=dset.dtype)
+        start = 0
+        for run in runs:
+            stop = start + run.size
+            X[:, start:stop] = dset[:, run[0]:run[-1] + 1]
+            start = stop
+
+    return X
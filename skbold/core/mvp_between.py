@@ -13,8 +13,10 @@ from glob import glob
 from fnmatch import fnmatch
 from .mvp import Mvp
 from sklearn.preprocessing import Imputer
-from sklearn.preprocessing import StandardScaler, LabelEncoder
+from sklearn.preprocessing import LabelEncoder
+from sklearn.externals.joblib import Parallel, delayed
 from ..preproc import MajorityUndersampler, LabelBinarizer
+from ..utils.parallel import _effective_n_jobs
 
 
 class MvpBetween(Mvp):
@@ -69,6 +71,14 @@ class MvpBetween(Mvp):
         implies that this particular data-type has a custom mask.
     mask_threshold : int or float
         Minimum value to binarize the mask when it's probabilistic.
+    n_jobs : int
+        Number of workers used to load (decompress and mask) the 3D
+        data-types ('VBM', 'TBSS', 'Contrast*'). Negative values are
+        interpreted as in joblib (-1 means all cores). Default: 1 (serial).
+    backend : str
+        Either 'thread' (default) or 'process'. Threads write the masked
+        volumes directly into the preallocated data-array; processes send
+        back only the masked row (not the full volume) for each subject.
 
     Attributes
     ----------
@@ -105,7 +115,7 @@ class MvpBetween(Mvp):
     """
     def __init__(self, source, subject_idf='sub0???', remove_zeros=True,
                  X=None, y=None, mask=None, mask_thres=0,
-                 subject_list=None):
+                 subject_list=None, n_jobs=1, backend='thread'):
 
         super(MvpBetween, self).__init__(X=X, y=y, mask=mask,
                                          mask_thres=mask_thres)
@@ -126,12 +136,19 @@ class MvpBetween(Mvp):
         self.data_shape = []  # This could be an array
         self.data_name = []
         self.binarize_params = None
+        self.n_jobs = n_jobs
+        self.backend = backend
 
         if not isinstance(source, dict):
             msg = "Source must be a dictionary with type (e.g. 'VBM') " \
                   "path ('path/to/VBM_file.nii.gz) mappings!"
             raise TypeError(msg)
 
+        if backend not in ['thread', 'process']:
+            msg = "Backend should be 'thread' or 'process', not '%s'." % \
+                  backend
+            raise ValueError(msg)
+
     def create(self):
         """ Extracts and stores data as specified in source.
 
@@ -444,69 +461,6 @@ class MvpBetween(Mvp):
                                         enumerate(self.common_subjects)
                                         if idx[i]]
 
-    def run_searchlight(self, out_dir, name='sl_results', n_folds=10, radius=5,
-                        mask=None, estimator=None, **kwargs):
-        """ Runs a searchlight on the mvp object.
-
-        Parameters
-        ----------
-        out_dir : str
-            Path to which to save the searchlight results
-        name : str
-            Name for the searchlight-results-file (nifti)
-        n_folds : int
-            The amount of folds in sklearn's StratifiedKFold.
-        radius : int/list
-            Radius for the searchlight. If list, it iterates over radii.
-        mask : str
-            Path to mask to apply to mvp. If nothing is listed, it will use
-            the masks applied when the mvp was created.
-        estimator : sklearn estimator or pipeline
-            Estimator to use in the classification process.
-        **kwargs
-            Other keyword arguments for initializing nilearn's searchlight
-            object (see nilearn.github.io/decoding/searchlight.html).
-        """
-
-        # to do: implement import searchlight here (so skbold does not
-        # necessarily depend on nilearn
-
-        # NOT YET TESTED
-
-        # Import OLD version
-        from sklearn.model_selection import StratifiedKFold
-        from sklearn.svm import SVC
-        from sklearn.pipeline import Pipeline
-        from nilearn.decoding import SearchLight
-
-        nimgs = self.write_4D(return_nimg=True)
-        cv = StratifiedKFold(self.y, n_folds=n_folds)
-
-        if estimator is None:
-            estimator = Pipeline([('scaler', StandardScaler()),
-                                  ('svm', SVC(kernel='linear', C=1))])
-
-        if isinstance(radius, (int, float)):
-            radius = [radius]
-
-        for i, nimg in enumerate(nimgs):
-
-            if mask is None:
-                mask_tmp = self.fs_masks[i]
-                if mask_tmp is not None:
-                    mask_bool = mask_tmp['idx'].astype(int)
-                else:
-                    mask_bool = np.ones(nimg.shape, dtype=bool)
-
-            for r in radius:
-                sl = SearchLight(mask_img=mask_bool, radius=r, n_jobs=-1,
-                                 cv=cv, estimator=estimator,
-                                 scoring='accuracy', **kwargs)
-                sl.fit(nimg, y=self.y)
-                sl_nifti = nib.Nifti1Image(sl.scores_, nimg.affine)
-
-                nib.save(sl_nifti, op.join(out_dir, name + '_%imm.nii.gz' % r))
-
     def write_4D(self, path=None, return_nimg=False):
         """ Writes a 4D nifti (subs = 4th dimension) of X.
 
@@ -661,30 +615,57 @@ class MvpBetween(Mvp):
 
     def _load_3D(self, args):
 
-        data = []
-        for path in args['paths']:
-            tmp = nib.load(path)
-            tmp_data = tmp.get_data().ravel()
+        paths = args['paths']
+        tmp = nib.load(paths[0])
 
-            tmp_mask = self.fs_masks[-1]
-            if tmp_mask is None:
-                tmp_mask = {'idx': np.ones(tmp_data.size, dtype=bool),
-                            'shape': tmp.shape}
-            if tmp_mask['shape'] == tmp.shape:
-                tmp_data = tmp_data[tmp_mask['idx']]
-
-            data.append(tmp_data[np.newaxis, :])
+        tmp_mask = self.fs_masks[-1]
+        if tmp_mask is None:
+            tmp_mask = {'idx': np.ones(np.prod(tmp.shape), dtype=bool),
+                        'shape': tmp.shape}
+
+        mask_idx = tmp_mask['idx'] if tmp_mask['shape'] == tmp.shape else None
+
+        # The first volume determines the size (and dtype) of the data, such
+        # that all subjects can be written into a single preallocated array
+        first = _load_masked_volume(paths[0], mask_idx)
+        dtype = first.dtype
+        if not np.issubdtype(dtype, np.floating):
+            dtype = np.float64
+
+        data = np.zeros((len(paths), first.size), dtype=dtype)
+        data[0, :] = first
+        del first
+
+        n_jobs = _effective_n_jobs(self.n_jobs)
+        if n_jobs == 1 or len(paths) == 1:
+            for i, path in enumerate(paths[1:], 1):
+                data[i, :] = _load_masked_volume(path, mask_idx)
+        elif self.backend == 'thread':
+            # Threads share memory, so they can fill in data directly
+            Parallel(n_jobs=n_jobs, backend='threading')(
+                delayed(_fill_masked_volume)(data, i, path, mask_idx)
+                for i, path in enumerate(paths) if i > 0)
+        else:
+            # Processes return (only) masked rows, in batches, such that
+            # the amount of in-flight rows remains bounded
+            batch_size = n_jobs * 8
+            with Parallel(n_jobs=n_jobs, backend='multiprocessing') as par:
+                for start in range(1, len(paths), batch_size):
+                    stop = min(start + batch_size, len(paths))
+                    rows = par(delayed(_load_masked_volume)(path, mask_idx)
+                               for path in paths[start:stop])
+                    for i, row in enumerate(rows, start):
+                        data[i, :] = row
 
         voxel_idx = np.arange(np.prod(tmp.shape))
 
-        if tmp_mask['shape'] == tmp.shape:
-            voxel_idx = voxel_idx[tmp_mask['idx']]
+        if mask_idx is not None:
+            voxel_idx = voxel_idx[mask_idx]
 
         self.voxel_idx.append(voxel_idx)
         self.affine.append(tmp.affine)
         self.data_shape.append(tmp.shape)
 
-        data = np.concatenate(data, axis=0)
         feature_ids = np.ones(data.shape[1], dtype=np.uint32) * len(self.X)
         self.featureset_id.append(feature_ids)
         self.X.append(data)
@@ -741,6 +722,22 @@ class MvpBetween(Mvp):
                              in self.common_subjects]
 
 
+def _load_masked_volume(path, mask_idx=None):
+    """ Loads a 3D nifti and returns its (masked) data as a 1D array. """
+
+    data = nib.load(path).get_data().ravel()
+
+    if mask_idx is not None:
+        data = data[mask_idx]
+
+    return data
+
+
+def _fill_masked_volume(out, i, path, mask_idx=None):
+    """ Loads a (masked) 3D nifti directly into row i of out. """
+    out[i, :] = _load_masked_volume(path, mask_idx)
+
+
 def _check_if_number(text):
 
     if text.isdigit():
@@ -1,10 +1,14 @@
 from __future__ import division, print_function, absolute_import
 
+import os
 import os.path as op
 import pandas as pd
 import numpy as np
 import nibabel as nib
+from numpy.lib.format import open_memmap
+from tempfile import mkstemp
 from ..core import Mvp, convert2epi, convert2mni
+from .mvp_between import _load_masked_volume
 from ..utils import sort_numbered_list
 from sklearn.preprocessing import LabelEncoder
 from glob import glob
@@ -59,6 +63,15 @@ class MvpWithin(Mvp):
         Absolute path to nifti-file that will be used as mask.
     mask_threshold : int or float
         Minimum value to binarize the mask when it's probabilistic.
+    n_jobs : int
+        Number of parallel FSL-processes used when transforming
+        stat-files to MNI space (only relevant if ref_space='mni').
+    dtype : numpy dtype
+        Data-type of the patterns (X); np.float32 halves the memory.
+    mmap_dir : str
+        If given, X is stored in a (.npy) file in this directory and opened
+        as a (read-only) memory-map, such that it does not have to fit in
+        memory.
 
     Attributes
     ----------
@@ -83,7 +96,8 @@ class MvpWithin(Mvp):
     def __init__(self, source, read_labels=True, remove_contrast=[],
                  invert_selection=None, ref_space='epi', statistic='tstat',
                  remove_zeros=True, X=None, y=None, mask=None,
-                 mask_threshold=0):
+                 mask_threshold=0, n_jobs=1, dtype=np.float64,
+                 mmap_dir=None):
 
         super(MvpWithin, self).__init__(X=X, y=y, mask=mask,
                                         mask_thres=mask_threshold)
@@ -95,6 +109,10 @@ class MvpWithin(Mvp):
         self.invert_selection = invert_selection
         self.remove_zeros = remove_zeros
         self.remove_contrast = remove_contrast
+        self.n_jobs = n_jobs
+        self.dtype = dtype
+        self.mmap_dir = mmap_dir
+        self.X_file = None
         self.remove_idx = None
         self.data_shape = None
         self.directories = []
@@ -106,6 +124,10 @@ class MvpWithin(Mvp):
         """ Extracts (meta-)data from FEAT-directory given appropriate settings
         during initialization.
 
+        Data is loaded in two passes: the first pass collects the stat-files
+        and labels of all runs (sources), after which the second pass loads
+        all stat-files (masked) into a single preallocated X.
+
         Raises
         ------
         ValueError
@@ -118,32 +140,25 @@ class MvpWithin(Mvp):
         if isinstance(self.source, str):
             self.source = [self.source]
 
-        # Loop over sources
+        # First pass: collect stat-files (and labels) of all sources
+        stat_files = []
         for src in self.source:
 
             if '.feat' in src:
-                self._load_fsl(src)
+                stat_files.extend(self._collect_fsl(src))
             else:
                 msg = "Loading 'within-data' from other sources than " \
                       "FSL-feat directories is not yet implemented!"
                 raise ValueError(msg)
 
-        # If only one featureset, just index; otherwise, concatenate
-        if len(self.X) == 1:
-            self.X = self.X[0]
-        else:
-            self.X = np.concatenate(self.X, axis=0)
+        # Second pass: load data into a single (preallocated) X
+        self._load_stat_files(stat_files)
 
         if self.read_labels:
             self.y = LabelEncoder().fit_transform(self.contrast_labels)
 
-        if self.remove_zeros:
-            idx = np.invert((self.X == 0)).all(axis=0)
-            self.X = self.X[:, idx]
-            self.voxel_idx = self.voxel_idx[idx]
-            self.featureset_id = self.featureset_id[idx]
-
-    def _load_fsl(self, src):
+    def _collect_fsl(self, src):
+        """ Reads the labels and returns the stat-files of a feat-dir. """
 
         if not op.isdir(src):
             msg = "The feat-directory '%s' doesn't seem to exist." % src
@@ -188,40 +203,71 @@ class MvpWithin(Mvp):
         # Transform stat-files if ref_space is 'mni' but files are in 'epi'.
         if transform2mni:
             out_dir = op.join(src, 'reg_standard')
-            stat_files = convert2mni(stat_files, reg_dir, out_dir)
+            stat_files = convert2mni(stat_files, reg_dir, out_dir,
+                                     n_jobs=self.n_jobs)
 
-        _ = [stat_files.pop(idx)
-             for idx in sorted(self.remove_idx, reverse=True)]
+        remove_idx = [] if self.remove_idx is None else self.remove_idx
+        _ = [stat_files.pop(idx) for idx in sorted(remove_idx, reverse=True)]
         n_stat = len(stat_files)
 
-        if not n_stat == len(contrast_labels_current) and self.read_labels:
+        if self.read_labels and not n_stat == len(contrast_labels_current):
             msg = 'The number of trials (%i) do not match the number of ' \
-                  'class labels (%i)' % (n_stat, len(self.contrast_labels))
+                  'class labels (%i)' % (n_stat, len(contrast_labels_current))
             raise ValueError(msg)
 
+        self.directories.extend([src] * n_stat)
+        return stat_files
+
+    def _load_stat_files(self, stat_files):
+        """ Loads (masked) stat-files into a single preallocated X. If
+        remove_zeros, the features that are zero in any trial are found in
+        an extra read-pass first, such that X is only allocated for the
+        remaining features. """
+
+        tmp = nib.load(stat_files[0])
         if self.common_mask is None:  # set attributes if no mask was given
-            tmp = nib.load(stat_files[0])
             self.affine = tmp.affine
             self.nifti_header = tmp.header
-            # maybe a call to _update_mask_info here?
             self.voxel_idx = np.arange(np.prod(tmp.shape))
 
-        # Pre-allocate
-        mvp_data = np.zeros((n_stat, self.voxel_idx.size))
+        if self.remove_zeros:
+            nonzero = np.ones(self.voxel_idx.size, dtype=bool)
+
+            for path in stat_files:
+                nonzero &= _load_stat_row(path, self.voxel_idx) != 0
+
+            self.voxel_idx = self.voxel_idx[nonzero]
+
+        X = self._allocate((len(stat_files), self.voxel_idx.size))
 
-        # Load in data (stat_files)
         for i, path in enumerate(stat_files):
-            stat_img = nib.load(path)
-            mvp_data[i, :] = stat_img.get_data().ravel()[self.voxel_idx]
-            self.directories.append(src)
+            X[i, :] = _load_stat_row(path, self.voxel_idx)
+
+        if isinstance(X, np.memmap):
+            X.flush()
+            del X
+            X = np.load(self.X_file, mmap_mode='r')
 
-        mvp_data[np.isnan(mvp_data)] = 0
-        self.X.append(mvp_data)
+        self.X = X
 
         # The following attributes are added for compatibility with MvpResults
-        self.data_shape = stat_img.shape
+        self.data_shape = tmp.shape
         self.data_name = ['MvpWithin']
-        self.featureset_id = np.zeros(mvp_data.shape[1], dtype=np.uint32)
+        self.featureset_id = np.zeros(self.X.shape[1], dtype=np.uint32)
+
+    def _allocate(self, shape):
+        """ Allocates (a memory-mapped, if mmap_dir is set) X. """
+
+        if self.mmap_dir is None:
+            return np.zeros(shape, dtype=self.dtype)
+
+        if not op.isdir(self.mmap_dir):
+            os.makedirs(self.mmap_dir)
+
+        fd, self.X_file = mkstemp(suffix='.npy', dir=self.mmap_dir)
+        os.close(fd)
+        return open_memmap(self.X_file, mode='w+', dtype=self.dtype,
+                           shape=shape)
 
     def _read_design(self, design_file):
 
@@ -279,3 +325,11 @@ class MvpWithin(Mvp):
         _ = [cope_labels.pop(idx) for idx in np.sort(self.remove_idx)[::-1]]
 
         return cope_labels
+
+
+def _load_stat_row(path, voxel_idx):
+    """ Loads the (masked) data of a stat-file, with NaNs set to 0. """
+
+    row = _load_masked_volume(path, voxel_idx)
+    row[np.isnan(row)] = 0
+    return row
@@ -0,0 +1,232 @@
+# In-process (NumPy/SciPy) implementation of FSL's flirt -applyxfm and
+# applywarp, to transform niftis between EPI and MNI space using the
+# registration-files from a FSL reg-directory (without FSL).
+
+# Author: Lukas Snoek [lukassnoek.github.io]
+# Contact: lukassnoek@gmail.com
+# License: 3 clause BSD
+
+from __future__ import division, print_function, absolute_import
+import os.path as op
+import numpy as np
+import nibabel as nib
+from scipy.ndimage import map_coordinates
+
+INTERPOLATION_ORDERS = {'nearestneighbour': 0, 'nn': 0, 'trilinear': 1,
+                        'spline': 3}
+
+REG_FILES = {'epi': {'ref': 'example_func.nii.gz',
+                     'src': 'standard.nii.gz',
+                     'mat': 'standard2example_func.mat',
+                     'warp': 'standard2example_func_warp.nii.gz'},
+             'mni': {'ref': 'standard.nii.gz',
+                     'src': 'example_func.nii.gz',
+                     'mat': 'example_func2standard.mat',
+                     'warp': 'example_func2standard_warp.nii.gz'}}
+
+
+def _fsl_vox2mm(shape, affine, zooms):
+    """ Returns the voxel to FSL (scaled-voxel) coordinate matrix.
+
+    FSL's matrices and warps operate on voxel-coordinates scaled by the
+    voxel-size, in which the x-axis is flipped when the image is stored in
+    neurological orientation (i.e. the determinant of the affine is positive).
+    """
+
+    vox2mm = np.diag(list(zooms[:3]) + [1.0])
+
+    if np.linalg.det(affine[:3, :3]) > 0:
+        flip = np.eye(4)
+        flip[0, 0] = -1
+        flip[0, 3] = shape[0] - 1
+        vox2mm = vox2mm.dot(flip)
+
+    return vox2mm
+
+
+class RegTransform(object):
+    """
+    Transforms niftis between EPI and MNI space without FSL.
+    Applies the (affine) matrices and (relative) warp-fields from a FSL
+    reg-directory using ``scipy.ndimage.map_coordinates``. The (source)
+    voxel-coordinates are computed only once per source-grid, such that
+    many images (or all volumes of a 4D image) can be transformed at the
+    cost of a single interpolation each.
+
+    Parameters
+    ----------
+    reg_dir : str
+        Absolute path to registration directory (as created by FSL).
+    direction : str
+        Either 'epi' (MNI to EPI, i.e. like ``convert2epi``) or 'mni' (EPI to
+        MNI, i.e. like ``convert2mni``).
+    apply_warp : bool
+        Whether to use the non-linear warp-field (if available in reg_dir).
+        Only relative displacement-fields (fnirt/convertwarp's default)
+        are supported.
+    """
+
+    def __init__(self, reg_dir, direction='epi', apply_warp=True):
+
+        if direction not in REG_FILES.keys():
+            raise ValueError("Direction should be 'epi' or 'mni', not '%s'."
+                             % direction)
+
+        files = {key: op.join(reg_dir, f)
+                 for key, f in REG_FILES[direction].items()}
+
+        self.reg_dir = reg_dir
+        self.direction = direction
+        self.ref = nib.load(files['ref'])
+        self.src_file = files['src']
+
+        if apply_warp and op.isfile(files['warp']):
+            self.warp_file = files['warp']
+            self.matrix = None
+        else:
+            self.warp_file = None
+            self.matrix = np.loadtxt(files['mat'])
+
+        self._coords = {}
+
+    def resample(self, img, interpolation='trilinear', affine=None):
+        """ Transforms an image to the reference space.
+
+        Parameters
+        ----------
+        img : str, Nifti1Image, or ndarray
+            (Path to) 3D or 4D image in the source space. If an ndarray, it
+            is assumed to have the same grid as the source image in reg_dir
+            (e.g. standard.nii.gz), unless an affine is passed.
+        interpolation : str
+            'trilinear' (default), 'nearestneighbour' (or 'nn'), or 'spline'.
+        affine : ndarray
+            Affine of img (only used if img is an ndarray).
+
+        Returns
+        -------
+        img : Nifti1Image
+            Transformed image with the reference image's affine and header
+            (with the data-type of the transformed data).
+            Nearest-neighbour interpolation preserves the data-type of the
+            input; other interpolations return float32 data.
+        """
+
+        if interpolation not in INTERPOLATION_ORDERS.keys():
+            msg = "Interpolation should be one of %r, not '%s'." % \
+                  (list(INTERPOLATION_ORDERS.keys()), interpolation)
+            raise ValueError(msg)
+
+        order = INTERPOLATION_ORDERS[interpolation]
+
+        if isinstance(img, np.ndarray):
+            data = img
+            if affine is None:
+                src = nib.load(self.src_file)
+                affine, zooms = src.affine, src.header.get_zooms()
+            else:
+                zooms = np.sqrt((affine[:3, :3] ** 2).sum(axis=0))
+        else:
+            if not isinstance(img, nib.Nifti1Image):
+                img = nib.load(img)
+            data = img.get_data()
+            affine, zooms = img.affine, img.header.get_zooms()
+
+        coords = self._get_coords(data.shape[:3], affine, zooms)
+        out_shape = self.ref.shape[:3]
+        dtype = data.dtype if order == 0 else np.float32
+
+        if data.ndim > 3:
+            out = np.zeros(out_shape + data.shape[3:], dtype=dtype)
+            vols = data.reshape(data.shape[:3] + (-1,))
+            out_vols = out.reshape(out_shape + (-1,))
+            for i in range(vols.shape[-1]):
+                out_vols[..., i] = self._interpolate(vols[..., i], coords,
+                                                     order, out_shape)
+        else:
+            out = self._interpolate(data, coords, order,
+                                    out_shape).astype(dtype)
+
+        # The on-disk data-type of the reference (e.g. int16) would round
+        # interpolated values when saved (FSL writes floats)
+        header = self.ref.header.copy()
+        header.set_data_dtype(out.dtype)
+        return nib.Nifti1Image(out, self.ref.affine, header=header)
+
+    def _interpolate(self, vol, coords, order, out_shape):
+
+        # map_coordinates returns the input's dtype, which would truncate
+        # interpolated values of integer images (e.g. masks)
+        vol = vol.astype(np.float64)
+        out = map_coordinates(vol, coords, order=order, mode='constant',
+                              cval=0.0, prefilter=order > 1)
+        return out.reshape(out_shape)
+
+    def _get_coords(self, src_shape, src_affine, src_zooms):
+        """ Computes (and caches) source voxel-coordinates of the ref-grid. """
+
+        key = (tuple(src_shape), src_affine.tobytes(),
+               tuple(np.asarray(src_zooms[:3], dtype=float)))
+
+        if key in self._coords:
+            return self._coords[key]
+
+        ref_shape = self.ref.shape[:3]
+        ref2mm = _fsl_vox2mm(ref_shape, self.ref.affine,
+                             self.ref.header.get_zooms())
+        mm2src = np.linalg.inv(_fsl_vox2mm(src_shape, src_affine, src_zooms))
+
+        ref_vox = np.indices(ref_shape).reshape((3, -1)).astype(np.float64)
+        ref_mm = ref2mm[:3, :3].dot(ref_vox) + ref2mm[:3, 3:]
+
+        if self.warp_file is not None:
+            warp = nib.load(self.warp_file).get_data()
+
+            if warp.ndim != 4 or warp.shape[3] != 3:
+                msg = ("Only (relative) displacement-fields with three "
+                       "components are supported, not %s." % self.warp_file)
+                raise ValueError(msg)
+
+            src_mm = ref_mm + warp.reshape((-1, 3)).T
+        else:
+            # FSL-matrices map source-mm to reference-mm, so we need the
+            # inverse to find the source location of each reference voxel
+            ref2src = np.linalg.inv(self.matrix)
+            src_mm = ref2src[:3, :3].dot(ref_mm) + ref2src[:3, 3:]
+
+        coords = mm2src[:3, :3].dot(src_mm) + mm2src[:3, 3:]
+        coords = coords.astype(np.float32)
+        self._coords[key] = coords
+
+        return coords
+
+
+def resample_image(img, reg_dir, direction='epi', interpolation='trilinear',
+                   apply_warp=True):
+    """ Transforms an image between EPI and MNI space without FSL.
+
+    Convenience function around ``RegTransform``; to transform many images,
+    create a ``RegTransform`` object once and call its ``resample`` method.
+
+    Parameters
+    ----------
+    img : str, Nifti1Image, or ndarray
+        (Path to) image to transform (see ``RegTransform.resample``).
+    reg_dir : str
+        Absolute path to registration directory (as created by FSL).
+    direction : str
+        Either 'epi' (MNI to EPI) or 'mni' (EPI to MNI).
+    interpolation : str
+        'trilinear' (default), 'nearestneighbour' (or 'nn'), or 'spline'.
+    apply_warp : bool
+        Whether to use the non-linear warp-field (if available).
+
+    Returns
+    -------
+    img : Nifti1Image
+        Transformed image.
+    """
+
+    transform = RegTransform(reg_dir, direction=direction,
+                             apply_warp=apply_warp)
+    return transform.resample(img, interpolation=interpolation)
@@ -0,0 +1,249 @@
+# Native searchlight implementation, which works directly on the patterns
+# (X) and voxel-indices of Mvp-objects (instead of on 4D niftis).
+
+# Author: Lukas Snoek [lukassnoek.github.io]
+# Contact: lukassnoek@gmail.com
+# License: 3 clause BSD
+
+from __future__ import division, print_function, absolute_import
+from builtins import range
+import numpy as np
+from sklearn.base import clone, is_classifier
+from sklearn.model_selection import check_cv, cross_val_score
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.svm import SVC
+from sklearn.externals.joblib import Parallel, delayed
+from ..utils.parallel import _effective_n_jobs
+
+
+FAST_ESTIMATORS = ['gnb', 'lda', 'ridge']
+
+
+def searchlight(X, y, neighbourhood, estimator=None, cv=5,
+                scoring='accuracy', centers=None, n_jobs=1, verbose=0,
+                alpha=None):
+    """ Runs a searchlight (cross-validated model per sphere).
+
+    Next to scikit-learn estimators, three 'fast' linear classifiers can be
+    used (by passing their name as estimator), which do not fit an estimator
+    per sphere, but compute the (per-fold) class-statistics once and
+    classify all spheres with batched (small) matrix operations:
+
+    - 'gnb': Gaussian naive Bayes (like sklearn's ``GaussianNB``), in which
+      the per-feature log-likelihoods are summed per sphere with a single
+      sparse matrix product;
+    - 'lda': linear discriminant analysis with shrinkage (like sklearn's
+      ``LinearDiscriminantAnalysis(solver='lsqr', shrinkage=alpha)``);
+    - 'ridge': ridge classifier (like sklearn's
+      ``RidgeClassifier(alpha=alpha)``).
+
+    For 'lda' and 'ridge', spheres are grouped by size, such that the
+    covariance-matrices (or Gram-matrices) of many spheres are solved at
+    once. The fast estimators only support scoring='accuracy'.
+
+    Parameters
+    ----------
+    X : ndarray
+        Numeric (float) array of shape = [n_samples, n_features]
+    y : ndarray
+        Targets of shape = [n_samples]
+    neighbourhood : scipy.sparse.csr_matrix
+        Sparse matrix of shape = [n_features, n_features], in which row i
+        indicates the features in the sphere around feature i (see
+        ``skbold.utils.get_neighbourhoods``).
+    estimator : scikit-learn estimator, pipeline, or str
+        Estimator to fit per sphere (default: a linear SVC after scaling),
+        or one of the fast estimators: 'gnb', 'lda', or 'ridge'.
+    cv : int or cross-validation generator
+        Cross-validation scheme (see sklearn's ``check_cv``); the folds are
+        computed once and used for all spheres.
+    scoring : str or callable
+        Scoring-method (see sklearn's ``cross_val_score``).
+    centers : ndarray
+        Indices of the features to use as sphere-centers; default: all.
+    n_jobs : int
+        Number of processes to run the spheres with (-1 means all cores).
+    verbose : int
+        Verbosity of the parallel computation.
+    alpha : float
+        Regularization of the fast estimators: the shrinkage (between 0 and
+        1) for 'lda' (default: 0.1) or the penalty for 'ridge' (default: 1).
+
+    Returns
+    -------
+    scores : ndarray
+        Average (across folds) score per sphere (center).
+    """
+
+    if estimator is None:
+        estimator = Pipeline([('scaler', StandardScaler()),
+                              ('svm', SVC(kernel='linear', C=1))])
+
+    if centers is None:
+        centers = np.arange(neighbourhood.shape[0])
+
+    fast = isinstance(estimator, str)
+    if fast:
+
+        if estimator not in FAST_ESTIMATORS:
+            msg = "Fast estimator should be one of %r, not '%s'." % \
+                  (FAST_ESTIMATORS, estimator)
+            raise ValueError(msg)
+
+        if scoring != 'accuracy':
+            raise ValueError("Fast estimators only support "
+                             "scoring='accuracy'.")
+
+        if alpha is None:
+            alpha = 0.1 if estimator == 'lda' else 1.0
+
+        cv = check_cv(cv, y, classifier=True)
+        score_func, args = _fast_scores, (estimator, alpha)
+    else:
+        cv = check_cv(cv, y, classifier=is_classifier(estimator))
+        score_func, args = _score_spheres, (estimator,)
+
+    folds = list(cv.split(X, y))
+
+    if n_jobs == 1:
+        return score_func(X, y, neighbourhood[centers], folds, scoring,
+                          *args)
+
+    batches = np.array_split(centers, _effective_n_jobs(n_jobs) * 4)
+    batches = [batch for batch in batches if batch.size > 0]
+
+    # Large arrays (i.e. X) are memory-mapped by joblib, such that the
+    # workers share them
+    scores = Parallel(n_jobs=n_jobs, verbose=verbose)(
+        delayed(score_func)(X, y, neighbourhood[batch], folds, scoring, *args)
+        for batch in batches)
+
+    return np.concatenate(scores)
+
+
+def _score_spheres(X, y, neighbourhood, folds, scoring, estimator):
+    """ Computes the cross-validated score for each sphere (row). """
+
+    indptr, indices = neighbourhood.indptr, neighbourhood.indices
+    scores = np.zeros(neighbourhood.shape[0])
+
+    for i in range(neighbourhood.shape[0]):
+        sphere = indices[indptr[i]:indptr[i + 1]]
+        scores[i] = cross_val_score(clone(estimator), X[:, sphere], y,
+                                    cv=folds, scoring=scoring).mean()
+
+    return scores
+
+
+def _fast_scores(X, y, neighbourhood, folds, scoring, method, alpha):
+    """ Computes the cross-validated accuracy of a fast linear classifier
+    for each sphere (row). """
+
+    classes, y_idx = np.unique(y, return_inverse=True)
+    scores = np.zeros(neighbourhood.shape[0])
+
+    for train, test in folds:
+
+        if method == 'gnb':
+            y_pred = _gnb_predict(X[train], y_idx[train], X[test],
+                                  neighbourhood, classes.size)
+        else:
+            y_pred = _batched_predict(X[train], y_idx[train], X[test],
+                                      neighbourhood, classes.size, method,
+                                      alpha)
+
+        scores += (y_pred == y_idx[test][:, np.newaxis]).mean(axis=0)
+
+    return scores / len(folds)
+
+
+def _gnb_predict(X_train, y_train, X_test, neighbourhood, n_classes):
+    """ Gaussian naive Bayes predictions, shape = [n_test, n_spheres]. """
+
+    nbh = neighbourhood.astype(np.float64)
+    counts = np.bincount(y_train, minlength=n_classes)
+
+    # Same (global) variance-smoothing as sklearn's GaussianNB
+    epsilon = 1e-9 * X_train.var(axis=0).max()
+
+    jll = np.zeros((n_classes, X_test.shape[0], nbh.shape[0]))
+    for c in range(n_classes):
+        X_c = X_train[y_train == c]
+        mean, var = X_c.mean(axis=0), X_c.var(axis=0) + epsilon
+
+        # Per-feature log-likelihoods, summed within spheres
+        ll = -0.5 * np.log(2 * np.pi * var) - \
+            (X_test - mean) ** 2 / (2 * var)
+        jll[c] = nbh.dot(ll.T).T + np.log(counts[c] / counts.sum())
+
+    return jll.argmax(axis=0)
+
+
+def _batched_predict(X_train, y_train, X_test, neighbourhood, n_classes,
+                     method, alpha, max_elements=2 ** 24):
+    """ LDA/ridge predictions for spheres grouped by size (batched solves),
+    shape = [n_test, n_spheres]. """
+
+    n_train = X_train.shape[0]
+    counts = np.bincount(y_train, minlength=n_classes)
+    means = np.array([X_train[y_train == c].mean(axis=0)
+                      for c in range(n_classes)])
+
+    if method == 'lda':
+        # Within-class centered data; its (1 / n) cross-product is the
+        # prior-weighted class-covariance of LinearDiscriminantAnalysis
+        X_c = X_train - means[y_train]
+        log_priors = np.log(counts / n_train)
+    else:
+        # One-vs-all targets (1 / -1) of RidgeClassifier, with intercept
+        X_mean = X_train.mean(axis=0)
+        X_c = X_train - X_mean
+        Y = -np.ones((n_train, n_classes))
+        Y[np.arange(n_train), y_train] = 1
+        Y_mean = Y.mean(axis=0)
+        Y_c = Y - Y_mean
+
+    indptr, indices = neighbourhood.indptr, neighbourhood.indices
+    sizes = np.diff(indptr)
+    y_pred = np.zeros((X_test.shape[0], sizes.size), dtype=np.int64)
+
+    for p in np.unique(sizes):
+
+        rows_p = np.flatnonzero(sizes == p)
+        if p == 0:
+            continue
+
+        # Bound the memory of the (batched) p x p (or n x n) matrices
+        n_batch = max(1, max_elements // (p * max(p, n_train)))
+
+        for start in range(0, rows_p.size, n_batch):
+            rows = rows_p[start:start + n_batch]
+            idx = indices[indptr[rows][:, np.newaxis] + np.arange(p)]
+            Xc_s = X_c[:, idx]  # [n_train x n_spheres x p]
+
+            if method == 'lda':
+                cov = np.einsum('nsp,nsq->spq', Xc_s, Xc_s) / n_train
+                mu = np.trace(cov, axis1=1, axis2=2) / p
+                cov *= (1 - alpha)
+                cov[:, np.arange(p), np.arange(p)] += alpha * mu[:, None]
+                M = means[:, idx].transpose((1, 2, 0))  # [n_spheres x p x C]
+                W = np.linalg.solve(cov, M)
+                b = -0.5 * np.einsum('spc,spc->sc', M, W) + log_priors
+            elif p <= n_train:  # primal ridge
+                G = np.einsum('nsp,nsq->spq', Xc_s, Xc_s)
+                G[:, np.arange(p), np.arange(p)] += alpha
+                W = np.linalg.solve(G, np.einsum('nsp,nc->spc', Xc_s, Y_c))
+                b = Y_mean - np.einsum('sp,spc->sc', X_mean[idx], W)
+            else:  # dual ridge (fewer samples than features)
+                K = np.einsum('nsp,msp->snm', Xc_s, Xc_s)
+                K[:, np.arange(n_train), np.arange(n_train)] += alpha
+                A = np.linalg.solve(K, np.broadcast_to(
+                    Y_c, (rows.size,) + Y_c.shape))
+                W = np.einsum('nsp,snc->spc', Xc_s, A)
+                b = Y_mean - np.einsum('sp,spc->sc', X_mean[idx], W)
+
+            dec = np.einsum('nsp,spc->nsc', X_test[:, idx], W) + b
+            y_pred[:, rows] = dec.argmax(axis=2)
+
+    return y_pred
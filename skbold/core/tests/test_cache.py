@@ -0,0 +1,83 @@
+import os
+import os.path as op
+import shutil
+import pytest
+import numpy as np
+import nibabel as nib
+from skbold.core import WarpCache
+from skbold.core.cache import check_warp_cache
+from skbold import testdata_path
+
+reg_dir = op.join(testdata_path, 'run1.feat', 'reg')
+reg_files = [op.join(reg_dir, 'example_func.nii.gz'),
+             op.join(reg_dir, 'standard2example_func.mat')]
+
+
+def _write_nifti(fn, value):
+    img = nib.Nifti1Image(np.ones((5, 5, 5)) * value, affine=np.eye(4))
+    nib.save(img, fn)
+
+
+def test_warp_cache():
+
+    cache_dir = op.join(testdata_path, 'warp_cache')
+    cache = WarpCache(cache_dir)
+    in_file = op.join(testdata_path, 'cache_in.nii.gz')
+    out_file = op.join(testdata_path, 'cache_out.nii.gz')
+
+    _write_nifti(in_file, 1)
+    key = cache.key(in_file, reg_files, interpolation='trilinear')
+    assert(not cache.get(key, out_file))
+
+    _write_nifti(out_file, 2)
+    cache.put(key, out_file)
+    os.remove(out_file)
+    assert(cache.get(key, out_file))
+    assert(nib.load(out_file).get_data().mean() == 2)
+
+    # Different options or contents should yield a different key
+    assert(key != cache.key(in_file, reg_files, interpolation='nn'))
+    _write_nifti(in_file, 3)
+    assert(key != cache.key(in_file, reg_files, interpolation='trilinear'))
+
+    # Least recently used entries are evicted when exceeding max_size
+    size = os.stat(cache._path(key)).st_size
+    cache.max_size = size
+    os.utime(cache._path(key), (0, 0))
+    cache.put('other', out_file)
+    assert(not cache.get(key, out_file))
+    assert(cache.get('other', out_file))
+
+    shutil.rmtree(cache_dir)
+    _ = [os.remove(f) for f in [in_file, out_file]]
+
+
+def test_check_warp_cache():
+
+    assert(check_warp_cache(False) is None)
+    cache_dir = op.join(testdata_path, 'warp_cache')
+    assert(isinstance(check_warp_cache(cache_dir), WarpCache))
+    shutil.rmtree(cache_dir)
+
+
+@pytest.mark.parametrize('convert', ['epi', 'mni'])
+def test_cache_does_not_overwrite_input(convert):
+
+    from skbold.core import convert2epi, convert2mni
+    cache_dir = op.join(testdata_path, 'warp_cache')
+    in_file = op.join(testdata_path, 'cache_in.nii.gz')
+    _write_nifti(in_file, 1)
+    mtime = os.stat(in_file).st_mtime
+
+    func = convert2epi if convert == 'epi' else convert2mni
+    out_file = func(in_file, reg_dir, suffix=None, cache=cache_dir,
+                    engine='numpy')
+
+    assert(out_file == in_file)
+    assert(os.stat(in_file).st_mtime == mtime)
+    assert(np.all(nib.load(in_file).get_data() == 1))
+    assert(not os.listdir(cache_dir) if op.isdir(cache_dir) else True)
+
+    if op.isdir(cache_dir):
+        shutil.rmtree(cache_dir)
+    os.remove(in_file)
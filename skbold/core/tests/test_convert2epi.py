@@ -1,3 +1,16 @@
 import os.path as op
 import pytest
-from ..convert_to_epi import convert2epi
+from ..convert_to_epi import convert2epi, _run_warps
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_run_warps(n_jobs):
+
+    to_run = [('file%i' % i, 'true', 'out%i' % i, None) for i in range(4)]
+    _run_warps(to_run, n_jobs=n_jobs)
+
+    to_run.append(('file_fail', 'exit 3', 'out_fail', None))
+    with pytest.raises(OSError) as excinfo:
+        _run_warps(to_run, n_jobs=n_jobs)
+
+    assert('file_fail (exit status 3)' in str(excinfo.value))
@@ -0,0 +1,114 @@
+import os
+import os.path as op
+import pytest
+import numpy as np
+from skbold.core import Mvp
+from skbold.core.mvp import _write_hdf5
+from skbold import testdata_path
+
+
+@pytest.mark.parametrize("backend", ['joblib', 'numpy'])
+@pytest.mark.parametrize("mmap_mode", [None, 'r'])
+def test_mvp_write_and_load(backend, mmap_mode):
+
+    X = np.random.normal(0, 1, size=(10, 100))
+    y = np.repeat([0, 1], 5)
+    mvp = Mvp(X=X, y=y)
+    mvp.voxel_idx = np.arange(100)
+    mvp.featureset_id = np.zeros(100, dtype=np.uint32)
+
+    mvp.write(path=testdata_path, name='mvp_test', backend=backend)
+    assert(np.array_equal(mvp.X, X))
+
+    if backend == 'joblib':
+        fn = op.join(testdata_path, 'mvp_test.jl')
+        to_remove = [fn]
+    else:
+        fn = op.join(testdata_path, 'mvp_test_header.jl')
+        to_remove = [fn, op.join(testdata_path, 'mvp_test_data.npy')]
+
+    mvp_loaded = Mvp.load(fn, mmap_mode=mmap_mode)
+    assert(np.array_equal(mvp_loaded.X, X))
+    assert(np.array_equal(mvp_loaded.y, y))
+    assert(np.array_equal(mvp_loaded.voxel_idx, mvp.voxel_idx))
+
+    if backend == 'numpy' and mmap_mode is not None:
+        assert(isinstance(mvp_loaded.X, np.memmap))
+
+    del mvp_loaded
+    _ = [os.remove(f) for f in to_remove]
+
+
+@pytest.mark.parametrize("backend", ['joblib', 'numpy', 'hdf5'])
+def test_mvp_load_subset(backend):
+
+    if backend == 'hdf5':
+        pytest.importorskip('h5py')
+
+    X = np.random.normal(0, 1, size=(10, 300))
+    mvp = Mvp(X=X, y=np.repeat([0, 1], 5))
+    mvp.voxel_idx = np.tile(np.arange(100), 3)
+    mvp.featureset_id = np.repeat([0, 1, 2], 100).astype(np.uint32)
+    mvp.data_shape = [(10, 10, 1)] * 3
+    mvp.data_name = ['fs0', 'fs1', 'fs2']
+    mvp.affine = [np.eye(4)] * 3
+
+    mvp.write(path=testdata_path, name='mvp_test', backend=backend,
+              chunks=(4, 16))
+    fn = op.join(testdata_path, 'mvp_test')
+
+    mvp_fs = Mvp.load(fn, featureset_id=1)
+    assert(np.array_equal(mvp_fs.X, X[:, 100:200]))
+    assert(np.array_equal(mvp_fs.featureset_id, np.zeros(100)))
+    assert(mvp_fs.data_name == ['fs1'])
+
+    mvp_roi = Mvp.load(fn, featureset_id=[0, 2], voxel_range=(10, 20))
+    idx = np.in1d(mvp.featureset_id, [0, 2])
+    idx &= (mvp.voxel_idx >= 10) & (mvp.voxel_idx < 20)
+    assert(np.array_equal(mvp_roi.X, X[:, idx]))
+    assert(np.array_equal(np.unique(mvp_roi.featureset_id), [0, 1]))
+    assert(mvp_roi.data_name == ['fs0', 'fs2'])
+
+    mvp_all = Mvp.load(fn)
+    assert(np.array_equal(mvp_all.X, X))
+
+    ext = {'joblib': ['.jl'], 'numpy': ['_header.jl', '_data.npy'],
+           'hdf5': ['_header.jl', '.h5']}
+    _ = [os.remove(fn + e) for e in ext[backend]]
+
+
+def test_mvp_write_removes_other_backends():
+
+    backends = ['joblib', 'numpy']
+    try:
+        import h5py
+        backends.insert(1, 'hdf5')
+    except ImportError:
+        pass
+
+    fn = op.join(testdata_path, 'mvp_test')
+    y = np.repeat([0, 1], 5)
+
+    # Each write replaces the previous one, regardless of the backend
+    for backend in backends + ['joblib']:
+        X = np.random.normal(0, 1, size=(10, 20))
+        mvp = Mvp(X=X, y=y)
+        mvp.voxel_idx = np.arange(20)
+        mvp.featureset_id = np.zeros(20, dtype=np.uint32)
+        mvp.write(path=testdata_path, name='mvp_test', backend=backend)
+
+        assert(np.array_equal(Mvp.load(fn).X, X))
+        if backend != 'joblib':
+            assert(np.array_equal(Mvp.load(fn + '_header.jl').X, X))
+
+        # An explicit data-file determines the backend
+        if backend == 'numpy' and 'hdf5' in backends:
+            mvp.X = X + 1
+            _write_hdf5(fn + '.h5', mvp)
+            assert(np.array_equal(Mvp.load(fn + '_data.npy').X, X))
+            assert(np.array_equal(Mvp.load(fn + '.h5').X, X + 1))
+            os.remove(fn + '.h5')
+
+    assert(not op.isfile(fn + '_header.jl'))
+    assert(not op.isfile(fn + '_data.npy'))
+    os.remove(fn + '.jl')
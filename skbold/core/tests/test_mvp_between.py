@@ -128,3 +128,22 @@ def test_mvp_between_update_sample(mvp1c):
     assert(len(mvp1c.y) == mvp1c.X.shape[0] == len(mvp1c.common_subjects))
     assert(mvp1c.common_subjects == ['sub001', 'sub002', 'sub004',
                                      'sub006', 'sub007'])
+
+
+@pytest.mark.parametrize("backend", ['thread', 'process'])
+@pytest.mark.parametrize("mask", [bmask, None])
+def test_mvp_between_create_parallel(backend, mask):
+    source = dict()
+    source['Contrast1'] = {'path': dpath + '/cope1.nii.gz'}
+
+    mvp = MvpBetween(source=source, subject_idf='sub???', mask=mask)
+    mvp.create()
+
+    source_par = dict()
+    source_par['Contrast1'] = {'path': dpath + '/cope1.nii.gz'}
+    mvp_par = MvpBetween(source=source_par, subject_idf='sub???', mask=mask,
+                         n_jobs=2, backend=backend)
+    mvp_par.create()
+
+    assert(np.array_equal(mvp.X, mvp_par.X))
+    assert(np.array_equal(mvp.voxel_idx, mvp_par.voxel_idx))
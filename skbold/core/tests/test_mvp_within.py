@@ -4,6 +4,7 @@ import os
 import os.path as op
 import pytest
 import shutil
+import numpy as np
 
 
 gm_mask = op.join(op.dirname(op.dirname(op.dirname(__file__))), 'data', 'ROIs',
@@ -38,3 +39,30 @@ def test_mvp_within(ref_space, mask):
     for testfeat in testfeats:
         if op.isdir(op.join(testfeat, 'reg_standard')):
             shutil.rmtree(op.join(testfeat, 'reg_standard'))
+
+
+@pytest.mark.mvpwithin
+def test_mvp_within_dtype_and_mmap(tmpdir):
+
+    testfeats = [op.join(testdata_path, 'run1.feat'),
+                 op.join(testdata_path, 'run2.feat')]
+
+    kwargs = dict(source=testfeats, read_labels=True, remove_contrast=[],
+                  ref_space='epi', statistic='cope', mask=None)
+
+    ref = MvpWithin(remove_zeros=False, **kwargs)
+    ref.create()
+
+    mvp = MvpWithin(remove_zeros=True, dtype=np.float32,
+                    mmap_dir=str(tmpdir), **kwargs)
+    mvp.create()
+
+    nonzero = (ref.X != 0).all(axis=0)
+    assert isinstance(mvp.X, np.memmap)
+    assert mvp.X.dtype == np.float32
+    assert len(os.listdir(str(tmpdir))) == 1
+    assert np.array_equal(mvp.voxel_idx, ref.voxel_idx[nonzero])
+    assert np.allclose(mvp.X, ref.X[:, nonzero], rtol=1e-6)
+    assert (mvp.X != 0).all()
+    assert np.array_equal(mvp.y, ref.y)
+    assert mvp.featureset_id.size == mvp.X.shape[1]
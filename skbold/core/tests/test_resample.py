@@ -0,0 +1,138 @@
+import os
+import os.path as op
+import numpy as np
+import nibabel as nib
+import pytest
+from ... import testdata_path
+from ..resample import RegTransform, _fsl_vox2mm
+from ..convert_to_epi import convert2epi
+from ..convert_to_mni import convert2mni
+
+reg_dir = op.join(testdata_path, 'run1.feat', 'reg')
+
+
+def test_reg_transform_matches_flirt():
+
+    # example_func2standard.nii.gz was created by FSL from example_func
+    transform = RegTransform(reg_dir, direction='mni')
+    img = transform.resample(op.join(reg_dir, 'example_func.nii.gz'))
+    flirted = nib.load(op.join(reg_dir, 'example_func2standard.nii.gz'))
+    assert(img.shape == flirted.shape)
+    assert(np.allclose(img.affine, flirted.affine))
+
+    ours, fsl = img.get_data(), flirted.get_data()
+    mask = fsl > 0
+    assert(np.corrcoef(ours[mask], fsl[mask])[0, 1] > 0.85)
+
+
+@pytest.mark.parametrize("interpolation", ['trilinear', 'nearestneighbour'])
+def test_reg_transform_in_memory(interpolation):
+
+    transform = RegTransform(reg_dir, direction='epi')
+    ref_shape = nib.load(op.join(reg_dir, 'example_func.nii.gz')).shape
+    mask = np.zeros((91, 109, 91), dtype=np.int16)
+    mask[30:60, 40:70, 30:60] = 1
+
+    img = transform.resample(mask, interpolation=interpolation)
+    assert(img.shape == ref_shape)
+    assert(img.get_data().max() > 0)
+
+    if interpolation == 'nearestneighbour':
+        assert(img.get_data().dtype == np.int16)
+        assert(np.in1d(np.unique(img.get_data()), [0, 1]).all())
+
+    # 4D images are transformed volume-by-volume
+    img = transform.resample(np.stack([mask, mask * 2], axis=-1),
+                             interpolation=interpolation)
+    assert(img.shape == ref_shape + (2,))
+    assert(np.allclose(img.get_data()[..., 0] * 2, img.get_data()[..., 1]))
+
+    with pytest.raises(ValueError):
+        transform.resample(mask, interpolation='sinc')
+
+
+def test_convert_numpy_engine():
+
+    stat = op.join(testdata_path, 'run1.feat', 'stats', 'cope1.nii.gz')
+    out_dir = op.join(testdata_path, 'resample_test')
+    out_mni = convert2mni(stat, reg_dir, out_dir, engine='numpy',
+                          cache=False)
+    assert(nib.load(out_mni).shape == (91, 109, 91))
+
+    out_epi = convert2epi(out_mni, reg_dir, out_dir, engine='numpy',
+                          cache=False)
+    assert(nib.load(out_epi).shape == nib.load(stat).shape)
+
+    with pytest.raises(ValueError):
+        convert2mni(stat, reg_dir, out_dir, engine='afni')
+
+    if 'FSLDIR' not in os.environ.keys():
+        with pytest.raises(OSError):
+            convert2epi(stat, reg_dir, out_dir, engine='fsl', overwrite=True)
+
+    _ = [os.remove(f) for f in [out_mni, out_epi]]
+    os.rmdir(out_dir)
+
+
+def _copy_reg_dir(tmp_dir, ref_dtype=None):
+    """ Copies the test reg-dir, optionally with an integer reference. """
+
+    for f in os.listdir(reg_dir):
+        img_or_txt = op.join(reg_dir, f)
+        if f.endswith('.mat'):
+            np.savetxt(op.join(tmp_dir, f), np.loadtxt(img_or_txt))
+        else:
+            img = nib.load(img_or_txt)
+            if ref_dtype is not None:
+                img.set_data_dtype(ref_dtype)
+            nib.save(img, op.join(tmp_dir, f))
+
+
+def test_reg_transform_float_output_with_integer_reference(tmpdir):
+
+    tmp_dir = str(tmpdir)
+    _copy_reg_dir(tmp_dir, ref_dtype=np.int16)
+    transform = RegTransform(tmp_dir, direction='mni')
+    img = transform.resample(op.join(reg_dir, 'example_func.nii.gz'))
+    fn = op.join(tmp_dir, 'out.nii.gz')
+    nib.save(img, fn)
+
+    assert(nib.load(fn).get_data_dtype() == np.float32)
+    assert(np.allclose(nib.load(fn).get_data(), img.get_data()))
+
+
+def test_reg_transform_warp(tmpdir):
+
+    # A (relative) warp-field equivalent to the affine matrix should give
+    # the same result as the matrix itself
+    tmp_dir = str(tmpdir)
+    _copy_reg_dir(tmp_dir)
+    transform = RegTransform(tmp_dir, direction='mni')
+    assert(transform.warp_file is None)
+    expected = transform.resample(op.join(reg_dir, 'example_func.nii.gz'))
+
+    ref = transform.ref
+    ref2mm = _fsl_vox2mm(ref.shape, ref.affine, ref.header.get_zooms())
+    ref_vox = np.indices(ref.shape).reshape((3, -1))
+    ref_mm = ref2mm[:3, :3].dot(ref_vox) + ref2mm[:3, 3:]
+    ref2src = np.linalg.inv(transform.matrix)
+    src_mm = ref2src[:3, :3].dot(ref_mm) + ref2src[:3, 3:]
+    warp = (src_mm - ref_mm).T.reshape(ref.shape + (3,))
+    nib.save(nib.Nifti1Image(warp.astype(np.float32), ref.affine),
+             op.join(tmp_dir, 'example_func2standard_warp.nii.gz'))
+
+    transform = RegTransform(tmp_dir, direction='mni')
+    assert(transform.warp_file is not None)
+    img = transform.resample(op.join(reg_dir, 'example_func.nii.gz'))
+    assert(np.allclose(img.get_data(), expected.get_data(), rtol=1e-4,
+                       atol=1e-2))
+
+    no_warp = RegTransform(tmp_dir, direction='mni', apply_warp=False)
+    assert(no_warp.warp_file is None)
+
+    # Warps should have three components
+    nib.save(nib.Nifti1Image(warp[..., :2].astype(np.float32), ref.affine),
+             op.join(tmp_dir, 'example_func2standard_warp.nii.gz'))
+    with pytest.raises(ValueError):
+        RegTransform(tmp_dir, direction='mni').resample(
+            op.join(reg_dir, 'example_func.nii.gz'))
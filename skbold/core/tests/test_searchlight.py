@@ -0,0 +1,114 @@
+import os
+import os.path as op
+import numpy as np
+import nibabel as nib
+import pytest
+from sklearn.naive_bayes import GaussianNB
+from sklearn.discriminant_analysis import LinearDiscriminantAnalysis
+from sklearn.linear_model import RidgeClassifier
+from sklearn.model_selection import StratifiedKFold
+from ... import testdata_path, roidata_path
+from ...utils import get_neighbourhoods
+from ..mvp_between import MvpBetween
+from ..mvp_within import MvpWithin
+from ..searchlight import searchlight
+
+
+def test_searchlight():
+
+    data_shape, affine = (6, 6, 6), np.diag([2, 2, 2, 1])
+    voxel_idx = np.arange(np.prod(data_shape))
+    rng = np.random.RandomState(42)
+    y = np.repeat([0, 1], 20)
+    X = rng.randn(40, voxel_idx.size)
+    X[y == 1, :5] += 2  # informative voxels: first corner of the volume
+
+    nbh = get_neighbourhoods(voxel_idx, affine, data_shape, 2)
+    scores = searchlight(X, y, nbh, estimator=GaussianNB(), cv=4)
+    assert(scores.shape == (voxel_idx.size,))
+    assert(scores[:5].mean() > scores[50:].mean())
+
+    scores_par = searchlight(X, y, nbh, estimator=GaussianNB(), cv=4,
+                             n_jobs=2, centers=np.arange(0, 216, 3))
+    assert(np.allclose(scores_par, scores[::3]))
+
+
+@pytest.mark.parametrize('n_classes', [2, 3])
+def test_searchlight_fast(n_classes):
+
+    data_shape, affine = (6, 6, 6), np.diag([2, 2, 2, 1])
+    voxel_idx = np.arange(np.prod(data_shape))
+    rng = np.random.RandomState(42)
+    y = np.repeat(np.arange(n_classes), 15)
+    X = rng.randn(y.size, voxel_idx.size)
+    X[:, :20] += y[:, np.newaxis]
+
+    # Radius 4 gives spheres larger than the training-set (dual ridge)
+    nbh = get_neighbourhoods(voxel_idx, affine, data_shape, 4)
+    cv = StratifiedKFold(n_splits=3)
+    estimators = {'gnb': GaussianNB(),
+                  'lda': LinearDiscriminantAnalysis(solver='lsqr',
+                                                    shrinkage=0.1),
+                  'ridge': RidgeClassifier(alpha=1.0)}
+
+    for method, estimator in estimators.items():
+        scores = searchlight(X, y, nbh, estimator=estimator, cv=cv)
+        scores_fast = searchlight(X, y, nbh, estimator=method, cv=cv)
+        assert(np.allclose(scores, scores_fast))
+
+    with pytest.raises(ValueError):
+        searchlight(X, y, nbh, estimator='svm')
+
+    with pytest.raises(ValueError):
+        searchlight(X, y, nbh, estimator='lda', scoring='f1')
+
+
+def test_mvp_between_searchlight():
+
+    source = {'Contrast1': {'path': op.join(testdata_path, 'mock_subjects',
+                                            'sub*', 'run1.feat', 'stats',
+                                            'cope1.nii.gz')}}
+    bmask = op.join(roidata_path, 'other', 'GrayMatter_prob.nii.gz')
+    mvp = MvpBetween(source=source, subject_idf='sub???', mask=bmask)
+    mvp.create()
+    mvp.add_y(op.join(testdata_path, 'sample_behav.tsv'),
+              col_name='var_categorical', index_col=0, remove=999)
+
+    # Only use a small block of voxels as sphere-centers
+    sl_mask = np.zeros(mvp.data_shape[0])
+    sl_mask[20:24, 20:24, 15:18] = 1
+    mask_file = op.join(testdata_path, 'sl_mask.nii.gz')
+    nib.Nifti1Image(sl_mask, mvp.affine[0]).to_filename(mask_file)
+
+    imgs = mvp.run_searchlight(testdata_path, n_folds=2, radius=[3, 6],
+                               mask=mask_file, estimator=GaussianNB())
+    assert(len(imgs) == 2)
+
+    for r in [3, 6]:
+        out_file = op.join(testdata_path, 'sl_results_%imm.nii.gz' % r)
+        assert(nib.load(out_file).shape == mvp.data_shape[0])
+        os.remove(out_file)
+
+    os.remove(mask_file)
+
+
+def test_mvp_within_searchlight():
+
+    testfeats = [op.join(testdata_path, 'run1.feat'),
+                 op.join(testdata_path, 'run2.feat')]
+    mvp = MvpWithin(source=testfeats, read_labels=True, remove_contrast=[],
+                    ref_space='epi', statistic='cope', remove_zeros=False)
+    mvp.create()
+
+    sl_mask = np.zeros(mvp.data_shape)
+    sl_mask[30:34, 30:34, 15:18] = 1
+    mask_file = op.join(testdata_path, 'sl_mask.nii.gz')
+    nib.Nifti1Image(sl_mask, mvp.affine).to_filename(mask_file)
+
+    imgs = mvp.run_searchlight(testdata_path, n_folds=2, radius=8,
+                               mask=mask_file, estimator='lda')
+    scores = imgs[0].get_data()[sl_mask > 0]
+    assert(((scores >= 0) & (scores <= 1)).all())
+
+    os.remove(op.join(testdata_path, 'sl_results_8mm.nii.gz'))
+    os.remove(mask_file)
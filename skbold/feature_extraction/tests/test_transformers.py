@@ -6,7 +6,9 @@ from ... import testdata_path
 from ...feature_extraction import *
 from ...utils.roi_globals import available_atlases, other_rois
 from ...utils.parse_roi_labels import parse_roi_labels
+from ...utils import load_roi_mask
 import pytest
+import numpy as np
 import os
 import random
 from glob import glob
@@ -34,7 +36,13 @@ def test_cluster_threshold():
 
     transf = ClusterThreshold(mvp=mvp_within, min_score=2)
     transf.fit(mvp_within.X, mvp_within.y)
-    transf.transform(mvp_within.X)
+    X_cl = transf.transform(mvp_within.X)
+    assert(X_cl.shape == (mvp_within.X.shape[0], transf.n_clust_))
+    assert(transf.cl_labels_.dtype == np.int32)
+
+    for j in range(transf.n_clust_):
+        idx = transf.cl_labels_ == j
+        assert(np.allclose(X_cl[:, j], mvp_within.X[:, idx].mean(axis=1)))
 
 
 @pytest.mark.transformer
@@ -65,3 +73,22 @@ def test_average_region_transformer():
 
     files_reg = glob(op.join(reg_dir, '*'))
     [os.remove(f) for f in files_reg if f not in orig_reg_files]
+
+
+@pytest.mark.transformer
+def test_average_region_transformer_mni():
+
+    data_shape = (91, 109, 91)
+    orig_mask = np.arange(0, np.prod(data_shape), 7)
+    X = np.random.randn(5, orig_mask.size)
+
+    art = AverageRegionTransformer(atlas='HarvardOxford-Cortical',
+                                   orig_mask=orig_mask, data_shape=data_shape,
+                                   ref_space='mni')
+    X_new = art.fit(X).transform(X)
+    assert(X_new.shape == (5, len(art.roi_names)))
+
+    rois, _ = load_roi_mask('all', atlas_name='HarvardOxford-Cortical')
+    for i, roi in enumerate(rois):
+        in_roi = roi.ravel()[orig_mask]
+        assert(np.allclose(X_new[:, i], X[:, in_roi].mean(axis=1)))
@@ -8,17 +8,16 @@ import os
 import os.path as op
 import skbold
 import numpy as np
-import nibabel as nib
 
 from ..utils.roi_globals import available_atlases, other_rois
 from ..utils.load_roi_mask import load_roi_mask, parse_roi_labels
-from ..core import convert2epi
+from ..core import RegTransform
 from sklearn.base import BaseEstimator, TransformerMixin
 from sklearn.feature_selection import f_classif
 from sklearn.decomposition import PCA
 from scipy.ndimage import label
+from scipy.sparse import csr_matrix
 from glob import glob
-from warnings import warn
 
 roi_dir = op.join(op.dirname(skbold.__file__), 'data', 'ROIs',
                   'harvard_oxford')
@@ -45,6 +44,14 @@ class AverageRegionTransformer(BaseEstimator, TransformerMixin):
         Path to directory with registration info (warps/transforms).
     **kwargs : key-word arguments
         Other arguments that can be passed to `skbold.utils.load_roi_mask`.
+
+    Attributes
+    ----------
+    averaging_matrix : scipy.sparse.csr_matrix
+        Sparse matrix of shape = [n_features, n_regions], such that the
+        region-averages are computed with a single (sparse) matrix product.
+    region_size : ndarray
+        Number of voxels per region.
     """
 
     def __init__(self, atlas='HarvardOxford-All', mask_threshold=0, mvp=None,
@@ -58,32 +65,27 @@ class AverageRegionTransformer(BaseEstimator, TransformerMixin):
         else:
             self.orig_mask = mvp.voxel_idx
             self.data_shape = mvp.data_shape
-            self.mask_threshold = mask_threshold
             self.affine = mvp.affine
             ref_space = mvp.ref_space
 
+        self.mask_threshold = mask_threshold
+
         rois, roi_names = load_roi_mask(roi_name='all', atlas_name=atlas,
                                         threshold=mask_threshold, **kwargs)
 
         self.roi_names = roi_names
 
-        # This is actually very inefficient, because it warps all ROIs
-        # separately, while it would be faster if just the atlas itself is
-        # warped first
         if ref_space == 'epi':
 
             if reg_dir is None:
-                warn('You have to provide a reg_dir because otherwise '
-                     'we cannot transform masks to epi space.')
+                raise ValueError('You have to provide a reg_dir because '
+                                 'otherwise we cannot transform masks to '
+                                 'epi space.')
 
-            to_transform = []
-            for i, roi in enumerate(rois):
-                img = nib.Nifti1Image(roi.astype(int), affine=self.affine)
-                fn = op.join(reg_dir, 'roi_%i.nii.gz' % i)
-                nib.save(img, fn)
-                to_transform.append(fn)
+            rois = _warp_rois(rois, reg_dir)
 
-            self.mask_list = convert2epi(to_transform, reg_dir, reg_dir)
+        self.averaging_matrix, self.region_size = _get_averaging_matrix(
+            rois, self.orig_mask, self.data_shape)
 
     def fit(self, X=None, y=None):
         """ Does nothing, but included to be used in sklearn's Pipeline. """
@@ -104,22 +106,98 @@ class AverageRegionTransformer(BaseEstimator, TransformerMixin):
         -------
         X_new : ndarray
             array with transformed data of shape = [n_samples, n_features]
-            in which features are region-average values.
+            in which features are region-average values (NaN for regions
+            without voxels in the mask).
         """
 
-        X_new = np.zeros((X.shape[0], len(self.mask_list)))
-        for i, mask in enumerate(self.mask_list):
-
-            roi_idx = nib.load(mask).get_data() > self.mask_threshold
-            overlap = np.zeros(self.data_shape).ravel()
-            overlap[roi_idx.ravel()] += 1
-            overlap[self.orig_mask] += 1
-            region_av = np.mean(X[:, (overlap == 2)[self.orig_mask]], axis=1)
-            X_new[:, i] = region_av
+        # (A.T X.T).T = X A, but sparse.dot(dense) is scipy's fast path
+        X_new = self.averaging_matrix.T.dot(X.T).T
+        X_new[:, self.region_size == 0] = np.nan
 
         return X_new
 
 
+def _warp_rois(rois, reg_dir):
+    """ Warps a list of (MNI) ROIs to EPI space at once.
+
+    Non-overlapping ROIs (e.g. maxprob or Yeo atlases) are warped as a single
+    label image; overlapping (probabilistic) ROIs cannot be represented by a
+    single label image and are warped as a single 4D image instead. Either
+    way, nearest-neighbour interpolation is used and the (source) coordinates
+    are computed only once.
+
+    Parameters
+    ----------
+    rois : list
+        List of boolean ndarrays (in MNI space).
+    reg_dir : str
+        Absolute path to registration directory (as created by FSL).
+
+    Returns
+    -------
+    rois : list
+        List of boolean ndarrays (in EPI space).
+    """
+
+    transform = RegTransform(reg_dir, direction='epi')
+    n_rois = len(rois)
+    stack = np.stack(rois, axis=-1)
+
+    if stack.sum(axis=-1).max() <= 1:
+        labels = stack.dot(np.arange(1, n_rois + 1)).astype(np.int16)
+        labels = transform.resample(labels, interpolation='nearestneighbour')
+        labels = labels.get_data()
+        return [labels == i for i in range(1, n_rois + 1)]
+    else:
+        stack = transform.resample(stack.astype(np.uint8),
+                                   interpolation='nearestneighbour')
+        stack = stack.get_data()
+        return [stack[..., i] > 0 for i in range(n_rois)]
+
+
+def _get_averaging_matrix(rois, orig_mask, data_shape):
+    """ Creates a sparse matrix that averages the voxels of X per ROI.
+
+    Parameters
+    ----------
+    rois : list
+        List of boolean ndarrays of shape data_shape.
+    orig_mask : ndarray
+        Indices of the voxels in X (in the flattened data_shape).
+    data_shape : tuple
+        Shape of the (3D) data.
+
+    Returns
+    -------
+    averaging_matrix : scipy.sparse.csr_matrix
+        Matrix of shape = [n_features, n_regions] with 1 / region-size for
+        the voxels of each region, such that X.dot(averaging_matrix) yields
+        the region-averages.
+    region_size : ndarray
+        Number of voxels (in X) per region.
+    """
+
+    # Maps (flattened) brain-indices to column indices in X (-1 = not in X)
+    n_features = np.asarray(orig_mask).size
+    col_idx = np.full(int(np.prod(data_shape)), -1, dtype=np.int64)
+    col_idx[orig_mask] = np.arange(n_features)
+
+    region_idx = []
+    for roi in rois:
+        cols = col_idx[roi.ravel()]
+        region_idx.append(cols[cols >= 0])
+
+    region_size = np.array([idx.size for idx in region_idx])
+    regions = np.repeat(np.arange(len(rois)), region_size)
+    region_idx = np.concatenate(region_idx)
+    weights = 1.0 / region_size[regions]
+
+    averaging_matrix = csr_matrix((weights, (region_idx, regions)),
+                                  shape=(n_features, len(rois)))
+
+    return averaging_matrix, region_size
+
+
 class ClusterThreshold(BaseEstimator, TransformerMixin):
     """
     Implements a cluster-based feature selection method.
@@ -160,7 +238,7 @@ class ClusterThreshold(BaseEstimator, TransformerMixin):
         self.mask_idx = mvp.voxel_idx
         self.scores_ = None
         self.idx_ = None
-        self.cl_idx_ = None
+        self.cl_labels_ = None
         self.n_clust_ = None
 
     def fit(self, X, y, *args):
@@ -191,15 +269,13 @@ class ClusterThreshold(BaseEstimator, TransformerMixin):
         cluster_nrs = values[counts.argsort()[::-1][:n_clust]]
         cluster_nrs = np.delete(cluster_nrs, 0)
 
-        # cl_idx holds indices per cluster
-        cl_idx = np.zeros((X.shape[1], len(cluster_nrs)))
-
-        # Update cl_idx until cluster-size < cluster_min
-        for j, clt in enumerate(cluster_nrs):
-            cl_idx[:, j] = (clustered == clt).ravel()[self.mask_idx]
+        # cl_labels holds the cluster-number (0, ..., n_clust - 1) of each
+        # feature, or -1 for features outside the (retained) clusters
+        lut = -np.ones(clustered.max() + 1, dtype=np.int32)
+        lut[cluster_nrs] = np.arange(len(cluster_nrs), dtype=np.int32)
 
-        self.n_clust_ = cl_idx.shape[1]
-        self.cl_idx_ = cl_idx
+        self.n_clust_ = len(cluster_nrs)
+        self.cl_labels_ = lut[clustered.ravel()[self.mask_idx]]
 
         return self
 
@@ -219,15 +295,15 @@ class ClusterThreshold(BaseEstimator, TransformerMixin):
 
         """
 
-        # X_cl = clustered version of X
-        X_cl = np.zeros((X.shape[0], self.n_clust_))
-        n_clust = X_cl.shape[1]
-
-        for j in range(n_clust):
-            idx = self.cl_idx_[:, j].astype(bool)
-            X_cl[:, j] = np.mean(X[:, idx], axis=1)
+        # Sparse [n_features, n_clusters] matrix with 1 / cluster-size for
+        # each feature in a cluster, such that X_cl = X.dot(avg)
+        in_cl = np.flatnonzero(self.cl_labels_ >= 0)
+        labels = self.cl_labels_[in_cl]
+        sizes = np.bincount(labels, minlength=self.n_clust_)
+        avg = csr_matrix((1.0 / sizes[labels], (in_cl, labels)),
+                         shape=(X.shape[1], self.n_clust_))
 
-        return X_cl
+        return avg.T.dot(X.T).T
 
 
 class PatternAverager(BaseEstimator, TransformerMixin):
@@ -12,8 +12,9 @@ All comply with the scikit-learn API, using fit() and transform() methods.
 """
 
 from .filters import GenericUnivariateSelect, SelectAboveCutoff
-from .selectors import fisher_criterion_score
+from .selectors import fisher_criterion_score, FoldAwareFClassif
 from .transformers import RoiIndexer, IncrementalFeatureCombiner
 
 __all__ = ['GenericUnivariateSelect', 'SelectAboveCutoff',
-           'fisher_criterion_score', 'IncrementalFeatureCombiner']
+           'fisher_criterion_score', 'FoldAwareFClassif',
+           'IncrementalFeatureCombiner']
@@ -1,5 +1,6 @@
 # Class to implement sklearn's f_classif function, but with a minimum
-# cutoff instead of an absolute or proportional amount of features.
+# cutoff instead of an absolute or proportional amount of features, and
+# univariate scoring functions (e.g. a fold-aware f_classif).
 
 # Author: Lukas Snoek [lukassnoek.github.io]
 # Contact: lukassnoek@gmail.com
@@ -8,10 +9,14 @@
 from __future__ import print_function, division, absolute_import
 from builtins import range
 import numpy as np
-from itertools import combinations
+from scipy.sparse import csr_matrix, issparse
+from scipy.special import fdtrc
+from sklearn.feature_selection import f_classif
+from ..utils.hashing import _hash_row
 
 
-def fisher_criterion_score(X, y, norm='l1', balance=False):
+def fisher_criterion_score(X, y, norm='l1', balance=False,
+                           block_elements=2 ** 22):
     """ Calculates fisher score.
 
     See [1]_ for more info.
@@ -29,38 +34,235 @@ def fisher_criterion_score(X, y, norm='l1', balance=False):
         The data matrix
     norm : str
         Whether to use the l1-norm or l2-norm.
+    balance : bool
+        Whether to return the scores per pair of classes (shape =
+        [n_pairs, n_features]) instead of their mean.
+    block_elements : int
+        Maximum number of elements of intermediate (pairwise difference)
+        arrays; features are processed in blocks accordingly.
 
     Returns
     -------
     scores_ : array, shape=(n_features,)
-        Fisher criterion scores for each feature.
+        Fisher criterion scores for each feature (or, if balance=True, shape
+        = [n_pairs, n_features]).
     """
 
-    n_class = np.unique(y).shape[0]
-    n_features = X.shape[1]
-    av_patterns = np.zeros((n_class, n_features))
-
-    # Calculate mean patterns
-    y_unique = np.unique(y)
-    for i in range(n_class):
-        av_patterns[i, :] = X[y == y_unique[i], :].mean(axis=0)
-        av_patterns[np.isnan(av_patterns)] = 0
-
-    # Create difference vectors, z-score standardization, absolute
-    comb = list(combinations(range(1, n_class + 1), 2))
-    diff_patterns = np.zeros((len(comb), n_features))
-    for i, cb in enumerate(comb):
-        a, b = av_patterns[cb[0] - 1], av_patterns[cb[1] - 1, :]
-        tmp = a - b
-
-        if norm == 'l1':
-            diff_patterns[i, :] = np.abs(tmp / (a.std() + b.std()))
-        else:
-            diff_patterns[i, :] = (tmp ** 2) / (a.std() ** 2 +
-                                                b.std() ** 2)
+    classes, y_idx = np.unique(y, return_inverse=True)
+    n_class, n_features = classes.size, X.shape[1]
+
+    # Calculate mean patterns (all classes at once)
+    n_samples = y_idx.size
+    indicator = csr_matrix((np.ones(n_samples), (y_idx, np.arange(n_samples))),
+                           shape=(n_class, n_samples))
+    av_patterns = indicator.dot(X)
+    if issparse(av_patterns):
+        av_patterns = av_patterns.toarray()
+
+    av_patterns = av_patterns / np.bincount(y_idx)[:, np.newaxis]
+    av_patterns[np.isnan(av_patterns)] = 0
+
+    # Normalization-constants of all pairs of classes
+    std = av_patterns.std(axis=1)
+    if norm == 'l1':
+        denom = std[:, np.newaxis] + std[np.newaxis, :]
+    else:
+        denom = std[:, np.newaxis] ** 2 + std[np.newaxis, :] ** 2
+
+    # Difference vectors, z-score standardization, absolute, for all pairs
+    # (in the order of itertools.combinations), in blocks of features
+    idx_a, idx_b = np.triu_indices(n_class, k=1)
+    n_pairs = idx_a.size
+
     if balance:
-        scores_ = diff_patterns
+        scores_ = np.zeros((n_pairs, n_features))
+        block_size = max(1, block_elements // max(n_pairs, 1))
+
+        for start in range(0, n_features, block_size):
+            block = slice(start, start + block_size)
+            scores_[:, block] = _pair_scores(av_patterns[idx_a, block],
+                                             av_patterns[idx_b, block],
+                                             denom[idx_a, idx_b], norm)
     else:
-        scores_ = np.mean(diff_patterns, axis=0)
+        # Mean across pairs without creating the diff_patterns
+        scores_ = np.zeros(n_features)
+        block_size = max(1, block_elements // n_class)
+
+        for i in range(n_class - 1):
+            others = np.arange(i + 1, n_class)
+
+            for start in range(0, n_features, block_size):
+                block = slice(start, start + block_size)
+                scores_[block] += _pair_scores(
+                    av_patterns[i, block][np.newaxis, :],
+                    av_patterns[others, block], denom[i, others],
+                    norm).sum(axis=0)
+
+        scores_ /= n_pairs
 
     return scores_
+
+
+def _pair_scores(a, b, denom, norm):
+    """ Normalized differences between (rows of) mean patterns a and b. """
+
+    if norm == 'l1':
+        return np.abs((a - b) / denom[:, np.newaxis])
+    else:
+        return (a - b) ** 2 / denom[:, np.newaxis]
+
+
+class FoldAwareFClassif(object):
+    """ F-classif (ANOVA) scorer which reuses statistics across folds.
+
+    Computes the same F-values and p-values as sklearn's ``f_classif``, but
+    precomputes the per-class sums and sums of squares of the full dataset
+    once (in ``__init__``). When called with a subset of the samples (e.g. a
+    train-set in a cross-validation loop), the statistics of the subset are
+    obtained by subtracting the contributions of the left-out samples (or by
+    summing those of the subset, when that is cheaper), which costs
+    O(n_test x n_features) arithmetic instead of O(n_train x n_features)
+    per fold.
+
+    Like the ``ConfoundRegressor``, it infers which samples it receives by
+    looking up (a hash of) the rows of X in the full dataset; when some rows
+    (or their labels) do not match, it falls back to ``f_classif``. To make
+    the lookup cheap, rows are hashed on a subset of (at most n_key_features,
+    non-constant) features only; the matched rows are then compared, one at
+    a time and without copies, with the full rows of X (falling back to
+    ``f_classif`` if they differ). This exact check reads every value of
+    the X it receives once, so each call costs an O(n_samples x n_features)
+    comparison on top of the O(n_test x n_features) arithmetic.
+
+    Parameters
+    ----------
+    X : numpy array
+        Array of shape (n_samples, n_features) with the full dataset.
+    y : numpy array
+        Array of shape (n_samples,) with the class labels.
+    n_key_features : int
+        Number of features used to identify samples.
+
+    Examples
+    --------
+    >>> scorer = FoldAwareFClassif(mvp.X, mvp.y)
+    >>> selector = SelectAboveCutoff(cutoff=2.3, score_func=scorer)
+    """
+
+    def __init__(self, X, y, n_key_features=1024):
+
+        self.X = X
+        self.y = np.asarray(y)
+        self.classes_, self.y_idx_ = np.unique(self.y, return_inverse=True)
+        self.counts_ = np.bincount(self.y_idx_)
+
+        indicator = self._indicator(np.arange(self.y.size))
+        self.sums_ = indicator.dot(X)
+        self.sqsums_ = indicator.dot(np.square(X, dtype=np.float64))
+        # Evenly spaced non-constant features to identify samples with
+        varying = np.flatnonzero((self.sqsums_.sum(axis=0) -
+                                  self.sums_.sum(axis=0) ** 2 / self.y.size)
+                                 > 0)
+        n_key = min(n_key_features, varying.size)
+        self.key_features_ = varying[np.linspace(0, varying.size - 1,
+                                                 n_key).astype(int)]
+        self._row_index = None
+
+    def __call__(self, X, y):
+
+        idx = self._get_sample_idx(X, y)
+
+        if idx is None:
+            return f_classif(X, y)
+
+        in_fold = np.zeros(self.y.size, dtype=bool)
+        in_fold[idx] = True
+
+        if idx.size <= self.y.size - idx.size:
+            sums, sqsums, counts = self._stats(idx)
+        else:
+            out_sums, out_sqsums, out_counts = self._stats(
+                np.flatnonzero(~in_fold))
+            sums = self.sums_ - out_sums
+            sqsums = self.sqsums_ - out_sqsums
+            counts = self.counts_ - out_counts
+
+        # Only classes present in this subset (like f_classif)
+        present = counts > 0
+        return _f_oneway(sums[present], sqsums[present], counts[present])
+
+    def __deepcopy__(self, memo):
+        # The statistics are read-only, so (sklearn's) clones can share them
+        return self
+
+    def _indicator(self, idx):
+        """ Sparse (n_classes x n_samples) class-indicator of samples idx. """
+        return csr_matrix((np.ones(idx.size), (self.y_idx_[idx],
+                                               np.arange(idx.size))),
+                          shape=(self.classes_.size, idx.size))
+
+    def _stats(self, idx):
+        """ Per-class sums, sums of squares, and counts of samples idx. """
+
+        indicator = self._indicator(idx)
+        X_sub = np.asarray(self.X[idx], dtype=np.float64)
+        counts = np.bincount(self.y_idx_[idx], minlength=self.classes_.size)
+        return indicator.dot(X_sub), indicator.dot(X_sub ** 2), counts
+
+    def _get_sample_idx(self, X, y):
+        """ Looks up the indices of the rows of X (None if not found). """
+
+        if self._row_index is None:
+            self._row_index = {}
+            X_key = np.asarray(self.X[:, self.key_features_])
+            for i, row in enumerate(X_key):
+                self._row_index.setdefault(_hash_row(row), []).append(i)
+
+        if X.shape[1] != self.X.shape[1]:
+            return None
+
+        X_key = np.asarray(X[:, self.key_features_], dtype=self.X.dtype)
+        used, idx = {}, []
+
+        for row in X_key:
+            key = _hash_row(row)
+            matches, n_used = self._row_index.get(key, []), used.get(key, 0)
+
+            # Identical rows are matched to subsequent samples
+            if n_used >= len(matches):
+                return None
+
+            idx.append(matches[n_used])
+            used[key] = n_used + 1
+
+        idx = np.array(idx, dtype=np.int64)
+
+        if not np.array_equal(self.y[idx], np.asarray(y)):
+            return None
+
+        # Rows that only agree on the key features are not the same samples;
+        # rows are compared one at a time to avoid copying (a subset of) X
+        for i, row in zip(idx, X):
+            if not np.array_equal(self.X[i], row):
+                return None
+
+        return idx
+
+
+def _f_oneway(sums, sqsums, counts):
+    """ One-way ANOVA (like sklearn's f_oneway) from per-class sums (and
+    sums of squares) of shape [n_classes, n_features]. """
+
+    n_classes, n_samples = counts.size, counts.sum()
+    square_of_sums_alldata = sums.sum(axis=0) ** 2
+    sstot = sqsums.sum(axis=0) - square_of_sums_alldata / n_samples
+    ssbn = (sums ** 2 / counts[:, np.newaxis]).sum(axis=0) - \
+        square_of_sums_alldata / n_samples
+    sswn = sstot - ssbn
+    msb = ssbn / (n_classes - 1)
+    msw = sswn / (n_samples - n_classes)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        f = msb / msw
+
+    return f, fdtrc(n_classes - 1, n_samples - n_classes, f)
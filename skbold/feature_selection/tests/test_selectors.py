@@ -3,9 +3,16 @@ from __future__ import absolute_import, division, print_function
 import os.path as op
 from ...core import MvpWithin
 from ... import testdata_path
-from ..selectors import fisher_criterion_score
+from ..selectors import fisher_criterion_score, FoldAwareFClassif
+from ..filters import SelectAboveCutoff
+from sklearn.feature_selection import f_classif
+from sklearn.model_selection import StratifiedKFold, cross_val_score
+from sklearn.pipeline import Pipeline
+from sklearn.svm import SVC
 import pytest
 import os
+import numpy as np
+from itertools import combinations
 import random
 from glob import glob
 
@@ -23,4 +30,68 @@ mvp_within.create()
 def test_fisher_criterion_score():
 
     scores = fisher_criterion_score(mvp_within.X, mvp_within.y)
-    assert(scores.shape[0] == mvp_within.X.shape[1])
\ No newline at end of file
+    assert(scores.shape[0] == mvp_within.X.shape[1])
+
+
+@pytest.mark.selector
+@pytest.mark.parametrize('norm', ['l1', 'l2'])
+@pytest.mark.parametrize('balance', [False, True])
+def test_fisher_criterion_score_vectorized(norm, balance):
+
+    rng = np.random.RandomState(0)
+    y = np.repeat(np.arange(12), 4)
+    X = rng.randn(y.size, 30)
+    X[y == 3, 5] = np.nan
+
+    # Reference: loop over all pairs of classes
+    av = np.array([X[y == c].mean(axis=0) for c in np.unique(y)])
+    av[np.isnan(av)] = 0
+    ref = []
+    for a, b in combinations(av, 2):
+        if norm == 'l1':
+            ref.append(np.abs((a - b) / (a.std() + b.std())))
+        else:
+            ref.append((a - b) ** 2 / (a.std() ** 2 + b.std() ** 2))
+
+    ref = np.array(ref) if balance else np.mean(ref, axis=0)
+    scores = fisher_criterion_score(X, y, norm=norm, balance=balance,
+                                    block_elements=50)
+    assert(np.allclose(scores, ref))
+
+
+@pytest.mark.selector
+def test_fold_aware_f_classif():
+
+    rng = np.random.RandomState(0)
+    y = np.repeat(np.arange(3), 10)
+    X = rng.randn(y.size, 40)
+    X[:, :5] += y[:, np.newaxis]
+    X[1] = X[0]  # identical samples
+
+    scorer = FoldAwareFClassif(X, y)
+    cv = StratifiedKFold(n_splits=3, shuffle=True, random_state=0)
+    for train, test in cv.split(X, y):
+        for idx in [train, test]:
+            f, p = scorer(X[idx], y[idx])
+            f_ref, p_ref = f_classif(X[idx], y[idx])
+            assert(np.allclose(f, f_ref))
+            assert(np.allclose(p, p_ref))
+
+    # Unknown samples fall back to f_classif
+    X_new, y_new = rng.randn(10, 40), np.tile([0, 1], 5)
+    assert(np.allclose(scorer(X_new, y_new)[0], f_classif(X_new, y_new)[0]))
+
+    # Samples that only match on the key features are not mistaken for the
+    # original samples (swapped non-key features fall back to f_classif)
+    scorer = FoldAwareFClassif(X, y, n_key_features=5)
+    X_swap = X.copy()
+    others = np.setdiff1d(np.arange(X.shape[1]), scorer.key_features_)
+    X_swap[np.ix_([2, 12], others)] = X_swap[np.ix_([12, 2], others)]
+    assert(np.allclose(scorer(X_swap, y)[0], f_classif(X_swap, y)[0]))
+
+    # Works as score_func in (cloned) pipelines
+    pipes = [Pipeline([('ufs', SelectAboveCutoff(cutoff=2, score_func=sf)),
+                       ('clf', SVC(kernel='linear'))])
+             for sf in [f_classif, scorer]]
+    scores = [cross_val_score(pipe, X, y, cv=cv) for pipe in pipes]
+    assert(np.allclose(scores[0], scores[1]))
@@ -12,6 +12,7 @@ import os.path as op
 from sklearn.base import BaseEstimator, TransformerMixin
 from skbold.utils import load_roi_mask  # to prevent circular imports
 from skbold.core import convert2epi
+from skbold.core.cache import get_cache_dir
 from glob import glob
 
 
@@ -108,7 +109,10 @@ class RoiIndexer(BaseEstimator, TransformerMixin):
             epi_name = op.basename(self.mask).split('.')[0]
             epi_exists = glob(op.join(self.reg_dir,
                                       '*%s_epi.nii.gz' % epi_name))
-            if epi_exists:
+
+            # With a warp-cache, convert2epi itself checks whether the
+            # existing file is up to date
+            if epi_exists and get_cache_dir('warps') is None:
                 self.mask = epi_exists[0]
             else:
 
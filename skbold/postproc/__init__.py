@@ -13,6 +13,11 @@ univariate feature selection procedure) or model weights
 (e.g. SVM-coefficients). These coefficients can kept track of as
 raw weights [1]_ or as 'forward-transformed' weights [2]_.
 
+The cross_validate_mvp function runs the folds of a pipeline (on an Mvp)
+in parallel and keeps track of the results with an MvpResults object.
+The PermutationTest class builds on it to compute permutation-based
+p-values of model performance (and FWE-corrected voxel-scores).
+
 The postproc subpackage additionally contains the function
 'extract_roi_info', which allows to calculate the amount of voxels (and
 other statistics) per ROI in a single statistical brain map and output a
@@ -40,6 +45,9 @@ from .extract_roi_info import extract_roi_info
 from .mvp_results import MvpResults, MvpAverageResults
 from .cluster_size_threshold import cluster_size_threshold
 from .prevalence import PrevalenceInference
+from .cross_validate import cross_validate_mvp
+from .permutation import PermutationTest
 
 __all__ = ['extract_roi_info', 'MvpResults', 'MvpAverageResults',
-           'cluster_size_threshold', 'PrevalenceInference']
+           'cluster_size_threshold', 'PrevalenceInference',
+           'cross_validate_mvp', 'PermutationTest']
@@ -0,0 +1,118 @@
+# Cross-validation driver which fits the folds of a pipeline on an Mvp in
+# parallel and keeps track of the results with MvpResults.
+
+# Author: Lukas Snoek [lukassnoek.github.io]
+# Contact: lukassnoek@gmail.com
+# License: 3 clause BSD
+
+from __future__ import division, print_function, absolute_import
+import os.path as op
+import shutil
+import numpy as np
+from tempfile import mkdtemp
+from sklearn.base import clone, is_classifier
+from sklearn.model_selection import check_cv
+from sklearn.externals.joblib import Parallel, delayed
+from .mvp_results import MvpResults, _extract_values_from_pipeline
+
+
+def cross_validate_mvp(mvp, pipeline, cv=5, mvp_results=None, n_jobs=1,
+                       mmap_dir=None, verbose=0, **kwargs):
+    """ Cross-validates a pipeline on an Mvp, with folds run in parallel.
+
+    Each fold is fit (on a clone of the pipeline) in a separate process.
+    Instead of copying X to every process, the workers read it from a
+    memory-mapped file (X itself, if it is already memory-mapped, e.g. by
+    ``Mvp.load(..., mmap_mode='r')``). Workers only return the test-indices,
+    predictions, and extracted coefficients/scores (and index of selected
+    features), which are merged into an ``MvpResults`` object in fold order.
+
+    Parameters
+    ----------
+    mvp : Mvp-object
+        Mvp (e.g. MvpBetween or MvpWithin) with X and y.
+    pipeline : scikit-learn Pipeline (or estimator)
+        Pipeline to cross-validate (is not modified).
+    cv : int or cross-validation generator
+        Cross-validation scheme (see sklearn's ``check_cv``).
+    mvp_results : MvpResults
+        MvpResults object to update (with n_iter equal to the number of
+        folds). If None, one is created with the keyword arguments.
+    n_jobs : int
+        Number of processes to run the folds with (-1 means all cores).
+    mmap_dir : str
+        Directory to write the memory-mapped X to (if X is not already
+        memory-mapped); default: the system's temporary directory.
+    verbose : int
+        Verbosity of the parallel computation.
+    **kwargs : keyword arguments
+        Arguments for ``MvpResults`` (e.g. ``feature_scoring='fwm'`` or
+        metrics, such as ``accuracy=accuracy_score``).
+
+    Returns
+    -------
+    mvp_results : MvpResults
+        Updated MvpResults object (call ``compute_scores`` for the results).
+
+    Examples
+    --------
+    >>> mvpr = cross_validate_mvp(mvp, pipe, cv=StratifiedKFold(5), n_jobs=5,
+    ...                           feature_scoring='fwm',
+    ...                           accuracy=accuracy_score)
+    >>> df, fscores = mvpr.compute_scores()
+    """
+
+    X, y = mvp.X, mvp.y
+    cv = check_cv(cv, y, classifier=is_classifier(pipeline))
+    folds = list(cv.split(X, y))
+
+    if mvp_results is None:
+        mvp_results = MvpResults(mvp=mvp, n_iter=len(folds), **kwargs)
+
+    fs = mvp_results.fs
+    X, tmp_dir = _memmap_array(X, mmap_dir, n_jobs)
+
+    try:
+        results = Parallel(n_jobs=n_jobs, verbose=verbose)(
+            delayed(_fit_fold)(X, y, pipeline, train_idx, test_idx, fs)
+            for train_idx, test_idx in folds)
+    finally:
+        del X
+
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir)
+
+    # Results are returned in fold order
+    for test_idx, y_pred, values in results:
+        mvp_results.update(test_idx, y_pred, values=values)
+
+    return mvp_results
+
+
+def _fit_fold(X, y, pipeline, train_idx, test_idx, fs):
+    """ Fits and evaluates a single fold. """
+
+    pipe = clone(pipeline)
+    pipe.fit(X[train_idx], y[train_idx])
+    y_pred = pipe.predict(X[test_idx])
+
+    if fs is None:
+        values = None
+    else:
+        values = _extract_values_from_pipeline(pipe, fs, X.shape[1])
+
+    return test_idx, y_pred, values
+
+
+def _memmap_array(X, mmap_dir=None, n_jobs=2):
+    """ Returns a read-only memory-mapped version of X (for n_jobs != 1)
+    and the temporary directory it is stored in (or None). """
+
+    if n_jobs == 1 or isinstance(X, np.memmap):
+        return X, None
+
+    tmp_dir = mkdtemp(dir=mmap_dir)
+    fn = op.join(tmp_dir, 'X.npy')
+    np.save(fn, X)
+
+    return np.load(fn, mmap_mode='r'), tmp_dir
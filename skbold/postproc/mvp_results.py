@@ -38,6 +38,16 @@ class MvpResults(object):
         relevant for `type_model='classification'`)
     verbose : bool
         Whether to print extra output.
+    accumulate : str
+        How to keep track of the feature-scores across folds: 'full'
+        (default) stores the values of all folds in ``voxel_values``
+        (shape = [n_iter, n_features(, n_class)]), while 'online' only keeps
+        track of a running mean and variance (Welford's algorithm), such that
+        memory does not depend on n_iter. The 'online' mode does not support
+        multiclass='ovo' in ``compute_scores``.
+    dtype : numpy dtype
+        Data-type of the (accumulated) feature-scores (default: float64);
+        float32 halves the memory.
     **metrics : keyword-arguments
         Keyword arguments of the form: `name_metric: metric_function`;
         any metric from scikit-learn works (or other metrics, as long as
@@ -57,7 +67,7 @@ class MvpResults(object):
 
     def __init__(self, mvp, n_iter, type_model='classification',
                  feature_scoring=None, confmat=False, verbose=False,
-                 **metrics):
+                 accumulate='full', dtype=np.float64, **metrics):
 
         for name, metric in metrics.items():
             setattr(self, name, np.zeros(n_iter))
@@ -82,15 +92,27 @@ class MvpResults(object):
         self.voxel_values = None
         self.df = None
         self.metrics = metrics
+        self.accumulate = accumulate
+        self.dtype = dtype
 
         if type_model == 'classification':
             if self.n_class < 3 or self.fs == 'ufs':
-                self.voxel_values = np.zeros((self.n_iter, mvp.X.shape[1]))
+                shape = (mvp.X.shape[1],)
             else:
-                self.voxel_values = np.zeros((self.n_iter, mvp.X.shape[1],
-                                              self.n_class))
+                shape = (mvp.X.shape[1], self.n_class)
         else:
-            self.voxel_values = np.zeros((self.n_iter, mvp.X.shape[1]))
+            shape = (mvp.X.shape[1],)
+
+        if accumulate == 'full':
+            self.voxel_values = np.zeros((self.n_iter,) + shape, dtype=dtype)
+        elif accumulate == 'online':
+            # Running count, mean, and sum of squared deviations
+            self.n_updates = 0
+            self.voxel_mean = np.zeros(shape, dtype=dtype)
+            self.voxel_m2 = np.zeros(shape, dtype=dtype)
+        else:
+            raise ValueError("Accumulate should be 'full' or 'online', "
+                             "not '%s'." % accumulate)
 
         if confmat:
             self.metrics['confmat'] = confusion_matrix
@@ -132,7 +154,7 @@ class MvpResults(object):
                 param = [param]
             return {p: getattr(model, p) for p in param}
 
-    def update(self, test_idx, y_pred, pipeline=None):
+    def update(self, test_idx, y_pred, pipeline=None, values=None):
         """ Updates with information from current fold.
 
         Parameters
@@ -144,6 +166,11 @@ class MvpResults(object):
         pipeline : scikit-learn Pipeline object
             pipeline from which relevant scores/coefficients will be
             extracted.
+        values : tuple
+            Tuple with the scores/coefficients and the (boolean) index of
+            selected features, as already extracted from a fitted pipeline
+            (e.g. by a parallel worker; see ``cross_validate_mvp``). Used
+            instead of pipeline.
         """
         i = self.iter
         y_true = self.y[test_idx]
@@ -155,8 +182,13 @@ class MvpResults(object):
             if self.verbose:
                 print("%s: %.3f" % (name, tmp[i]))
 
-        if pipeline is not None and self.fs is not None:
-            self._update_voxel_values(pipeline)
+        if self.fs is not None:
+
+            if values is None and pipeline is not None:
+                values = self._extract_values_from_pipeline(pipeline)
+
+            if values is not None:
+                self._update_voxel_values(*values)
 
         self.iter += 1
 
@@ -240,43 +272,26 @@ class MvpResults(object):
 
     def _calculate_feature_scores(self, multiclass, to_tstat):
 
-        values = self.voxel_values
-
-        if multiclass == 'ovo':
-            # in scikit-learn 'ovo', Positive labels are reversed
-            values *= -1
-            n_class = len(np.unique(self.mvp.y))
-            n_models = comb(n_class, 2, exact=True)
-            cmb = list(combinations(range(n_models), 2))
-
-            scores = np.zeros((values.shape[0], values.shape[1], n_class))
-
-            for number in range(n_models):
+        if self.accumulate == 'online':
 
-                for i, c in enumerate(cmb):
+            if multiclass == 'ovo':
+                raise ValueError("Multiclass 'ovo' is not supported with "
+                                 "accumulate='online'; use 'full' instead.")
 
-                    if number in c:
-
-                        if c.index(number) == 1:
-                            val = values[:, :, i] * -1
-                        else:
-                            val = values[:, :, i]
-
-                        scores[:, :, number] += val
-
-            values = scores / n_class
+            n = self.n_iter
+            m_values, sd_values = self._get_online_moments()
+        else:
+            values = self._get_full_values(multiclass)
+            n = values.shape[0]
+            m_values, sd_values = values.mean(axis=0), values.std(axis=0)
 
-        nonzero_idx = values.sum(axis=0) != 0
+        nonzero_idx = m_values != 0
+        values = np.zeros(m_values.shape)
         if to_tstat:
-            n = values.shape[0]
-            m_values = values[:, nonzero_idx].mean(axis=0)
-            se_values = values[:, nonzero_idx].std(axis=0) / np.sqrt(n - 1)
-            values = values.sum(axis=0)
-            values[nonzero_idx] = m_values / se_values
+            se_values = sd_values[nonzero_idx] / np.sqrt(n - 1)
+            values[nonzero_idx] = m_values[nonzero_idx] / se_values
         else:
-            m_values = values[:, nonzero_idx].mean(axis=0)
-            values = values.sum(axis=0)
-            values[nonzero_idx] = m_values
+            values[nonzero_idx] = m_values[nonzero_idx]
 
         fids = np.unique(self.featureset_id)
 
@@ -305,6 +320,59 @@ class MvpResults(object):
 
         return to_return
 
+    def _get_full_values(self, multiclass):
+
+        values = self.voxel_values
+
+        if multiclass == 'ovo':
+            # in scikit-learn 'ovo', Positive labels are reversed
+            values *= -1
+            n_class = len(np.unique(self.mvp.y))
+            n_models = comb(n_class, 2, exact=True)
+            cmb = list(combinations(range(n_models), 2))
+
+            scores = np.zeros((values.shape[0], values.shape[1], n_class))
+
+            for number in range(n_models):
+
+                for i, c in enumerate(cmb):
+
+                    if number in c:
+
+                        if c.index(number) == 1:
+                            val = values[:, :, i] * -1
+                        else:
+                            val = values[:, :, i]
+
+                        scores[:, :, number] += val
+
+            values = scores / n_class
+
+        return values
+
+    def _get_online_moments(self):
+        """ Returns the mean and (population) std across all n_iter folds. """
+
+        # Folds without an update count as all-zero values (as in the
+        # 'full' mode), which are merged with the running moments
+        count, n = self.n_updates, self.n_iter
+        mean = self.voxel_mean.astype(np.float64)
+        m2 = self.voxel_m2 + mean ** 2 * count * (n - count) / n
+
+        return mean * count / n, np.sqrt(m2 / n)
+
+    def _accumulate(self, row):
+        """ Adds the values of a fold (row) to the voxel-values. """
+
+        if self.accumulate == 'full':
+            self.voxel_values[self.iter] = row
+        else:
+            # Welford's online algorithm
+            self.n_updates += 1
+            delta = row - self.voxel_mean
+            self.voxel_mean += delta / self.n_updates
+            self.voxel_m2 += delta * (row - self.voxel_mean)
+
     def _check_mvp_attributes(self):
 
         if not isinstance(self.affine, list):
@@ -317,93 +385,120 @@ class MvpResults(object):
             self.data_name = [self.data_name]
 
     def _extract_values_from_pipeline(self, pipe):
+        return _extract_values_from_pipeline(pipe, self.fs, self.X.shape[1])
 
-        if pipe.__class__.__name__ == 'GridSearchCV':
-            pipe = pipe.best_estimator_
-        elif pipe.__class__.__name__ != 'Pipeline':
-            # hack to allow non-pipelines
-            pipe.idx_ = np.ones(pipe.coef_.size, dtype=bool)
-            pipe_steps = {pipe.__class__.__name__: pipe}
-        else:
-            pipe_steps = copy(pipe.named_steps)
+    def _update_voxel_values(self, val, idx):
 
-        for name, step in pipe_steps.items():
+        self.n_vox[self.iter] = val.shape[0]
 
-            if hasattr(step, 'best_estimator_'):
-                pipe_steps[name] = step.best_estimator_
-            else:
-                pipe_steps[name] = step
-
-        match = 'coef_' if self.fs in ['fwm', 'forward'] else 'scores_'
-        val = [getattr(step, match) for step in pipe_steps.values()
-               if hasattr(step, match)]
-
-        ensemble = [step for step in pipe_steps.values()
-                    if hasattr(step, 'estimators_')]
-
-        if len(val) == 1:
-            val = val[0]
-        elif len(val) == 0 and len(ensemble) == 1:
-            val = np.concatenate([ens.coef_ for ens in ensemble[0]]).mean(
-                axis=0)
-        elif len(val) == 0:
-            raise ValueError('Found no %s attribute anywhere in the '
-                             'pipeline!' % match)
+        if self.accumulate == 'full':
+            shape = self.voxel_values.shape[1:]
         else:
-            raise ValueError('Found more than one %s attribute in the '
-                             'pipeline!' % match)
+            shape = self.voxel_mean.shape
 
-        idx = [step.get_support() for step in pipe_steps.values()
-               if callable(getattr(step, "get_support", None))]
+        row = _values_to_row(val, idx, self.fs, self.X, shape, self.dtype)
+        self._accumulate(row)
 
-        if len(idx) == 0:
-            idx = [getattr(step, 'idx_') for step in pipe_steps.values()
-                   if hasattr(step, 'idx_')]
+    def _calculate_forward_mapping(self, val, idx):
+        return _forward_mapping(self.X[:, idx], val)
 
-        if len(idx) == 1:
-            idx = idx[0]
-        elif len(idx) > 1:
-            msg = 'Found more than one index in pipeline!'
-            raise ValueError(msg)
-        else:
-            msg = 'Found no index in pipeline! Assuming no voxel selection.'
-            print(msg)
-            idx = np.ones(self.X.shape[1], dtype=bool)
 
-        val = np.squeeze(val)
-        if val.shape[0] != idx.sum():
-            val = val.T
+def _values_to_row(val, idx, fs, X, shape, dtype=np.float64):
+    """ Maps the coefficients/scores of a fold to all features (a row of
+    voxel-values), according to the feature-scoring method (fs). """
 
-        return val, idx
+    row = np.zeros(shape, dtype=dtype)
 
-    def _update_voxel_values(self, pipe):
+    if fs == 'fwm':
+        row[idx] = val
+    elif fs == 'ufs':
+        row[:] = val
+    elif fs == 'forward':
+        row[idx] = _forward_mapping(X[:, idx], val)
+    else:
+        msg = "Please specify either 'ufs', 'fwm', or 'forward'."
+        raise ValueError(msg)
 
-        val, idx = self._extract_values_from_pipeline(pipe)
-        self.n_vox[self.iter] = val.shape[0]
+    return row
 
-        if self.fs == 'fwm':
-            self.voxel_values[self.iter, idx] = val
-        elif self.fs == 'ufs':
-            self.voxel_values[self.iter, :] = val
-        elif self.fs == 'forward':
-            A = self._calculate_forward_mapping(val, idx)
-            self.voxel_values[self.iter, idx] = A
-        else:
-            msg = "Please specify either 'ufs', 'fwm', or 'forward'."
-            raise ValueError(msg)
 
-    def _calculate_forward_mapping(self, val, idx):
+def _forward_mapping(X, W):
+    """ Matrix-free Haufe forward model, cov(X) W, for X (n_samples x
+    n_voxels) and W (n_voxels[, n_models]).
 
-        # Haufe et al. (2014). On the interpretation of weight vectors of
-        # linear models in multivariate neuroimaging. Neuroimage, 87, 96-110.
+    Haufe et al. (2014). On the interpretation of weight vectors of linear
+    models in multivariate neuroimaging. Neuroimage, 87, 96-110.
+
+    Cov(X) W is computed as Xc.T (Xc W) / (n - 1), i.e., without the
+    n_voxels x n_voxels covariance matrix. As the columns of Xc W sum to
+    zero, Xc.T (Xc W) = X.T (Xc W), so X needs no centered copy.
+    """
 
-        W = val
-        X = self.X[:, idx]
+    XcW = X.dot(W) - X.mean(axis=0).dot(W)
+    return X.T.dot(XcW) / (X.shape[0] - 1)
 
-        # Cov[x(n), y(n)]
-        A = np.cov(X.T).dot(W)
 
-        return A
+def _extract_values_from_pipeline(pipe, fs, n_features):
+    """ Extracts the coefficients (or scores) and index of selected features
+    from a fitted pipeline. """
+
+    if pipe.__class__.__name__ == 'GridSearchCV':
+        pipe = pipe.best_estimator_
+    elif pipe.__class__.__name__ != 'Pipeline':
+        # hack to allow non-pipelines
+        pipe.idx_ = np.ones(pipe.coef_.size, dtype=bool)
+        pipe_steps = {pipe.__class__.__name__: pipe}
+    else:
+        pipe_steps = copy(pipe.named_steps)
+
+    for name, step in pipe_steps.items():
+
+        if hasattr(step, 'best_estimator_'):
+            pipe_steps[name] = step.best_estimator_
+        else:
+            pipe_steps[name] = step
+
+    match = 'coef_' if fs in ['fwm', 'forward'] else 'scores_'
+    val = [getattr(step, match) for step in pipe_steps.values()
+           if hasattr(step, match)]
+
+    ensemble = [step for step in pipe_steps.values()
+                if hasattr(step, 'estimators_')]
+
+    if len(val) == 1:
+        val = val[0]
+    elif len(val) == 0 and len(ensemble) == 1:
+        val = np.concatenate([ens.coef_ for ens in ensemble[0]]).mean(
+            axis=0)
+    elif len(val) == 0:
+        raise ValueError('Found no %s attribute anywhere in the '
+                         'pipeline!' % match)
+    else:
+        raise ValueError('Found more than one %s attribute in the '
+                         'pipeline!' % match)
+
+    idx = [step.get_support() for step in pipe_steps.values()
+           if callable(getattr(step, "get_support", None))]
+
+    if len(idx) == 0:
+        idx = [getattr(step, 'idx_') for step in pipe_steps.values()
+               if hasattr(step, 'idx_')]
+
+    if len(idx) == 1:
+        idx = idx[0]
+    elif len(idx) > 1:
+        msg = 'Found more than one index in pipeline!'
+        raise ValueError(msg)
+    else:
+        msg = 'Found no index in pipeline! Assuming no voxel selection.'
+        print(msg)
+        idx = np.ones(n_features, dtype=bool)
+
+    val = np.squeeze(val)
+    if val.shape[0] != idx.sum():
+        val = val.T
+
+    return val, idx
 
 
 class MvpAverageResults(object):
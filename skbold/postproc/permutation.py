@@ -0,0 +1,283 @@
+# Permutation test of the cross-validated performance (and, optionally,
+# voxel-scores, with max-statistic FWE-correction) of a pipeline on an Mvp.
+
+# Author: Lukas Snoek [lukassnoek.github.io]
+# Contact: lukassnoek@gmail.com
+# License: 3 clause BSD
+
+from __future__ import division, print_function, absolute_import
+from builtins import range
+import os
+import os.path as op
+import shutil
+import numpy as np
+import pandas as pd
+import nibabel as nib
+from sklearn.base import clone, is_classifier
+from sklearn.metrics import accuracy_score
+from sklearn.model_selection import check_cv
+from sklearn.utils import check_random_state
+from sklearn.externals.joblib import Parallel, delayed
+from ..utils.parallel import _effective_n_jobs
+from .cross_validate import cross_validate_mvp, _memmap_array
+from .mvp_results import _extract_values_from_pipeline, _values_to_row
+
+
+class PermutationTest(object):
+    """
+    Permutation test of the cross-validated model performance of a pipeline
+    on an Mvp object.
+
+    The observed performance (and feature-scores) are computed with
+    ``cross_validate_mvp`` (and kept in an ``MvpResults`` object). For the
+    null distribution, y is permuted with independent random streams (one
+    seed per permutation, such that results do not depend on the number of
+    processes) and the cross-validation is repeated (in parallel, on a
+    memory-mapped X), like sklearn's ``permutation_test_score``. Only the
+    null distributions of the (fold-averaged) scores are kept, and optionally
+    the maximum (absolute) voxel-score per permutation, which gives
+    family-wise error (FWE) corrected p-values per voxel [1]_.
+
+    Parameters
+    ----------
+    mvp : Mvp-object
+        Mvp (e.g. MvpBetween or MvpWithin) with X and y.
+    pipeline : scikit-learn Pipeline (or estimator)
+        Pipeline to evaluate (is not modified).
+    cv : int or cross-validation generator
+        Cross-validation scheme (see sklearn's ``check_cv``); the folds of
+        the permutations are split on the permuted y.
+    n_permutations : int
+        Number of permutations.
+    feature_scoring : str
+        Feature-scoring method ('fwm', 'forward', or 'ufs'; see
+        ``MvpResults``) for the voxel-scores.
+    fwe : bool
+        Whether to compute FWE-corrected p-values for the (fold-averaged)
+        voxel-scores, using the max-statistic (needs feature_scoring).
+    random_state : None, int, or RandomState
+        Random state to draw the seeds of the permutations with.
+    **metrics : keyword-arguments
+        Metrics of the form `name_metric: metric_function` (higher is
+        better), as in ``MvpResults``. Default: accuracy=accuracy_score.
+
+    Attributes
+    ----------
+    mvp_results : MvpResults
+        Results of the observed (unpermuted) cross-validation.
+    null_ : DataFrame
+        Null distribution (n_permutations x metrics) of the scores.
+    df : DataFrame
+        Observed score and p-value per metric.
+    voxel_scores_ : ndarray
+        Observed (absolute, fold-averaged) voxel-scores (if fwe).
+    null_max_ : ndarray
+        Maximum voxel-score per permutation (if fwe).
+    p_fwe_ : ndarray
+        FWE-corrected p-value per voxel (if fwe).
+
+    References
+    ----------
+    .. [1] Nichols, T.E., and Holmes, A.P. (2002). Nonparametric
+       permutation tests for functional neuroimaging: a primer with
+       examples. Human Brain Mapping, 15, 1-25.
+    """
+
+    def __init__(self, mvp, pipeline, cv=5, n_permutations=1000,
+                 feature_scoring=None, fwe=False, random_state=None,
+                 **metrics):
+
+        if fwe and feature_scoring is None:
+            raise ValueError("FWE-correction needs voxel-scores; set "
+                             "feature_scoring to 'fwm', 'forward', or 'ufs'.")
+
+        if not metrics:
+            metrics = {'accuracy': accuracy_score}
+
+        self.mvp = mvp
+        self.pipeline = pipeline
+        self.cv = cv
+        self.n_permutations = n_permutations
+        self.feature_scoring = feature_scoring
+        self.fwe = fwe
+        self.random_state = random_state
+        self.metrics = metrics
+        self.mvp_results = None
+        self.null_ = None
+        self.df = None
+
+    def run(self, n_jobs=1, mmap_dir=None, verbose=0):
+        """ Runs the observed and permuted cross-validations.
+
+        Parameters
+        ----------
+        n_jobs : int
+            Number of processes to run the permutations (and folds of the
+            observed cross-validation) with (-1 means all cores).
+        mmap_dir : str
+            Directory to write the memory-mapped X to (see
+            ``cross_validate_mvp``).
+        verbose : int
+            Verbosity of the parallel computation.
+
+        Returns
+        -------
+        df : DataFrame
+            Observed score and p-value per metric.
+        """
+
+        mvp, names = self.mvp, sorted(self.metrics.keys())
+        cv = check_cv(self.cv, mvp.y, classifier=is_classifier(self.pipeline))
+        folds = list(cv.split(mvp.X, mvp.y))
+        fs = self.feature_scoring if self.fwe else None
+
+        self.mvp_results = cross_validate_mvp(
+            mvp, self.pipeline, cv=folds, n_jobs=n_jobs, mmap_dir=mmap_dir,
+            verbose=verbose, feature_scoring=self.feature_scoring,
+            **self.metrics)
+
+        seeds = check_random_state(self.random_state).randint(
+            2 ** 31 - 1, size=self.n_permutations)
+        n_chunks = min(self.n_permutations, _effective_n_jobs(n_jobs) * 4)
+        X, tmp_dir = _memmap_array(mvp.X, mmap_dir, n_jobs)
+
+        try:
+            results = Parallel(n_jobs=n_jobs, verbose=verbose)(
+                delayed(_run_permutations)(X, mvp.y, self.pipeline, cv,
+                                           chunk, self.metrics, fs)
+                for chunk in np.array_split(seeds, n_chunks))
+        finally:
+            del X
+
+            if tmp_dir is not None:
+                shutil.rmtree(tmp_dir)
+
+        null = np.concatenate([res[0] for res in results])
+        self.null_ = pd.DataFrame(null, columns=names)
+
+        observed = [getattr(self.mvp_results, name).mean() for name in names]
+        pvals = [_permutation_pvalues(null[:, i], observed[i])
+                 for i in range(len(names))]
+        self.df = pd.DataFrame({'score': observed, 'p': pvals},
+                               index=names, columns=['score', 'p'])
+
+        if self.fwe:
+            self.null_max_ = np.concatenate([res[1] for res in results])
+            self.voxel_scores_ = _voxel_statistic(self._observed_values())
+            self.p_fwe_ = _permutation_pvalues(self.null_max_,
+                                               self.voxel_scores_)
+
+        return self.df
+
+    def write(self, path, name='permutation'):
+        """ Writes the results to disk.
+
+        Writes a tab-separated file (``name.tsv``) with the observed score
+        and p-value per metric and a numpy file (``name.npz``) with the null
+        distributions. If fwe, the FWE-corrected p-values are also written
+        as niftis (``name_pfwe[_dataname].nii.gz``).
+
+        Parameters
+        ----------
+        path : str
+            Where to write the results to disk
+        name : str
+            Name of the files (without extension).
+        """
+
+        if self.df is None:
+            raise ValueError("Cannot write results; call run() first!")
+
+        if not op.isdir(path):
+            os.makedirs(path)
+
+        self.df.to_csv(op.join(path, name + '.tsv'), sep='\t',
+                       index_label='metric')
+
+        to_save = {'null_' + col: self.null_[col].values
+                   for col in self.null_.columns}
+
+        if self.fwe:
+            to_save.update(null_max=self.null_max_,
+                           voxel_scores=self.voxel_scores_,
+                           p_fwe=self.p_fwe_)
+
+            mvp = self.mvp
+            fids = np.unique(mvp.featureset_id)
+            data_shape, affine, data_name = [
+                attr if isinstance(attr, list) else [attr]
+                for attr in (mvp.data_shape, mvp.affine, mvp.data_name)]
+
+            for pos_idx, fid in enumerate(fids):
+                cols = mvp.featureset_id == fid
+                shape = data_shape[pos_idx][:3]
+                img = np.ones(np.prod(shape), dtype=np.float32)
+                img[mvp.voxel_idx[cols]] = self.p_fwe_[cols]
+                img = nib.Nifti1Image(img.reshape(shape), affine[pos_idx])
+
+                fn = name + '_pfwe' if len(fids) == 1 else \
+                    name + '_pfwe_%s' % data_name[pos_idx]
+                nib.save(img, op.join(path, fn + '.nii.gz'))
+
+        np.savez(op.join(path, name + '.npz'), **to_save)
+
+    def _observed_values(self):
+        """ Fold-averaged voxel-values of the observed cross-validation. """
+
+        mvpr = self.mvp_results
+
+        if mvpr.accumulate == 'full':
+            return mvpr.voxel_values.mean(axis=0)
+        else:
+            return mvpr._get_online_moments()[0]
+
+
+def _run_permutations(X, y, pipeline, cv, seeds, metrics, fs):
+    """ Runs the cross-validation for a chunk of permutations (seeds);
+    returns their (fold-averaged) scores and maximum voxel-scores. """
+
+    names = sorted(metrics.keys())
+    scores = np.zeros((len(seeds), len(names)))
+    max_stats = np.zeros(len(seeds))
+
+    for i, seed in enumerate(seeds):
+        y_perm = np.random.RandomState(seed).permutation(y)
+        folds = list(cv.split(X, y_perm))
+        voxel_values = 0
+
+        for train_idx, test_idx in folds:
+            pipe = clone(pipeline)
+            pipe.fit(X[train_idx], y_perm[train_idx])
+            y_pred = pipe.predict(X[test_idx])
+            scores[i] += [metrics[name](y_perm[test_idx], y_pred)
+                          for name in names]
+
+            if fs is not None:
+                val, idx = _extract_values_from_pipeline(pipe, fs, X.shape[1])
+                shape = (X.shape[1],) if fs == 'ufs' else \
+                    (X.shape[1],) + val.shape[1:]
+                voxel_values = voxel_values + _values_to_row(val, idx, fs, X,
+                                                             shape)
+
+        scores[i] /= len(folds)
+
+        if fs is not None:
+            max_stats[i] = _voxel_statistic(voxel_values / len(folds)).max()
+
+    return scores, max_stats
+
+
+def _voxel_statistic(values):
+    """ Absolute voxel-scores (maximum across models/classes, if 2D). """
+
+    values = np.abs(values)
+    return values if values.ndim == 1 else values.max(axis=1)
+
+
+def _permutation_pvalues(null, observed):
+    """ P-values, (1 + #(null >= observed)) / (1 + n_permutations), of (an
+    array of) observed values. """
+
+    null = np.sort(null)
+    n_greater = null.size - np.searchsorted(null, observed, side='left')
+    return (1 + n_greater) / (1 + null.size)
@@ -1,12 +1,19 @@
 from __future__ import division, print_function, absolute_import
 
 from builtins import range
+import os
 import os.path as op
 import numpy as np
+from numpy.lib.format import open_memmap
+import pandas as pd
 import nibabel as nib
 from sklearn.externals import joblib
+from sklearn.externals.joblib import Parallel, delayed
 from scipy import stats
-from tqdm import trange
+from tqdm import tqdm
+from ..utils.parallel import _effective_n_jobs
+from glob import glob
+from tempfile import mkstemp
 from warnings import filterwarnings
 
 filterwarnings(action='ignore', category=RuntimeWarning)
@@ -30,6 +37,13 @@ class PrevalenceInference(object):
         What prevalence inference null (gamma < gamma0) to test
     alpha : float
         Significance level for hypothesis testing
+    dtype : numpy dtype
+        Data-type to store obs and perms in (e.g. np.float32, which halves
+        memory). If None (default), the data-type of the inputs is kept.
+    mmap_dir : str
+        If not None, the (masked) perms are stored in a .npy-file in this
+        directory and memory-mapped (read-only), such that parallel workers
+        (see ``run``) read from the same buffer instead of receiving a copy.
 
     Examples
     --------
@@ -48,21 +62,145 @@ class PrevalenceInference(object):
 	P2 = 100000
     """
 
-    def __init__(self, obs, perms, P2=100000, gamma0=0.5, alpha=0.05):
+    def __init__(self, obs, perms, P2=100000, gamma0=0.5, alpha=0.05,
+                 dtype=None, mmap_dir=None):
         """ Initializes PrevalenceInference object."""
 
         self.obs = obs
         self.perms = perms
+        self.dtype = dtype
+        self.mmap_dir = mmap_dir
+        self.perms_file = None
         self.P2 = P2
         self.gamma0 = gamma0
         self.alpha = alpha
         self.N = None
         self.K = None
         self.P1 = None
+        self.mask = None
+        self.u_rank = None
+        self.c_rank = None
+        self.brain_mask = None
+        self.affine = None
 
         print("This is experimental functionality! (i.e., not yet fully tested"
               " through)")
 
+    @classmethod
+    def from_niftis(cls, obs, perms, mask=None, mask_threshold=0, P2=100000,
+                    gamma0=0.5, alpha=0.05, dtype=np.float32, mmap_dir=None):
+        """ Creates a PrevalenceInference object from (first level) niftis.
+
+        The observed and permuted maps are streamed, one subject at a time,
+        into a preallocated (optionally memory-mapped) array of shape
+        [N x K x P1], in which K are the voxels within the mask.
+
+        Parameters
+        ----------
+        obs : str or list
+            Glob-pattern (or list of paths) of the 3D niftis with observed
+            values, one per subject (sorted in the same order as perms).
+        perms : str or list
+            Glob-pattern (or list of paths) of 4D niftis with first level
+            permutation maps (P1 volumes), one per subject. An item of the
+            list may also be a glob-pattern matching the P1 3D niftis of a
+            single subject.
+        mask : str, Nifti1Image, or ndarray
+            (Path to) mask; if None, all voxels are used (voxels that are
+            zero or NaN are always removed by ``run``).
+        mask_threshold : int or float
+            Minimum value to binarize the mask when it's probabilistic.
+        P2 : int
+            Number of second level permutations to run
+        gamma0 : float
+            What prevalence inference null (gamma < gamma0) to test
+        alpha : float
+            Significance level for hypothesis testing
+        dtype : numpy dtype
+            Data-type to store obs and perms in (default: float32).
+        mmap_dir : str
+            If not None, perms is streamed into a memory-mapped .npy-file in
+            this directory (instead of into memory).
+
+        Returns
+        -------
+        pvi : PrevalenceInference
+            Object with (masked) obs and perms; ``write`` additionally
+            writes the results as niftis (using the mask).
+        """
+
+        obs = _glob_files(obs)
+        perms = _glob_files(perms) if isinstance(perms, str) else perms
+
+        if len(obs) != len(perms):
+            msg = ("Found %i subjects with observed values, but %i with "
+                   "permutations!" % (len(obs), len(perms)))
+            raise ValueError(msg)
+
+        ref = nib.load(obs[0])
+        data_shape = ref.shape[:3]
+
+        if mask is None:
+            brain_mask = np.ones(data_shape, dtype=bool)
+        else:
+            if isinstance(mask, str):
+                mask = nib.load(mask)
+
+            if isinstance(mask, nib.Nifti1Image):
+                mask = mask.get_data()
+
+            brain_mask = mask > mask_threshold
+
+        if brain_mask.shape != data_shape:
+            msg = ("Shape of mask %r does not match shape of data %r!"
+                   % (brain_mask.shape, data_shape))
+            raise ValueError(msg)
+
+        N, K = len(obs), int(brain_mask.sum())
+        obs_data = np.zeros((N, K), dtype=dtype)
+        perms_data = None
+
+        for i in tqdm(range(N)):
+            obs_data[i] = nib.load(obs[i]).get_data()[brain_mask]
+            these_perms = _load_perms(perms[i], brain_mask)
+
+            if perms_data is None:  # P1 is only known after the first load
+                shape = (N, K, these_perms.shape[1])
+
+                if mmap_dir is None:
+                    perms_data = np.zeros(shape, dtype=dtype)
+                else:
+                    if not op.isdir(mmap_dir):
+                        os.makedirs(mmap_dir)
+
+                    fd, perms_file = mkstemp(suffix='.npy', dir=mmap_dir)
+                    os.close(fd)
+                    perms_data = open_memmap(perms_file, mode='w+',
+                                             dtype=dtype, shape=shape)
+
+            if these_perms.shape[1] != perms_data.shape[2]:
+                msg = ("Subject %i has %i permutations, but the first "
+                       "subject has %i!" % (i, these_perms.shape[1],
+                                            perms_data.shape[2]))
+                raise ValueError(msg)
+
+            perms_data[i] = these_perms
+
+        if mmap_dir is not None:
+            perms_data.flush()
+            del perms_data
+            perms_data = np.load(perms_file, mmap_mode='r')
+
+        pvi = cls(obs=obs_data, perms=perms_data, P2=P2, gamma0=gamma0,
+                  alpha=alpha, dtype=dtype, mmap_dir=mmap_dir)
+        pvi.brain_mask = brain_mask
+        pvi.affine = ref.affine
+
+        if mmap_dir is not None:
+            pvi.perms_file = perms_file
+
+        return pvi
+
     def _check_inputs(self):
         """ Checks and validates inputs data and extracts parameters. """
 
@@ -73,17 +211,23 @@ class PrevalenceInference(object):
         if self.perms.ndim > 3:
             raise ValueError("Your array should be 2D or 3D!")
 
+        if self.obs.ndim > 2:
+            msg = "Observed values (obs) should be 1 or 2 dimensional!"
+            raise ValueError(msg)
+
+        if self.dtype is not None:
+            self.obs = self.obs.astype(self.dtype, copy=False)
+
         if self.obs.ndim == 2:  # Assume we're dealing with multiple voxels
-            self.K = self.obs.shape[1]
             self._create_mask()  # To remove NaNs and such
+            self.K = self.obs.shape[1]
         else:  # We just have a single score
             self.K = 1
             # Add singleton axis to make calculations more parsimonious
             self.perms = self.perms[:, np.newaxis, :]
 
-        if self.obs.ndim > 2:
-            msg = "Observed values (obs) should be 1 or 2 dimensional!"
-            raise ValueError(msg)
+            if self.dtype is not None:
+                self.perms = self.perms.astype(self.dtype, copy=False)
 
         self.N = self.obs.shape[0]
         self.P1 = self.perms.shape[-1]
@@ -93,42 +237,107 @@ class PrevalenceInference(object):
 
     def _create_mask(self):
         """ Removes all zero or NaN voxels. """
-        # Stack all data together
-        all_data = np.dstack((self.obs[:, :, np.newaxis], self.perms))
-
-        # Voxels should be neither zero nor NaN
-        mask = np.logical_and(~(np.isnan(all_data).sum(axis=(0, 2)) > 0),
-                              ~((all_data == 0.0).sum(axis=(0, 2)) > 0))
-        all_data_nonzero = all_data[:, mask, :]  # index with mask
 
-        # Unstack obs and perms
-        self.obs = all_data_nonzero[:, :, 0]
-        self.perms = all_data_nonzero[:, :, 1:]
+        # Voxels should be neither zero nor NaN (checked subject-by-subject,
+        # to avoid copying all data at once)
+        invalid = np.isnan(self.obs).any(axis=0) | (self.obs == 0).any(axis=0)
+        for perms in self.perms:
+            invalid |= np.isnan(perms).any(axis=1) | (perms == 0).any(axis=1)
+
+        mask = ~invalid
+        N, K, P1 = self.perms.shape
+        shape = (N, int(mask.sum()), P1)
+        dtype = self.perms.dtype if self.dtype is None else self.dtype
+
+        if mask.all() and dtype == self.perms.dtype and \
+                (self.mmap_dir is None or isinstance(self.perms, np.memmap)):
+            perms = self.perms  # nothing to remove; no need to copy
+        elif self.mmap_dir is not None:
+
+            if not op.isdir(self.mmap_dir):
+                os.makedirs(self.mmap_dir)
+
+            old_file = self.perms_file  # e.g. created by from_niftis
+            fd, self.perms_file = mkstemp(suffix='.npy', dir=self.mmap_dir)
+            os.close(fd)
+            perms = open_memmap(self.perms_file, mode='w+', dtype=dtype,
+                                shape=shape)
+        else:
+            perms = np.zeros(shape, dtype=dtype)
+
+        if perms is not self.perms:
+            for i in range(N):
+                perms[i] = self.perms[i][mask]
+
+        if isinstance(perms, np.memmap) and perms is not self.perms:
+            perms.flush()
+            del perms
+            perms = np.load(self.perms_file, mmap_mode='r')
+
+            if old_file is not None:
+                self.perms = None
+                os.remove(old_file)
+
+        self.mask = mask
+        self.obs = self.obs[:, mask]
+        self.perms = perms
         print("Found %i non-zero voxels" % mask.sum())
 
-    def run(self):
-        """ Runs actual prevalence inference algorithm. """
+    def run(self, block_size=None, n_jobs=1, checkpoint=None,
+            chunk_size=10000, random_state=None):
+        """ Runs actual prevalence inference algorithm.
 
-        self._check_inputs()
+        Parameters
+        ----------
+        block_size : int
+            Number of second level permutations that are evaluated at once
+            (vectorized); larger blocks are faster, but need block_size x K
+            floats of memory. If None, the block size is chosen such that
+            a block takes about 128 MB. For a given random seed, the results
+            do not depend on the block size.
+        n_jobs : int
+            Number of processes to run the second level permutations with
+            (-1 means all cores). If n_jobs > 1, a checkpoint, or a
+            random_state is given, the P2 permutations are split in chunks
+            (of chunk_size) that each have their own random seed (derived
+            from random_state), such that, for a given random_state, the
+            results do not depend on n_jobs.
+        checkpoint : str
+            Path to a (.npz) file in which the ranks of finished chunks are
+            saved. If the file exists (e.g. from an interrupted run with the
+            same parameters), finished chunks are not run again.
+        chunk_size : int
+            Number of second level permutations per chunk (only used when
+            n_jobs > 1, a checkpoint, or a random_state is given).
+        random_state : int
+            Seed for the chunks' seeds. If None, it is drawn from numpy's
+            global random state (or read from the checkpoint); with n_jobs=1
+            and no checkpoint, numpy's global random state is then used
+            directly.
+        """
+
+        if self.N is None:  # inputs are only checked (and masked) once
+            self._check_inputs()
 
         # Shorten parameters for clarity
         N, K, P1, P2, alpha, gamma0 = (self.N, self.K, self.P1, self.P2,
                                        self.alpha, self.gamma0)
 
-        m = np.min(self.obs, axis=0)
-        u_rank = np.zeros(K)
+        if block_size is None:
+            block_size = max(1, 2 ** 24 // K)
 
-        if K > 1:
-            c_rank = np.zeros(K)
+        m = np.min(self.obs, axis=0)
 
-        for j in trange(P2):  # Loop for second level permutations
-            these_perms = np.vstack([self.perms[k, :, np.random.choice(np.arange(P1))]
-                                     for k in range(N)])
-            min_vals = these_perms.min(axis=0)
-            u_rank += m <= min_vals  # Update uncorrected values
+        if n_jobs == 1 and checkpoint is None and random_state is None:
+            u_rank, c_rank = _permutation_ranks(self.perms, m, P2, block_size,
+                                                np.random)
+        else:
+            u_rank, c_rank = self._run_chunks(m, block_size, n_jobs,
+                                              checkpoint, chunk_size,
+                                              random_state)
 
-            if K > 1:  # Update corrected values
-                c_rank += m <= min_vals.max()
+        self.u_rank = u_rank
+        self.c_rank = c_rank
 
         # Calculate statistics!
         # - pu_GN = pvalue uncorrected Global Null,
@@ -170,13 +379,228 @@ class PrevalenceInference(object):
         # Median scores of observed values
         self.score_typical = np.median(self.obs, axis=0)
 
-    def write(self, path):
+    def _run_chunks(self, m, block_size, n_jobs, checkpoint, chunk_size,
+                    random_state):
+        """ Runs independently seeded chunks of second level permutations
+        (in parallel) and sums their ranks; optionally with checkpointing. """
+
+        K, P2 = self.K, self.P2
+        n_chunks = int(np.ceil(P2 / chunk_size))
+        done = np.zeros(n_chunks, dtype=bool)
+        u_rank, c_rank = np.zeros(K), np.zeros(K)
+
+        if checkpoint is not None and not checkpoint.endswith('.npz'):
+            checkpoint += '.npz'
+
+        if checkpoint is not None and op.isfile(checkpoint):
+            ckpt = np.load(checkpoint)
+            params = (int(ckpt['P2']), int(ckpt['K']), int(ckpt['chunk_size']))
+
+            if params != (P2, K, chunk_size):
+                msg = ("Checkpoint %s was created with different parameters "
+                       "(P2, K, chunk_size = %r)!" % (checkpoint, params))
+                raise ValueError(msg)
+
+            seed = int(ckpt['seed'])
+            done, u_rank, c_rank = ckpt['done'], ckpt['u_rank'], ckpt['c_rank']
+            print("Resuming from checkpoint (%i out of %i chunks done)"
+                  % (done.sum(), n_chunks))
+        elif random_state is None:
+            seed = np.random.randint(2 ** 31 - 1)
+        else:
+            seed = random_state
+
+        seeds = np.random.RandomState(seed).randint(2 ** 31 - 1, size=n_chunks)
+        sizes = [min(chunk_size, P2 - i * chunk_size) for i in range(n_chunks)]
+        todo = np.where(~done)[0]
+
+        # Chunks are run in rounds of n_jobs, after which the (additive)
+        # ranks are merged and checkpointed
+        n_round = len(todo) if checkpoint is None else \
+            _effective_n_jobs(n_jobs)
+
+        with Parallel(n_jobs=n_jobs) as parallel:
+
+            for start in tqdm(range(0, len(todo), n_round)):
+                this_round = todo[start:start + n_round]
+                ranks = parallel(delayed(_chunk_ranks)(
+                    self.perms, m, sizes[i], block_size, seeds[i])
+                    for i in this_round)
+
+                for u, c in ranks:
+                    u_rank = u_rank + u
+                    c_rank = c_rank + c
+
+                done[this_round] = True
+
+                if checkpoint is not None:
+                    tmp = checkpoint[:-4] + '_tmp.npz'
+                    np.savez(tmp, u_rank=u_rank, c_rank=c_rank, done=done,
+                             seed=seed, P2=P2, K=K, chunk_size=chunk_size)
+                    os.rename(tmp, checkpoint)  # never a half-written file
+
+        return u_rank, c_rank
+
+    def write(self, path, name='prevalence'):
         """ Writes results from Prevalence Inference procedure to disk.
 
+        Writes a tab-separated file (``name.tsv``) with the statistics per
+        (non-zero) voxel and a numpy file (``name.npz``) with all results,
+        including the ranks and the mask of non-zero voxels. When created
+        with ``from_niftis``, the voxel statistics (pu_GN, pu_MN, gamma0_u,
+        and, if K > 1, pc_GN, pc_MN, gamma0_c) are also written as niftis
+        (``name_stat.nii.gz``).
+
         Parameters
         ----------
         path : str
             Where to write the results to disk
+        name : str
+            Name of the files (without extension).
         """
 
-        pass
+        if self.u_rank is None:
+            raise ValueError("Cannot write results; call run() first!")
+
+        if not op.isdir(path):
+            os.makedirs(path)
+
+        voxel_stats = ['pu_GN', 'pu_MN', 'gamma0_u', 'pc_GN', 'pc_MN',
+                       'gamma0_c', 'score_typical', 'u_rank', 'c_rank']
+        if self.K == 1:  # corrected statistics only exist for K > 1
+            voxel_stats.remove('c_rank')
+
+        voxel_stats = [stat for stat in voxel_stats if hasattr(self, stat)]
+        df = pd.DataFrame({stat: np.atleast_1d(getattr(self, stat))
+                           for stat in voxel_stats}, columns=voxel_stats)
+        df.to_csv(op.join(path, name + '.tsv'), sep='\t', index=False)
+
+        to_save = df.to_dict(orient='list')
+        to_save = {key: np.array(val) for key, val in to_save.items()}
+        to_save['gamma0_max_u'] = self.gamma0_max_u
+
+        if hasattr(self, 'gamma0_max_c'):
+            to_save['gamma0_max_c'] = self.gamma0_max_c
+
+        if self.mask is not None:
+            to_save['mask'] = self.mask
+
+        to_save.update(N=self.N, K=self.K, P1=self.P1, P2=self.P2,
+                       gamma0=self.gamma0, alpha=self.alpha)
+        np.savez(op.join(path, name + '.npz'), **to_save)
+
+        if self.brain_mask is not None:
+            # Voxels in the brain-mask that were kept (i.e. non-zero)
+            vox_idx = np.flatnonzero(self.brain_mask)
+            if self.mask is not None:
+                vox_idx = vox_idx[self.mask]
+
+            for stat in ['pu_GN', 'pu_MN', 'gamma0_u', 'pc_GN', 'pc_MN',
+                         'gamma0_c']:
+
+                if not hasattr(self, stat):
+                    continue
+
+                img = np.zeros(self.brain_mask.shape, dtype=np.float32)
+                img.ravel()[vox_idx] = getattr(self, stat)
+                img = nib.Nifti1Image(img, affine=self.affine)
+                img.to_filename(op.join(path, '%s_%s.nii.gz' % (name, stat)))
+
+
+def _glob_files(files):
+    """ Returns a sorted list of files from a glob-pattern (or list). """
+
+    if isinstance(files, str):
+        files = sorted(glob(files))
+
+        if not files:
+            raise ValueError("Did not find any files!")
+
+    return files
+
+
+def _load_perms(perms, brain_mask):
+    """ Loads the permutation maps of a single subject as a [K x P1] array.
+
+    Parameters
+    ----------
+    perms : str or list
+        Path to 4D nifti, or glob-pattern (or list) of 3D niftis.
+    brain_mask : numpy ndarray
+        Boolean 3D array.
+    """
+
+    if isinstance(perms, str) and not any(c in perms for c in '*?['):
+        return nib.load(perms).get_data()[brain_mask]
+
+    files = _glob_files(perms)
+    these_perms = np.zeros((brain_mask.sum(), len(files)))
+    for i, f in enumerate(files):
+        these_perms[:, i] = nib.load(f).get_data()[brain_mask]
+
+    return these_perms
+
+
+def _chunk_ranks(perms, m, P2, block_size, seed):
+    """ Computes the ranks of a chunk of permutations with its own seed. """
+    return _permutation_ranks(perms, m, P2, block_size,
+                              np.random.RandomState(seed), progress=False)
+
+
+def _permutation_ranks(perms, m, P2, block_size, rng, progress=True):
+    """ Counts how often the observed minimum statistic is <= the
+    permutation minimum statistic, for P2 second level permutations.
+
+    Permutations are drawn and evaluated in blocks of block_size. Per block,
+    one first level permutation is drawn for each subject and permutation
+    (in the same order as drawing them one-by-one), after which the minimum
+    across subjects is updated subject-by-subject (to bound memory).
+
+    Parameters
+    ----------
+    perms : numpy ndarray
+        Array of shape [N x K x P1].
+    m : numpy ndarray
+        Minimum (across subjects) of the observed values, shape [K].
+    P2 : int
+        Number of second level permutations.
+    block_size : int
+        Number of second level permutations per block.
+    rng : numpy RandomState (or the np.random module)
+        Random number generator to draw permutations with.
+    progress : bool
+        Whether to show a progress-bar.
+
+    Returns
+    -------
+    u_rank : numpy ndarray
+        Uncorrected counts, shape [K].
+    c_rank : numpy ndarray
+        Corrected (maximum across voxels) counts, shape [K].
+    """
+
+    N, K, P1 = perms.shape
+    u_rank = np.zeros(K)
+    c_rank = np.zeros(K)
+    m = np.atleast_1d(m)[:, np.newaxis]
+
+    with tqdm(total=P2, disable=not progress) as pbar:
+
+        for start in range(0, P2, block_size):
+            B = min(block_size, P2 - start)
+            idx = rng.randint(0, P1, size=(B, N))
+
+            # Running minimum across subjects, shape [K x B]
+            min_vals = np.take(perms[0], idx[:, 0], axis=1)
+            for k in range(1, N):
+                np.minimum(min_vals, np.take(perms[k], idx[:, k], axis=1),
+                           out=min_vals)
+
+            u_rank += (m <= min_vals).sum(axis=1)  # Update uncorrected values
+
+            if K > 1:  # Update corrected values
+                c_rank += (m <= min_vals.max(axis=0)).sum(axis=1)
+
+            pbar.update(B)
+
+    return u_rank, c_rank
@@ -3,13 +3,15 @@ import os.path as op
 from ...core import MvpBetween
 from ... import testdata_path, roidata_path
 import os
-from ...postproc import MvpResults
+from ...postproc import MvpResults, cross_validate_mvp
+from ...postproc.mvp_results import _forward_mapping
 from sklearn.model_selection import StratifiedKFold
 from sklearn.feature_selection import f_classif, SelectKBest
 from sklearn.svm import SVC
 from sklearn.pipeline import Pipeline
 from sklearn.metrics import accuracy_score, f1_score, roc_auc_score
 import pytest
+import numpy as np
 
 dpath = op.join(testdata_path, 'mock_subjects', 'sub*', 'run1.feat', 'stats')
 bmask = op.join(roidata_path, 'other', 'GrayMatter_prob.nii.gz')
@@ -48,3 +50,64 @@ def test_mvp_results(method):
     for f in ['Contrast1.nii.gz', 'results.tsv', 'confmat.npy']:
         assert(op.isfile(op.join(testdata_path, f)))
         os.remove(op.join(testdata_path, f))
+
+
+@pytest.mark.mvpresults
+@pytest.mark.parametrize("method", ['fwm', 'ufs'])
+def test_mvp_results_online(method):
+
+    pipe = Pipeline([('ufs', SelectKBest(score_func=f_classif, k=100)),
+                     ('clf', SVC(kernel='linear'))])
+
+    # n_iter > number of folds: missing folds count as zeros in both modes
+    results = [MvpResults(mvp=mvp, n_iter=4, feature_scoring=method,
+                          accumulate=acc, accuracy=accuracy_score)
+               for acc in ['full', 'online']]
+
+    folds = StratifiedKFold(n_splits=3)
+    for train_idx, test_idx in folds.split(mvp.X, mvp.y):
+        pipe.fit(mvp.X[train_idx], mvp.y[train_idx])
+        pred = pipe.predict(mvp.X[test_idx])
+        for mvpr in results:
+            mvpr.update(test_idx, pred, pipeline=pipe)
+
+    full, online = [mvpr.compute_scores()[1].get_data() for mvpr in results]
+    assert(np.allclose(full, online, equal_nan=True))
+    assert(not hasattr(results[1], 'voxel_values') or
+           results[1].voxel_values is None)
+
+    with pytest.raises(ValueError):
+        results[1].compute_scores(multiclass='ovo')
+
+
+@pytest.mark.mvpresults
+@pytest.mark.parametrize("method", ['fwm', 'forward'])
+def test_cross_validate_mvp(method):
+
+    pipe = Pipeline([('ufs', SelectKBest(score_func=f_classif, k=100)),
+                     ('clf', SVC(kernel='linear'))])
+    folds = StratifiedKFold(n_splits=3)
+
+    mvpr = MvpResults(mvp=mvp, n_iter=3, feature_scoring=method,
+                      accuracy=accuracy_score)
+    for train_idx, test_idx in folds.split(mvp.X, mvp.y):
+        pipe.fit(mvp.X[train_idx], mvp.y[train_idx])
+        pred = pipe.predict(mvp.X[test_idx])
+        mvpr.update(test_idx, pred, pipeline=pipe)
+
+    mvpr_par = cross_validate_mvp(mvp, pipe, cv=folds, n_jobs=2,
+                                  feature_scoring=method,
+                                  accuracy=accuracy_score)
+    assert(np.allclose(mvpr.accuracy, mvpr_par.accuracy))
+    assert(np.allclose(mvpr.voxel_values, mvpr_par.voxel_values))
+    assert(np.array_equal(mvpr.n_vox, mvpr_par.n_vox))
+
+
+@pytest.mark.mvpresults
+@pytest.mark.parametrize("n_models", [1, 3])
+def test_forward_mapping(n_models):
+
+    rng = np.random.RandomState(0)
+    X = rng.randn(40, 300) + 10
+    W = np.squeeze(rng.randn(300, n_models))
+    assert(np.allclose(_forward_mapping(X, W), np.cov(X.T).dot(W)))
@@ -0,0 +1,64 @@
+from __future__ import absolute_import
+import os.path as op
+import shutil
+import pytest
+import numpy as np
+import nibabel as nib
+from sklearn.feature_selection import f_classif, SelectKBest
+from sklearn.metrics import accuracy_score, f1_score
+from sklearn.model_selection import StratifiedKFold
+from sklearn.pipeline import Pipeline
+from sklearn.svm import SVC
+from ...core import MvpBetween
+from ... import testdata_path, roidata_path
+from ...postproc import PermutationTest
+
+
+@pytest.fixture
+def mvp():
+    source = {'Contrast1': {'path': op.join(testdata_path, 'mock_subjects',
+                                            'sub*', 'run1.feat', 'stats',
+                                            'cope1.nii.gz')}}
+    bmask = op.join(roidata_path, 'other', 'GrayMatter_prob.nii.gz')
+    mvp = MvpBetween(source=source, subject_idf='sub???', mask=bmask)
+    mvp.create()
+    mvp.add_y(op.join(testdata_path, 'sample_behav.tsv'),
+              col_name='var_categorical', index_col=0, remove=999)
+    return mvp
+
+
+@pytest.mark.permutation
+def test_permutation_test(mvp):
+
+    pipe = Pipeline([('ufs', SelectKBest(score_func=f_classif, k=100)),
+                     ('clf', SVC(kernel='linear'))])
+    folds = StratifiedKFold(n_splits=2)
+    out_dir = op.join(testdata_path, 'permutation_test')
+
+    perm = PermutationTest(mvp, pipe, cv=folds, n_permutations=20,
+                           feature_scoring='fwm', fwe=True, random_state=1,
+                           accuracy=accuracy_score, f1=f1_score)
+    df = perm.run()
+    assert(list(df.index) == ['accuracy', 'f1'])
+    assert(perm.null_.shape == (20, 2))
+    assert(((df['p'] > 0) & (df['p'] <= 1)).all())
+    assert(perm.p_fwe_.shape == (mvp.X.shape[1],))
+    assert(perm.p_fwe_.min() >= 1 / 21)
+
+    # Independent seeds per permutation: same results in parallel
+    perm_par = PermutationTest(mvp, pipe, cv=folds, n_permutations=20,
+                               feature_scoring='fwm', fwe=True,
+                               random_state=1, accuracy=accuracy_score,
+                               f1=f1_score)
+    perm_par.run(n_jobs=2)
+    assert(np.allclose(perm.null_.values, perm_par.null_.values))
+    assert(np.allclose(perm.null_max_, perm_par.null_max_))
+
+    perm.write(out_dir)
+    img = nib.load(op.join(out_dir, 'permutation_pfwe.nii.gz')).get_data()
+    assert(np.allclose(img.ravel()[mvp.voxel_idx], perm.p_fwe_))
+    assert(op.isfile(op.join(out_dir, 'permutation.tsv')))
+    shutil.rmtree(out_dir)
+
+    with pytest.raises(ValueError):
+        PermutationTest(mvp, pipe, fwe=True)
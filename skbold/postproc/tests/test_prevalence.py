@@ -1,7 +1,12 @@
 from __future__ import absolute_import
+import os
 import os.path as op
+import shutil
 import pytest
 import numpy as np
+import pandas as pd
+import nibabel as nib
+from ... import testdata_path
 from ...postproc import PrevalenceInference
 
 @pytest.mark.prevalence
@@ -13,3 +18,144 @@ def test_prevalence(K, N=20, P1=100, P2=20000, gamma0=0.5, alpha=0.05):
     pvi = PrevalenceInference(obs=obs, perms=perms, P2=P2, alpha=alpha,
                               gamma0=gamma0)
     pvi.run()
+
+
+@pytest.mark.prevalence
+@pytest.mark.parametrize("block_size", [1, 7, 1000])
+def test_prevalence_block_size(block_size, N=10, K=50, P1=20, P2=300):
+
+    obs = np.random.normal(loc=0.55, scale=0.05, size=(N, K))
+    perms = np.random.normal(loc=0.5, scale=0.05, size=(N, K, P1))
+
+    # Reference: one second level permutation at a time
+    np.random.seed(42)
+    m = obs.min(axis=0)
+    u_rank, c_rank = np.zeros(K), np.zeros(K)
+    for j in range(P2):
+        min_vals = np.vstack([perms[k, :, np.random.choice(np.arange(P1))]
+                              for k in range(N)]).min(axis=0)
+        u_rank += m <= min_vals
+        c_rank += m <= min_vals.max()
+
+    np.random.seed(42)
+    pvi = PrevalenceInference(obs=obs, perms=perms, P2=P2)
+    pvi.run(block_size=block_size)
+    assert(np.array_equal(pvi.pu_GN, (1 + u_rank) / (P2 + 1)))
+    assert(np.array_equal(pvi.pc_GN, (1 + c_rank) / (P2 + 1)))
+
+
+@pytest.mark.prevalence
+def test_prevalence_chunks(N=10, K=50, P1=20, P2=1000):
+
+    obs = np.random.normal(loc=0.55, scale=0.05, size=(N, K))
+    perms = np.random.normal(loc=0.5, scale=0.05, size=(N, K, P1))
+    ckpt = op.join(testdata_path, 'prevalence_ckpt.npz')
+    out_dir = op.join(testdata_path, 'prevalence_test')
+
+    pvi = PrevalenceInference(obs=obs, perms=perms, P2=P2)
+    pvi.run(n_jobs=2, chunk_size=300, random_state=1)
+
+    # A seeded serial run gives the same results as a parallel one
+    pvi_serial = PrevalenceInference(obs=obs, perms=perms, P2=P2)
+    pvi_serial.run(n_jobs=1, chunk_size=300, random_state=1)
+    assert(np.array_equal(pvi.u_rank, pvi_serial.u_rank))
+    assert(np.array_equal(pvi.c_rank, pvi_serial.c_rank))
+    assert(np.array_equal(pvi.pc_GN, pvi_serial.pc_GN))
+
+    pvi_ckpt = PrevalenceInference(obs=obs, perms=perms, P2=P2)
+    pvi_ckpt.run(checkpoint=ckpt, chunk_size=300, random_state=1)
+    assert(np.array_equal(pvi.u_rank, pvi_ckpt.u_rank))
+    assert(np.array_equal(pvi.c_rank, pvi_ckpt.c_rank))
+
+    # All chunks are finished, so the checkpoint (incl. seed) is reused
+    pvi_ckpt = PrevalenceInference(obs=obs, perms=perms, P2=P2)
+    pvi_ckpt.run(checkpoint=ckpt, chunk_size=300, random_state=2)
+    assert(np.array_equal(pvi.u_rank, pvi_ckpt.u_rank))
+
+    with pytest.raises(ValueError):
+        pvi_ckpt.run(checkpoint=ckpt, chunk_size=100)
+
+    pvi.write(out_dir)
+    df = pd.read_csv(op.join(out_dir, 'prevalence.tsv'), sep='\t')
+    assert(df.shape[0] == K)
+    assert(np.allclose(df['pc_GN'], pvi.pc_GN))
+    assert(np.load(op.join(out_dir, 'prevalence.npz'))['mask'].sum() == K)
+
+    os.remove(ckpt)
+    shutil.rmtree(out_dir)
+
+
+@pytest.mark.prevalence
+def test_prevalence_mask_and_mmap(N=10, K=50, P1=20, P2=500):
+
+    obs = np.random.normal(loc=0.55, scale=0.05, size=(N, K))
+    perms = np.random.normal(loc=0.5, scale=0.05, size=(N, K, P1))
+    obs[3, 5], perms[2, 7, 4], perms[8, 9, 0] = 0, np.nan, 0
+    mmap_dir = op.join(testdata_path, 'prevalence_mmap')
+
+    np.random.seed(42)
+    pvi = PrevalenceInference(obs=obs, perms=perms, P2=P2)
+    pvi.run()
+    assert(pvi.K == K - 3)
+    assert(np.array_equal(np.where(~pvi.mask)[0], [5, 7, 9]))
+
+    np.random.seed(42)
+    pvi_mm = PrevalenceInference(obs=obs, perms=perms, P2=P2,
+                                 dtype=np.float32, mmap_dir=mmap_dir)
+    pvi_mm.run(n_jobs=2, chunk_size=100, random_state=1)
+    assert(isinstance(pvi_mm.perms, np.memmap))
+    assert(pvi_mm.perms.dtype == np.float32)
+    assert(pvi_mm.perms.shape == (N, K - 3, P1))
+    assert(np.allclose(pvi_mm.perms, perms[:, pvi.mask, :]))
+
+    del pvi_mm
+    shutil.rmtree(mmap_dir)
+
+
+@pytest.mark.prevalence
+@pytest.mark.parametrize("as_3d", [False, True])
+def test_prevalence_from_niftis(as_3d, N=4, P1=6, P2=200):
+
+    tmp_dir = op.join(testdata_path, 'prevalence_niftis')
+    os.makedirs(tmp_dir)
+    shape, affine = (5, 6, 4), np.eye(4)
+    mask = np.zeros(shape, dtype=bool)
+    mask[1:4, 1:5, 1:3] = True
+    nib.Nifti1Image(mask.astype(np.int16), affine).to_filename(
+        op.join(tmp_dir, 'mask.nii.gz'))
+
+    obs = np.random.normal(loc=0.55, scale=0.05, size=(N,) + shape)
+    perms = np.random.normal(loc=0.5, scale=0.05, size=(N,) + shape + (P1,))
+    perms_files = []
+    for i in range(N):
+        nib.Nifti1Image(obs[i], affine).to_filename(
+            op.join(tmp_dir, 'obs_sub%i.nii.gz' % i))
+
+        if as_3d:
+            for ii in range(P1):
+                nib.Nifti1Image(perms[i, ..., ii], affine).to_filename(
+                    op.join(tmp_dir, 'perm_sub%i_%i.nii.gz' % (i, ii)))
+            perms_files.append(op.join(tmp_dir, 'perm_sub%i_*.nii.gz' % i))
+        else:
+            nib.Nifti1Image(perms[i], affine).to_filename(
+                op.join(tmp_dir, 'perms_sub%i.nii.gz' % i))
+
+    if not as_3d:
+        perms_files = op.join(tmp_dir, 'perms_sub*.nii.gz')
+
+    pvi = PrevalenceInference.from_niftis(
+        obs=op.join(tmp_dir, 'obs_sub*.nii.gz'), perms=perms_files,
+        mask=op.join(tmp_dir, 'mask.nii.gz'), P2=P2,
+        mmap_dir=op.join(tmp_dir, 'mmap'))
+    assert(np.allclose(pvi.obs, obs[:, mask]))
+    assert(np.allclose(pvi.perms, perms[:, mask, :]))
+    assert(isinstance(pvi.perms, np.memmap))
+
+    pvi.run()
+    pvi.write(tmp_dir)
+    img = nib.load(op.join(tmp_dir, 'prevalence_pu_GN.nii.gz')).get_data()
+    assert(np.allclose(img[mask], pvi.pu_GN))
+    assert((img[~mask] == 0).all())
+
+    del pvi
+    shutil.rmtree(tmp_dir)
@@ -3,15 +3,19 @@ The confounds module contains code to handle and account for
 confounds in pattern analyses.
 """
 
+from __future__ import division, print_function, absolute_import
+from builtins import range
+import hashlib
 import numpy as np
 from sklearn.base import BaseEstimator, TransformerMixin
+from ..utils.hashing import _hash_row
 
 
 class ConfoundRegressor(BaseEstimator, TransformerMixin):
     """ Fits a confound onto each feature in X and returns their residuals."""
 
     def __init__(self, confound, X, cross_validate=True, precise=False,
-                 stack_intercept=True):
+                 stack_intercept=True, dtype=None, block_size=10000):
         """ Regresses out a variable (confound) from each feature in X.
 
         Parameters
@@ -35,7 +39,7 @@ class ConfoundRegressor(BaseEstimator, TransformerMixin):
             dataset confound regression" (WDCR) as it does not apply confound
             regression to the *full* dataset, but simply refits the confound
             model on the test-set. We recommend setting this parameter to True.
-        precise: bool
+        precise: bool or str
             Transformer-objects in scikit-learn only allow to pass the data
             (X) and optionally the target (y) to the fit and transform methods.
             However, we need to index the confound accordingly as well. To do so,
@@ -47,8 +51,22 @@ class ConfoundRegressor(BaseEstimator, TransformerMixin):
             by looking at the sum of all the features, which is less accurate, but much
             faster. For dense data, this should work just fine. Also, to aid the
             accuracy, we remove the features which are constant (0) across samples.
+            When setting precise to 'hash', each sample (row) is identified by
+            a hash of its bytes, which are looked up in an index of the rows of
+            self.X (built once), which is both exact and fast (linear in the
+            number of samples). Note that, with this option, identical rows in
+            X are assumed to have identical confound-values.
         stack_intercept : bool
-            Whether to stack an intercept to the confound (default is True)
+            Whether to stack an intercept to the confound (default is True).
+            The intercept is stacked once (the confound itself is not
+            modified), so repeated calls to fit are idempotent.
+        dtype : numpy dtype
+            Dtype of the confound-model and the returned data (e.g.,
+            np.float32 to save memory). If None, the weights are estimated
+            in float64 and the returned data has the dtype of X.
+        block_size : int
+            Number of features (columns) to process at once, which limits
+            the memory needed for intermediate arrays.
 
         Attributes
         ----------
@@ -56,6 +74,11 @@ class ConfoundRegressor(BaseEstimator, TransformerMixin):
             Array with weights for the confound(s)
         nz_idx_ : numpy array
             Array with indices indicating non-zero voxels
+        row_index_ : dict
+            Index mapping row-hashes of X to sample indices (if
+            precise='hash')
+        design_ : numpy array
+            Confound-design (including the intercept, if stacked)
         """
 
         self.confound = confound
@@ -63,9 +86,13 @@ class ConfoundRegressor(BaseEstimator, TransformerMixin):
         self.Xo = X
         self.precise = precise
         self.stack_intercept = stack_intercept
+        self.dtype = dtype
+        self.block_size = block_size
         self.Xo_nz = None
         self.weights_ = None
         self.nz_idx_ = None
+        self.row_index_ = None
+        self.design_ = None
 
     def fit(self, X, y=None):
         """ Fits the confound-regressor to X.
@@ -79,31 +106,27 @@ class ConfoundRegressor(BaseEstimator, TransformerMixin):
             Included for compatibility; does nothing.
         """
 
-        if self.stack_intercept:
-            icept = np.ones(self.confound.shape[0])
-            self.confound = np.c_[icept, self.confound]
+        self._check_init()
+        fit_idx = self._get_sample_idx(X)
 
-        # Find nonzero voxels (i.e., voxels which have not all zero
-        # values across samples)
-        if self.nz_idx_ is None:
-            self.nz_idx_ = np.sum(self.Xo, axis=0) != 0
-            self.Xo_nz = self.Xo[:, self.nz_idx_]
-        
-        X_nz = X[:, self.nz_idx_]
-        confound = self.confound
+        # The (pseudo)inverse of the confound-design only depends on the
+        # samples (i.e., fold), so it is cached and shared by all features.
+        # The cache is created here (not in __init__), so it only helps when
+        # the same object is refit (e.g. with cross_validate=False); clones
+        # (e.g. in cross_val_score) start with an empty cache.
+        if not hasattr(self, '_pinv_cache'):
+            self._pinv_cache = {}
 
-        if self.precise:
-            # Find indices of this X relative to original X (Xo)
-            tmp = np.in1d(self.Xo_nz, X_nz).reshape(self.Xo_nz.shape)
-            fit_idx = tmp.sum(axis=1) == self.Xo_nz.shape[1]
-        else:
-            # Faster than above (but potentially less accurate)
-            fit_idx = np.in1d(self.Xo_nz.sum(axis=1), X_nz.sum(axis=1))
+        pinv = self._get_pinv(fit_idx)
+        nz_cols = np.flatnonzero(self.nz_idx_)
+        self.weights_ = np.zeros((pinv.shape[0], nz_cols.size),
+                                 dtype=pinv.dtype)
 
-        confound_fit = confound[fit_idx, :]
+        for start in range(0, nz_cols.size, self.block_size):
+            block = slice(start, start + self.block_size)
+            X_block = np.asarray(X[:, nz_cols[block]], dtype=pinv.dtype)
+            self.weights_[:, block] = pinv.dot(X_block)
 
-        # Vectorized implementation estimating weights for all features
-        self.weights_ = np.linalg.lstsq(confound_fit, X_nz, rcond=None)[0]
         return self
 
     def transform(self, X):
@@ -125,16 +148,87 @@ class ConfoundRegressor(BaseEstimator, TransformerMixin):
         if not self.cross_validate:
             self.fit(X)
 
+        transform_idx = self._get_sample_idx(X)
+        confound_transform = self.design_[transform_idx].astype(
+            self.weights_.dtype)
+
+        dtype = X.dtype if self.dtype is None else self.dtype
+        X_corr = np.zeros(X.shape, dtype=dtype)
+        nz_cols = np.flatnonzero(self.nz_idx_)
+
+        for start in range(0, nz_cols.size, self.block_size):
+            block = slice(start, start + self.block_size)
+            cols = nz_cols[block]
+            X_corr[:, cols] = X[:, cols] - \
+                confound_transform.dot(self.weights_[:, block])
+
+        return X_corr
+
+    def _check_init(self):
+        """ Sets up the design and non-zero features (once). """
+
+        if self.design_ is None:
+            design = np.asarray(self.confound)
+
+            if design.ndim == 1:
+                design = design[:, np.newaxis]
+
+            if self.stack_intercept:
+                design = np.c_[np.ones(design.shape[0]), design]
+
+            self.design_ = design
+
+        # Find nonzero voxels (i.e., voxels which have not all zero
+        # values across samples)
+        if self.nz_idx_ is None:
+            self.nz_idx_ = np.sum(self.Xo, axis=0) != 0
+
+            if self.precise != 'hash':
+                self.Xo_nz = self.Xo[:, self.nz_idx_]
+
+    def _get_pinv(self, idx):
+        """ Returns the (cached) pseudoinverse of the design of samples idx,
+        which gives the same (least-squares) weights as np.linalg.lstsq. """
+
+        idx = np.asarray(idx)
+        key = hashlib.sha1(idx.tobytes()).hexdigest() + str(idx.dtype)
+
+        if key not in self._pinv_cache:
+            dtype = np.float64 if self.dtype is None else self.dtype
+            pinv = np.linalg.pinv(self.design_[idx].astype(np.float64))
+            self._pinv_cache[key] = pinv.astype(dtype)
+
+        return self._pinv_cache[key]
+
+    def _get_sample_idx(self, X):
+        """ Infers which samples (rows) of the original X (Xo) are in X. """
+
+        if self.precise == 'hash':
+
+            if self.row_index_ is None:
+                self.row_index_ = {}
+                for i, row in enumerate(self.Xo):
+                    self.row_index_.setdefault(_hash_row(row), i)
+
+            # Same dtype as Xo, otherwise the bytes differ
+            X = np.asarray(X, dtype=self.Xo.dtype)
+
+            try:
+                idx = [self.row_index_[_hash_row(row)] for row in X]
+            except KeyError:
+                raise ValueError("Some samples in X do not occur in the X "
+                                 "passed to the ConfoundRegressor!")
+
+            return np.array(idx, dtype=np.int64)
+
         X_nz = X[:, self.nz_idx_]
 
         if self.precise:
+            # Find indices of this X relative to original X (Xo)
             tmp = np.in1d(self.Xo_nz, X_nz).reshape(self.Xo_nz.shape)
-            transform_idx = tmp.sum(axis=1) == self.Xo_nz.shape[1]
+            idx = tmp.sum(axis=1) == self.Xo_nz.shape[1]
         else:
-            transform_idx = np.in1d(self.Xo_nz.sum(axis=1), X_nz.sum(axis=1))
+            # Faster than above (but potentially less accurate)
+            idx = np.in1d(self.Xo_nz.sum(axis=1), X_nz.sum(axis=1))
 
-        confound_transform = self.confound[transform_idx]
-        X_new = X_nz - confound_transform.dot(self.weights_)
-        X_corr = np.zeros_like(X)
-        X_corr[:, self.nz_idx_] = X_new
-        return X_corr
+        return idx
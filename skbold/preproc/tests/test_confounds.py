@@ -0,0 +1,84 @@
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+import pytest
+from sklearn.model_selection import KFold
+from ..confounds import ConfoundRegressor
+
+
+@pytest.mark.parametrize("precise", [False, True, 'hash'])
+def test_confound_regressor(precise):
+
+    rng = np.random.RandomState(0)
+    confound = rng.randn(50)
+    X = rng.randn(50, 20) + confound[:, np.newaxis]
+    X[:, 3] = 0  # constant feature
+
+    for train, test in KFold(n_splits=5).split(X):
+        cr = ConfoundRegressor(confound=confound, X=X, precise=precise)
+        X_train = cr.fit_transform(X[train])
+        X_test = cr.transform(X[test])
+
+        # Reference: confound-model fit on the train-set only
+        C = np.c_[np.ones(50), confound]
+        W = np.linalg.lstsq(C[train], X[train], rcond=None)[0]
+        assert(np.allclose(X_train, X[train] - C[train].dot(W)))
+        assert(np.allclose(X_test, X[test] - C[test].dot(W)))
+
+
+def test_confound_regressor_hash():
+
+    rng = np.random.RandomState(0)
+    confound = rng.randn(50, 2)
+    X = rng.randn(50, 20)
+    cr = ConfoundRegressor(confound=confound, X=X, precise='hash')
+
+    # Sample-order of X does not matter
+    idx = rng.permutation(50)[:30]
+    assert(np.array_equal(cr._get_sample_idx(X[idx]), idx))
+
+    # Nor does its dtype (e.g., upcasted float32 data)
+    cr = ConfoundRegressor(confound=confound, X=X.astype(np.float32),
+                           precise='hash')
+    X_64 = X[idx].astype(np.float32).astype(np.float64)
+    assert(np.array_equal(cr._get_sample_idx(X_64), idx))
+
+    with pytest.raises(ValueError):
+        cr.fit(rng.randn(10, 20))
+
+
+def test_confound_regressor_blocks_and_dtype():
+
+    rng = np.random.RandomState(0)
+    confound = rng.randn(40, 2)
+    X = rng.randn(40, 25) + confound[:, :1]
+    train, test = np.arange(30), np.arange(30, 40)
+
+    cr = ConfoundRegressor(confound=confound, X=X)
+    cr.fit(X[train])
+    weights, X_test = cr.weights_.copy(), cr.transform(X[test])
+
+    # Refitting does not stack the intercept again
+    cr.fit(X[train])
+    assert(cr.design_.shape == (40, 3))
+    assert(np.array_equal(cr.confound, confound))
+    assert(np.allclose(cr.weights_, weights))
+
+    cr_block = ConfoundRegressor(confound=confound, X=X, block_size=4)
+    assert(np.allclose(cr_block.fit(X[train]).transform(X[test]), X_test))
+
+    cr_32 = ConfoundRegressor(confound=confound, X=X, dtype=np.float32)
+    X_test_32 = cr_32.fit(X[train]).transform(X[test])
+    assert(X_test_32.dtype == np.float32)
+    assert(np.allclose(X_test_32, X_test, atol=1e-5))
+
+    # Without cross-validation, the pseudoinverse is cached per fold
+    cr_ncv = ConfoundRegressor(confound=confound, X=X, cross_validate=False)
+    cr_ncv.fit_transform(X[train])
+    cr_ncv.transform(X[test])
+    cr_ncv.transform(X[test])
+    assert(len(cr_ncv._pinv_cache) == 2)
+
+    # The cache is created when fitting, not in __init__
+    assert(not hasattr(ConfoundRegressor(confound=confound, X=X),
+                       '_pinv_cache'))
@@ -10,8 +10,10 @@ the `load_roi_mask` function allows for loading ROIs from the
 Harvard-Oxford (sub)cortical atlas. This function is also
 integrated in the `RoiIndexer` transformer.from
 
-Lastly, the `ArrayPermuter`, `RowIndexer`, and `SelectFeatureset`
+The `ArrayPermuter`, `RowIndexer`, and `SelectFeatureset`
 transformers can be used in, for example. permutation analyses.
+Lastly, `get_neighbourhoods` computes (sparse) sphere-neighbourhoods of
+voxels, e.g. for searchlight analyses.
 """
 
 from .sort_numbered_list import sort_numbered_list
@@ -19,7 +21,9 @@ from .crossval_splitter import CrossvalSplitter
 from .parse_roi_labels import parse_roi_labels
 from .load_roi_mask import load_roi_mask, print_mask_options
 from .misc_transformers import ArrayPermuter, RowIndexer, SelectFeatureset
+from .neighbourhood import get_neighbourhoods
 
 __all__ = ['sort_numbered_list', 'CrossvalSplitter',
            'parse_roi_labels', 'print_mask_options',
-           'ArrayPermuter', 'RowIndexer', 'SelectFeatureset']
+           'ArrayPermuter', 'RowIndexer', 'SelectFeatureset',
+           'get_neighbourhoods']
@@ -0,0 +1,14 @@
+# Helpers to identify samples (rows) of arrays by their contents.
+
+# Author: Lukas Snoek [lukassnoek.github.io]
+# Contact: lukassnoek@gmail.com
+# License: 3 clause BSD
+
+from __future__ import division, print_function, absolute_import
+import hashlib
+import numpy as np
+
+
+def _hash_row(row):
+    """ Hashes the bytes of a sample (row). """
+    return hashlib.sha1(np.ascontiguousarray(row).tobytes()).digest()
@@ -5,14 +5,23 @@
 from __future__ import absolute_import, division, print_function
 import numpy as np
 from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.utils import check_random_state
 
 
 class ArrayPermuter(BaseEstimator, TransformerMixin):
-    """ Permutes (shuffles) rows of matrix. """
+    """ Permutes (shuffles) rows of matrix.
 
-    def __init__(self):
+    Parameters
+    ----------
+    random_state : None, int, or RandomState
+        Random state used for the permutations (see sklearn's
+        ``check_random_state``). If None, the global numpy random state is
+        used; if an int, the same permutation is used for every call.
+    """
+
+    def __init__(self, random_state=None):
         """ Initializes ArrayPermuter object. """
-        pass
+        self.random_state = random_state
 
     def fit(self, X=None, y=None):
         """ Does nothing, but included to be used in sklearn's Pipeline. """
@@ -32,7 +41,7 @@ class ArrayPermuter(BaseEstimator, TransformerMixin):
             ndarray with permuted rows
 
         """
-        return np.random.permutation(X)
+        return check_random_state(self.random_state).permutation(X)
 
 
 class RowIndexer(object):
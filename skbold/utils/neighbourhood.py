@@ -0,0 +1,194 @@
+# Functions to compute (sphere) neighbourhoods of voxels, e.g. for
+# searchlight analyses, which are optionally cached on disk.
+
+# Author: Lukas Snoek [lukassnoek.github.io]
+# Contact: lukassnoek@gmail.com
+# License: 3 clause BSD
+
+from __future__ import division, print_function, absolute_import
+from builtins import range
+import os
+import os.path as op
+import hashlib
+import numpy as np
+from scipy.sparse import csr_matrix
+from ..core.cache import get_cache_dir
+
+
+def get_neighbourhoods(voxel_idx, affine, data_shape, radius, cache=None):
+    """ Computes, for each voxel, its neighbours within a sphere.
+
+    Neighbourhoods are computed with an 'offset stencil': all voxel-offsets
+    within the (largest) radius are computed once (in world coordinates,
+    using the affine), after which the neighbours of all voxels are looked up
+    offset-by-offset. Multiple radii are derived from a single computation.
+
+    The neighbourhoods can be cached on disk, under a key which is a hash of
+    the voxels (voxel_idx), affine, data_shape and radius, such that repeated
+    analyses with the same mask load them instead of recomputing them.
+
+    Parameters
+    ----------
+    voxel_idx : ndarray
+        Indices of the voxels (in the flattened data_shape), e.g.
+        ``mvp.voxel_idx``.
+    affine : ndarray
+        Affine (4 x 4) of the data; the radius is in world units (mm).
+    data_shape : tuple
+        Shape of the (3D) data.
+    radius : int, float, or list
+        Radius (or list of radii) of the spheres.
+    cache : None, bool, or str
+        If None, the neighbourhoods are cached only when the environment
+        variable ``SKBOLD_CACHE_DIR`` is set (in its 'neighbourhoods'
+        subdirectory). If True, that directory is required. If False, no
+        cache is used. If a str, it is used as cache-directory.
+
+    Returns
+    -------
+    neighbourhoods : scipy.sparse.csr_matrix (or list of csr_matrices)
+        Sparse (boolean) matrix of shape [n_voxels, n_voxels], in which row i
+        indicates the neighbours of voxel i (i.e., ``voxel_idx[i]``), in
+        terms of indices of voxel_idx (i.e., columns of X). If radius is a
+        list, a list with a matrix per radius is returned.
+    """
+
+    radii = radius if isinstance(radius, (list, tuple)) else [radius]
+    voxel_idx = np.asarray(voxel_idx)
+    data_shape = tuple(data_shape[:3])
+
+    if cache is None:
+        cache = get_cache_dir('neighbourhoods')
+    elif cache is True:
+        cache = get_cache_dir('neighbourhoods')
+        if cache is None:
+            raise ValueError("cache=True, but SKBOLD_CACHE_DIR is not set!")
+
+    if cache:
+        keys = [_neighbourhood_key(voxel_idx, affine, data_shape, r)
+                for r in radii]
+        cached = [_load_neighbourhood(cache, key) for key in keys]
+    else:
+        cached = [None] * len(radii)
+
+    to_compute = [r for r, nbh in zip(radii, cached) if nbh is None]
+    if to_compute:
+        computed = iter(_compute_neighbourhoods(voxel_idx, affine,
+                                                data_shape, to_compute))
+
+    neighbourhoods = []
+    for i, nbh in enumerate(cached):
+
+        if nbh is None:
+            nbh = next(computed)
+
+            if cache:
+                _save_neighbourhood(cache, keys[i], nbh)
+
+        neighbourhoods.append(nbh)
+
+    if not isinstance(radius, (list, tuple)):
+        neighbourhoods = neighbourhoods[0]
+
+    return neighbourhoods
+
+
+def _compute_neighbourhoods(voxel_idx, affine, data_shape, radii):
+    """ Computes the neighbourhoods (list of csr_matrices) for all radii
+    with an offset stencil. """
+
+    n_vox = voxel_idx.size
+    offsets, dists = _get_offsets(affine, max(radii))
+
+    # Maps (flattened) brain-indices to indices of voxel_idx (-1 = not in it)
+    lookup = np.full(int(np.prod(data_shape)), -1, dtype=np.int64)
+    lookup[voxel_idx] = np.arange(n_vox)
+    ijk = np.column_stack(np.unravel_index(voxel_idx, data_shape))
+
+    rows, cols, row_dists = [], [], []
+    for offset, dist in zip(offsets, dists):
+        nb = ijk + offset
+        inside = ((nb >= 0) & (nb < data_shape)).all(axis=1)
+        nb_idx = np.full(n_vox, -1, dtype=np.int64)
+        nb_idx[inside] = lookup[np.ravel_multi_index(nb[inside].T,
+                                                     data_shape)]
+        valid = np.flatnonzero(nb_idx >= 0)
+        rows.append(valid)
+        cols.append(nb_idx[valid])
+        row_dists.append(np.full(valid.size, dist))
+
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    row_dists = np.concatenate(row_dists)
+
+    neighbourhoods = []
+    for r in radii:
+        within = row_dists <= r + 1e-6
+        nbh = csr_matrix((np.ones(within.sum(), dtype=bool),
+                          (rows[within], cols[within])),
+                         shape=(n_vox, n_vox))
+        nbh.sort_indices()
+        neighbourhoods.append(nbh)
+
+    return neighbourhoods
+
+
+def _neighbourhood_key(voxel_idx, affine, data_shape, radius):
+    """ Computes the cache-key (sha1-hash) of a neighbourhood. """
+
+    sha1 = hashlib.sha1()
+    sha1.update(np.ascontiguousarray(voxel_idx, dtype=np.int64).tobytes())
+    sha1.update(np.ascontiguousarray(affine, dtype=np.float64).tobytes())
+    sha1.update(('%r_%r' % (tuple(int(d) for d in data_shape),
+                            float(radius))).encode('utf-8'))
+
+    return sha1.hexdigest()
+
+
+def _load_neighbourhood(cache_dir, key):
+    """ Loads a cached neighbourhood (or returns None if not cached). """
+
+    path = op.join(cache_dir, key + '.npz')
+
+    if not op.isfile(path):
+        return None
+
+    f = np.load(path)
+    return csr_matrix((np.ones(f['indices'].size, dtype=bool), f['indices'],
+                       f['indptr']), shape=tuple(f['shape']))
+
+
+def _save_neighbourhood(cache_dir, key, nbh):
+    """ Stores a neighbourhood (its CSR-arrays) in the cache. """
+
+    if not op.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    path = op.join(cache_dir, key + '.npz')
+    tmp = path + '.tmp%i' % os.getpid()
+
+    with open(tmp, 'wb') as f:
+        np.savez(f, indptr=nbh.indptr, indices=nbh.indices,
+                 shape=np.array(nbh.shape))
+
+    os.rename(tmp, path)  # atomic; avoids half-written cache entries
+
+
+def _get_offsets(affine, radius):
+    """ Returns all voxel-offsets (and their distance) within radius. """
+
+    M = np.asarray(affine)[:3, :3]
+
+    # |M.dot(d)| >= smallest singular value * |d|, so this bounds the offsets
+    min_sv = np.linalg.svd(M, compute_uv=False).min()
+    n = int(np.ceil(radius / min_sv))
+
+    grid = np.arange(-n, n + 1)
+    offsets = np.array(np.meshgrid(grid, grid, grid, indexing='ij'))
+    offsets = offsets.reshape((3, -1)).T
+    dists = np.sqrt((offsets.dot(M.T) ** 2).sum(axis=1))
+
+    # Small tolerance, as radii are often exact multiples of the voxel-size
+    within = dists <= radius + 1e-6
+    order = np.argsort(dists[within], kind='mergesort')
+
+    return offsets[within][order], dists[within][order]
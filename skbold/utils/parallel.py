@@ -0,0 +1,17 @@
+# Helpers for parallel (joblib) computations.
+
+# Author: Lukas Snoek [lukassnoek.github.io]
+# Contact: lukassnoek@gmail.com
+# License: 3 clause BSD
+
+from __future__ import division, print_function, absolute_import
+from multiprocessing import cpu_count
+
+
+def _effective_n_jobs(n_jobs):
+    """ Translates joblib-style (negative) n_jobs to a number of workers. """
+
+    if n_jobs < 0:
+        n_jobs = max(cpu_count() + 1 + n_jobs, 1)
+
+    return n_jobs
@@ -28,6 +28,13 @@ def test_array_permuter():
     transf.fit(mvp_within.X, mvp_within.y)
     transf.transform(mvp_within.X)
 
+    X_perm = ArrayPermuter(random_state=42).transform(mvp_within.X)
+    assert(np.array_equal(X_perm,
+                          ArrayPermuter(random_state=42).transform(
+                              mvp_within.X)))
+    assert(np.allclose(np.sort(X_perm, axis=0),
+                       np.sort(mvp_within.X, axis=0)))
+
 
 @pytest.mark.transformer
 def test_row_indexer():
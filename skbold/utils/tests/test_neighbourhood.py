@@ -0,0 +1,64 @@
+from __future__ import absolute_import, division, print_function
+
+import os
+import os.path as op
+import shutil
+import numpy as np
+import pytest
+from ... import testdata_path
+from ..neighbourhood import get_neighbourhoods
+
+affines = [np.diag([2, 2, 2, 1]),
+           np.array([[-3, 0.2, 0, 90], [0.1, 3, 0.3, -126],
+                     [0, -0.2, 3.3, -72], [0, 0, 0, 1]])]
+
+
+@pytest.mark.parametrize("affine", affines)
+def test_get_neighbourhoods(affine):
+
+    data_shape = (10, 12, 9)
+    rng = np.random.RandomState(0)
+    voxel_idx = np.sort(rng.choice(np.prod(data_shape), 600, replace=False))
+    radii = [0, 4, 6.5]
+
+    nbhs = get_neighbourhoods(voxel_idx, affine, data_shape, radii)
+    assert(len(nbhs) == len(radii))
+
+    # Brute-force distances between all voxels (in world coordinates)
+    ijk = np.column_stack(np.unravel_index(voxel_idx, data_shape))
+    xyz = ijk.dot(affine[:3, :3].T)
+    dists = np.sqrt(((xyz[:, np.newaxis] - xyz[np.newaxis]) ** 2).sum(-1))
+
+    for r, nbh in zip(radii, nbhs):
+        assert(nbh.shape == (voxel_idx.size, voxel_idx.size))
+        assert(np.array_equal(nbh.toarray(), dists <= r + 1e-6))
+
+    nbh = get_neighbourhoods(voxel_idx, affine, data_shape, 4)
+    assert((nbh != nbhs[1]).nnz == 0)
+
+
+def test_get_neighbourhoods_cache():
+
+    cache_dir = op.join(testdata_path, 'nbh_cache')
+    data_shape, affine = (10, 12, 9), affines[1]
+    voxel_idx = np.arange(0, np.prod(data_shape), 2)
+
+    nbhs = get_neighbourhoods(voxel_idx, affine, data_shape, [3, 6],
+                              cache=cache_dir)
+    assert(len(os.listdir(cache_dir)) == 2)
+
+    # Only the new radius is computed and added to the cache
+    cached = get_neighbourhoods(voxel_idx, affine, data_shape, [6, 9],
+                                cache=cache_dir)
+    assert(len(os.listdir(cache_dir)) == 3)
+    assert((cached[0] != nbhs[1]).nnz == 0)
+    assert(cached[0].dtype == bool)
+
+    # Different voxels yield a different key
+    get_neighbourhoods(voxel_idx[1:], affine, data_shape, 3, cache=cache_dir)
+    assert(len(os.listdir(cache_dir)) == 4)
+
+    nbh = get_neighbourhoods(voxel_idx, affine, data_shape, 9, cache=False)
+    assert((nbh != cached[1]).nnz == 0)
+
+    shutil.rmtree(cache_dir)